@@ -0,0 +1,266 @@
+# backtest.py
+"""
+Vectorized intraday backtest of gap-day strategies over stored 1-minute bars.
+
+The regular session (09:30 onwards) of every gap day is loaded once into (days x minutes)
+matrices, NaN where a minute has no bar. A parameter set (entry rule, stop, target, time exit,
+side) is then evaluated for all days at once with array operations: entry, stop and target
+bars are the first True column of a boolean mask. Parameter sweeps are split across a process
+pool whose workers each receive the matrices once.
+
+Fills are conservative: a stop and a target hit in the same bar count as the stop, a stop
+gapped through fills at the bar's open, and costs are charged per round trip.
+"""
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analysis.intraday import fetch_session_bars
+from market_data.scheduler import run_concurrently
+from market_data.trading_calendar import MARKET_OPEN_MINUTE, MS_PER_MINUTE, format_minute, session_boundaries
+
+# Minutes of a full regular session; early closes leave the later columns empty
+SESSION_MINUTES = 390
+
+ENTRY_RULES = ('market', 'retest_high')
+SIDES = ('short', 'long')
+EXIT_REASONS = ('stop', 'target', 'time')
+
+DEFAULT_PARAMS = {
+    'entry': 'market',      # 'market': at the open of the entry_minute bar; 'retest_high': when price
+                            # returns to the high of the first entry_minute minutes
+    'entry_minute': 0,      # Minutes after 09:30
+    'stop_percent': 20.0,   # Adverse move from the entry price that stops the trade out; 0 = none
+    'target_percent': 0.0,  # Favorable move that takes profit; 0 = none
+    'exit_minute': 390,     # Time exit: close of the bar before this minute after 09:30
+    'side': 'short',
+    'cost_percent': 0.0,    # Round-trip costs, in percent of the entry price
+}
+
+# Session matrices of the current sweep worker process, see _init_worker
+_worker_session = None
+
+
+def load_sessions(polygon_client, gap_days, max_workers=1):
+    """
+    Loads the regular-session 1-minute bars of gap days into matrices.
+
+    Args:
+        polygon_client: The initialized Polygon.io client (bars come from the bar cache or flat-file store).
+        gap_days (list): Dicts with at least 'ticker' and 'date'; other keys are kept as day columns.
+        max_workers (int): Gap days fetched concurrently.
+
+    Returns:
+        dict: 'days' (pd.DataFrame, one row per loaded day in date order), 'open', 'high', 'low' and
+              'close' (float arrays of shape (days, SESSION_MINUTES)), 'minutes' (regular-session
+              length per day), plus the derived 'close_ffill' (last close so far), 'running_high' and
+              'next_bar' (index of the first bar at or after each minute, SESSION_MINUTES if none).
+              Days whose bars could not be fetched or that have none are left out.
+    """
+    import pandas as pd
+    gap_days = sorted(gap_days, key=lambda gap_day: (gap_day['date'], gap_day['ticker']))
+    bars_list = run_concurrently(lambda gap_day: fetch_session_bars(polygon_client, gap_day['ticker'], gap_day['date']),
+                                 gap_days, max_workers)
+
+    loaded = [(gap_day, bars) for gap_day, bars in zip(gap_days, bars_list) if bars is not None and len(bars)]
+    shape = (len(loaded), SESSION_MINUTES)
+    matrices = {field: np.full(shape, np.nan) for field in ('open', 'high', 'low', 'close')}
+    minutes = np.zeros(len(loaded), dtype=np.int64)
+    for row, (gap_day, bars) in enumerate(loaded):
+        boundaries = session_boundaries(gap_day['date'])
+        regular = bars.window(boundaries['market_open'], boundaries['market_close'])
+        columns = (regular.timestamp - boundaries['market_open']) // MS_PER_MINUTE
+        for field, matrix in matrices.items():
+            matrix[row, columns] = getattr(regular, field)
+        minutes[row] = (boundaries['market_close'] - boundaries['market_open']) // MS_PER_MINUTE
+
+    session = {'days': pd.DataFrame([gap_day for gap_day, _ in loaded]), 'minutes': minutes, **matrices}
+    positions = np.broadcast_to(np.arange(SESSION_MINUTES), shape)
+    has_bar = ~np.isnan(matrices['close'])
+    last_bar = np.maximum.accumulate(np.where(has_bar, positions, -1), axis=1)
+    session['close_ffill'] = np.where(last_bar >= 0, np.take_along_axis(matrices['close'], np.maximum(last_bar, 0),
+                                                                        axis=1), np.nan)
+    session['running_high'] = np.fmax.accumulate(matrices['high'], axis=1)
+    session['next_bar'] = np.minimum.accumulate(np.where(has_bar, positions, SESSION_MINUTES)[:, ::-1], axis=1)[:, ::-1]
+    return session
+
+
+def _first_true(mask):
+    """Returns the first True column of each row, SESSION_MINUTES where there is none."""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), SESSION_MINUTES)
+
+
+def _take(matrix, columns):
+    """Picks one column per row; NaN where the column is out of range."""
+    valid = columns < matrix.shape[1]
+    values = np.take_along_axis(matrix, np.minimum(columns, matrix.shape[1] - 1)[:, None], axis=1)[:, 0]
+    return np.where(valid, values, np.nan)
+
+
+def simulate(session, params):
+    """
+    Evaluates one parameter set on every loaded day at once.
+
+    Args:
+        session (dict): As returned by load_sessions.
+        params (dict): Overrides of DEFAULT_PARAMS.
+
+    Returns:
+        dict: Per-day arrays: 'entered' (bool), 'entry_index' and 'exit_index' (minutes after 09:30),
+              'entry_price', 'exit_price', 'exit_reason' (index into EXIT_REASONS, -1 without a
+              trade) and 'return_percent' (NaN without a trade).
+    """
+    params = {**DEFAULT_PARAMS, **params}
+    if params['entry'] not in ENTRY_RULES:
+        raise ValueError(f"Unknown entry rule '{params['entry']}'. Use one of: {', '.join(ENTRY_RULES)}.")
+    if params['side'] not in SIDES:
+        raise ValueError(f"Unknown side '{params['side']}'. Use one of: {', '.join(SIDES)}.")
+    entry_minute = int(params['entry_minute'])
+    if params['entry'] == 'retest_high' and entry_minute < 1:
+        raise ValueError("The retest_high entry needs an entry_minute of at least 1.")
+
+    opens, highs, lows = session['open'], session['high'], session['low']
+    short = params['side'] == 'short'
+    columns = np.arange(SESSION_MINUTES)
+    last_index = np.minimum(int(params['exit_minute']), session['minutes']) - 1
+
+    if entry_minute >= SESSION_MINUTES:
+        entry_index = np.full(len(opens), SESSION_MINUTES)
+        entry_price = np.full(len(opens), np.nan)
+    elif params['entry'] == 'market':
+        entry_index = session['next_bar'][:, entry_minute]
+        entry_price = _take(opens, entry_index)
+    else:
+        level = session['running_high'][:, entry_minute - 1]
+        entry_index = _first_true((columns >= entry_minute) & (highs >= level[:, None]))
+        # A limit short (or buy stop) at the level fills at the open when the bar opens beyond it
+        entry_price = np.fmax(_take(opens, entry_index), level)
+    entered = (entry_index <= last_index) & ~np.isnan(entry_price)
+
+    in_trade = (columns >= entry_index[:, None]) & (columns <= last_index[:, None])
+    direction = -1.0 if short else 1.0
+    stop_index = np.full(len(opens), SESSION_MINUTES)
+    target_index = np.full(len(opens), SESSION_MINUTES)
+    stop_price = entry_price * (1 - direction * params['stop_percent'] / 100)
+    target_price = entry_price * (1 + direction * params['target_percent'] / 100)
+    if params['stop_percent'] > 0:
+        stop_index = _first_true(in_trade & ((highs >= stop_price[:, None]) if short else (lows <= stop_price[:, None])))
+    if params['target_percent'] > 0:
+        target_index = _first_true(in_trade & ((lows <= target_price[:, None]) if short
+                                               else (highs >= target_price[:, None])))
+
+    stopped = stop_index <= np.minimum(target_index, last_index)
+    targeted = ~stopped & (target_index <= last_index)
+    # A stop gapped through on a later bar fills at that bar's open
+    stop_open = _take(opens, stop_index)
+    gapped = stop_index > entry_index
+    stop_fill = np.where(gapped, np.fmax(stop_price, stop_open) if short else np.fmin(stop_price, stop_open),
+                         stop_price)
+    exit_index = np.where(stopped, stop_index, np.where(targeted, target_index, last_index))
+    exit_price = np.where(stopped, stop_fill, np.where(targeted, target_price, _take(session['close_ffill'],
+                                                                                     np.maximum(last_index, 0))))
+    exit_reason = np.where(stopped, 0, np.where(targeted, 1, 2))
+
+    return_percent = direction * (exit_price / entry_price - 1) * 100 - params['cost_percent']
+    return {
+        'entered': entered,
+        'entry_index': entry_index,
+        'entry_price': entry_price,
+        'exit_index': exit_index,
+        'exit_price': exit_price,
+        'exit_reason': np.where(entered, exit_reason, -1),
+        'return_percent': np.where(entered, return_percent, np.nan),
+    }
+
+
+def summarize(result):
+    """
+    Aggregates the trades of one simulation, in date order.
+
+    Returns:
+        dict: trades, win_rate and stop_rate / target_rate (percent of trades), avg/median/total
+              return (percent), profit_factor (gross wins over gross losses) and max_drawdown
+              (largest fall of the cumulative return, in percent points).
+    """
+    returns = result['return_percent'][result['entered']]
+    reasons = result['exit_reason'][result['entered']]
+    if not len(returns):
+        return {'trades': 0, 'win_rate': None, 'avg_return': None, 'median_return': None, 'total_return': 0.0,
+                'profit_factor': None, 'max_drawdown': 0.0, 'stop_rate': None, 'target_rate': None}
+    gains = returns[returns > 0].sum()
+    losses = -returns[returns < 0].sum()
+    equity = np.cumsum(returns)
+    return {
+        'trades': int(len(returns)),
+        'win_rate': float(np.mean(returns > 0) * 100),
+        'avg_return': float(returns.mean()),
+        'median_return': float(np.median(returns)),
+        'total_return': float(equity[-1]),
+        'profit_factor': float(gains / losses) if losses > 0 else None,
+        'max_drawdown': float(np.max(np.maximum.accumulate(np.r_[0.0, equity]) - np.r_[0.0, equity])),
+        'stop_rate': float(np.mean(reasons == 0) * 100),
+        'target_rate': float(np.mean(reasons == 1) * 100),
+    }
+
+
+def trade_frame(session, result):
+    """
+    Lists the trades of one simulation.
+
+    Returns:
+        pd.DataFrame: One row per trade: the day columns plus entry/exit time (HH:MM), price,
+                      exit reason and return percent.
+    """
+    entered = result['entered']
+    trades = session['days'][entered].reset_index(drop=True)
+    trades['entry time'] = [format_minute(MARKET_OPEN_MINUTE + int(index)) for index in result['entry_index'][entered]]
+    trades['entry price'] = result['entry_price'][entered]
+    trades['exit time'] = [format_minute(MARKET_OPEN_MINUTE + int(index)) for index in result['exit_index'][entered]]
+    trades['exit price'] = result['exit_price'][entered]
+    trades['exit reason'] = [EXIT_REASONS[reason] for reason in result['exit_reason'][entered]]
+    trades['return %'] = result['return_percent'][entered]
+    return trades
+
+
+def parameter_grid(**choices):
+    """
+    Builds every combination of parameter choices, e.g.
+    parameter_grid(entry_minute=[0, 30], stop_percent=[10, 20]) -> 4 parameter sets.
+    """
+    names = list(choices)
+    return [dict(zip(names, values)) for values in itertools.product(*(choices[name] for name in names))]
+
+
+def _init_worker(session):
+    global _worker_session
+    _worker_session = session
+
+
+def _summarize_chunk(param_sets):
+    return [summarize(simulate(_worker_session, params)) for params in param_sets]
+
+
+def run_sweep(session, param_sets, processes=1, chunk_size=8):
+    """
+    Evaluates many parameter sets, on a process pool when processes > 1.
+
+    Args:
+        session (dict): As returned by load_sessions.
+        param_sets (list): Parameter dicts, e.g. from parameter_grid.
+        processes (int): Worker processes; each receives the session matrices once.
+        chunk_size (int): Parameter sets per task.
+
+    Returns:
+        list: One summarize dict per parameter set, merged with its full parameters, in input order.
+    """
+    param_sets = [{**DEFAULT_PARAMS, **params} for params in param_sets]
+    if processes <= 1 or len(param_sets) <= chunk_size:
+        summaries = [summarize(simulate(session, params)) for params in param_sets]
+    else:
+        # Session matrices are read only: drop the per-day frame the workers do not need
+        matrices = {name: value for name, value in session.items() if name != 'days'}
+        chunks = [param_sets[start:start + chunk_size] for start in range(0, len(param_sets), chunk_size)]
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(matrices,)) as executor:
+            summaries = [summary for chunk in executor.map(_summarize_chunk, chunks) for summary in chunk]
+    return [{**params, **summary} for params, summary in zip(param_sets, summaries)]
@@ -0,0 +1,108 @@
+# gap_scan.py
+"""
+Vectorized gap-up scan over a daily bar series.
+
+The daily aggregates are loaded once into columnar arrays; gap %, day high %, closing %
+and the Runner/Fader label are computed with array operations and qualifying days are
+selected with a boolean mask, so only those rows go on to intraday enrichment.
+"""
+import numpy as np
+import pandas as pd
+
+from market_data.bars import BarArray
+from market_data.trading_calendar import local_dates
+
+DAILY_COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+
+def daily_aggs_to_frame(aggs_list):
+    """
+    Loads daily bar aggregates into a columnar DataFrame.
+
+    Args:
+        aggs_list (BarArray or iterable): Daily bars in ascending time order, as a BarArray or as
+                                          Agg objects.
+
+    Returns:
+        pd.DataFrame: One float column per field in DAILY_COLUMNS (timestamp as int64 ms).
+    """
+    bars = aggs_list if isinstance(aggs_list, BarArray) else BarArray.from_aggs(aggs_list)
+    return pd.DataFrame({field: getattr(bars, field) for field in DAILY_COLUMNS})
+
+
+def session_dates(timestamps):
+    """
+    Converts daily bar timestamps (UTC ms) to their session dates.
+
+    Returns:
+        pd.Series: 'YYYY-MM-DD' strings in the America/New_York timezone.
+    """
+    timestamps = pd.Series(timestamps)
+    return pd.Series(local_dates(timestamps.to_numpy(dtype='int64')), index=timestamps.index)
+
+
+def last_finished_session(daily_df, today):
+    """
+    Returns the date of the last bar in a daily series that is before today, or None.
+
+    Args:
+        daily_df (pd.DataFrame): Daily bars as returned by daily_aggs_to_frame.
+        today (str): Today's date, 'YYYY-MM-DD'.
+    """
+    finished = [date_str for date_str in session_dates(daily_df['timestamp'].tail(2)) if date_str < today]
+    return finished[-1] if finished else None
+
+
+def scan_gap_days(daily_df, gap_threshold):
+    """
+    Selects the days that gapped up by at least gap_threshold percent over the previous close.
+
+    Args:
+        daily_df (pd.DataFrame): Daily bars as returned by daily_aggs_to_frame. A single ticker's
+                                 series takes the previous close from the preceding row; frames
+                                 covering many tickers must carry their own previous_close and
+                                 ticker columns.
+        gap_threshold (float): Minimum gap up at the open, in percent.
+
+    Returns:
+        pd.DataFrame: One row per qualifying day with date, previous_close, open, high, close,
+                      volume, gap_up_percent, day_high_percent, closing_percent and runner_fader
+                      (plus ticker when the input has one).
+    """
+    open_ = daily_df['open'].to_numpy()
+    high = daily_df['high'].to_numpy()
+    close = daily_df['close'].to_numpy()
+
+    if 'previous_close' in daily_df.columns:
+        previous_close = daily_df['previous_close'].to_numpy()
+    else:
+        previous_close = np.empty_like(close)
+        previous_close[:1] = np.nan
+        previous_close[1:] = close[:-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gap_up_percent = ((open_ - previous_close) / previous_close) * 100
+        day_high_percent = ((high - previous_close) / previous_close) * 100
+        closing_percent = ((close - previous_close) / previous_close) * 100
+
+    # NaN comparisons are False, so missing values and the first day never qualify
+    mask = (previous_close > 0) & (gap_up_percent >= gap_threshold)
+
+    gap_days = pd.DataFrame({
+        'timestamp': daily_df['timestamp'].to_numpy()[mask],
+        'previous_close': previous_close[mask],
+        'open': open_[mask],
+        'high': high[mask],
+        'close': close[mask],
+        'volume': daily_df['volume'].to_numpy()[mask],
+        'gap_up_percent': gap_up_percent[mask],
+        'day_high_percent': day_high_percent[mask],
+        'closing_percent': closing_percent[mask],
+        'runner_fader': np.select(
+            [close[mask] > open_[mask], close[mask] < open_[mask]], ['Runner', 'Fader'], default='Neutral'
+        ),
+    })
+    gap_days.insert(0, 'date', session_dates(gap_days['timestamp']))
+    if 'ticker' in daily_df.columns:
+        gap_days.insert(0, 'ticker', daily_df['ticker'].to_numpy()[mask])
+    return gap_days
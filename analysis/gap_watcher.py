@@ -0,0 +1,232 @@
+# gap_watcher.py
+"""
+Live premarket gap watcher.
+
+Consumes minute bars as a feed delivers them and keeps constant-size state per ticker in
+parallel NumPy arrays (one slot per ticker): last price, premarket open/high/high time/volume,
+the regular-session open and the VWAP cross count. A batch of bars (normally one minute of the
+whole market) updates every slot it touches in a few array operations, and the ranked gapper
+list is a partial sort over the slots, so thousands of symbols stay current within
+milliseconds of each bar.
+
+VWAP crosses follow count_crosses over resample_vwap_bars: bars are folded into 2-minute buckets
+and a cross is counted when consecutive buckets close on opposite sides of their VWAP.
+"""
+import numpy as np
+
+from analysis.intraday import VWAP_BAR_MS
+from analysis.universe_scan import adjust_for_splits
+from market_data.trading_calendar import format_local_time, previous_trading_day, session_boundaries
+
+# Initial number of ticker slots; the arrays double when they run out
+INITIAL_SLOTS = 1024
+
+FLOAT_STATE = ('previous_close', 'last_price', 'premarket_open', 'premarket_high', 'premarket_volume', 'open',
+               'volume', 'bucket_weighted', 'bucket_volume', 'bucket_close', 'bucket_vwap')
+INT_STATE = ('last_timestamp', 'premarket_high_timestamp', 'bucket', 'crosses', 'last_side')
+
+
+def load_previous_closes(grouped_daily_store, session_date, splits=None):
+    """
+    Reads every ticker's close of the trading day before session_date from the grouped daily store.
+
+    Args:
+        grouped_daily_store (GroupedDailyStore): The local store (see sync-grouped-daily).
+        session_date (date): The session being watched.
+        splits (pd.DataFrame or None): Splits executed on session_date (see fetch_splits); the
+                                       closes are adjusted so they compare with the session's
+                                       unadjusted bars.
+
+    Returns:
+        dict: ticker -> previous close; empty if that day is not stored.
+    """
+    previous = previous_trading_day(session_date)
+    frame = grouped_daily_store.load(previous, previous, columns=('ticker', 'timestamp', 'close'))
+    frame = adjust_for_splits(frame, splits)
+    return dict(zip(frame['ticker'].astype(str), frame['close'].astype(float)))
+
+
+class GapWatcher:
+    """
+    Incremental per-ticker premarket state for one session.
+
+    Args:
+        session_date (str): The session date, 'YYYY-MM-DD'.
+        previous_closes (dict): ticker -> close of the previous session; tickers without one have
+                                no gap % and are never ranked.
+    """
+
+    def __init__(self, session_date, previous_closes):
+        self.session_date = session_date
+        self.boundaries = session_boundaries(session_date)
+        self.previous_closes = previous_closes
+        self.slots = {}  # ticker -> slot index
+        self.tickers = []
+        self.bars_seen = 0
+        self.last_timestamp = None
+        self.state = {}
+        self._allocate(INITIAL_SLOTS)
+
+    def _allocate(self, capacity):
+        """Creates or grows the state arrays to capacity slots."""
+        used = len(self.tickers)
+        for name in FLOAT_STATE:
+            array = np.full(capacity, np.nan)
+            if name in ('premarket_volume', 'volume', 'bucket_weighted', 'bucket_volume'):
+                array[:] = 0.0
+            if name in self.state:
+                array[:used] = self.state[name][:used]
+            self.state[name] = array
+        for name in INT_STATE:
+            array = np.full(capacity, -1 if name in ('bucket', 'last_timestamp', 'premarket_high_timestamp') else 0,
+                            dtype=np.int64)
+            if name in self.state:
+                array[:used] = self.state[name][:used]
+            self.state[name] = array
+
+    def _slot_indices(self, tickers):
+        """Maps tickers to slots, adding slots for tickers seen for the first time."""
+        indices = np.empty(len(tickers), dtype=np.int64)
+        for position, ticker in enumerate(tickers):
+            slot = self.slots.get(ticker)
+            if slot is None:
+                slot = len(self.tickers)
+                if slot == len(self.state['last_price']):
+                    self._allocate(2 * slot)
+                self.slots[ticker] = slot
+                self.tickers.append(ticker)
+                self.state['previous_close'][slot] = self.previous_closes.get(ticker, np.nan)
+            indices[position] = slot
+        return indices
+
+    def update(self, bars):
+        """
+        Applies a batch of minute bars.
+
+        Args:
+            bars (list): Tuples in FEED_FIELDS order (ticker, timestamp ms, open, high, low, close,
+                         volume, vwap), e.g. one batch of a feed. Bars of one ticker must arrive in
+                         time order.
+        """
+        if not bars:
+            return
+        tickers, timestamps, opens, highs, lows, closes, volumes, vwaps = zip(*bars)
+        columns = [np.array(values, dtype=float) for values in (opens, highs, closes, volumes, vwaps)]
+        timestamps = np.array(timestamps, dtype=np.int64)
+        indices = self._slot_indices(tickers)
+
+        # A ticker updates once per round, so a batch with several bars of one ticker is applied in order
+        order = np.lexsort((timestamps, indices))
+        sorted_indices = indices[order]
+        group_starts = np.r_[0, np.flatnonzero(sorted_indices[1:] != sorted_indices[:-1]) + 1]
+        occurrence = np.arange(len(order)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(order)]))
+        for round_number in range(int(occurrence.max()) + 1):
+            selected = order[occurrence == round_number]
+            self._apply(indices[selected], timestamps[selected], *(column[selected] for column in columns))
+
+        self.bars_seen += len(bars)
+        self.last_timestamp = max(self.last_timestamp or 0, int(timestamps.max()))
+
+    def _apply(self, slots, timestamps, opens, highs, closes, volumes, vwaps):
+        """Applies bars of distinct tickers."""
+        state = self.state
+        boundaries = self.boundaries
+        volumes = np.nan_to_num(volumes)
+
+        premarket = (timestamps >= boundaries['premarket_start']) & (timestamps < boundaries['market_open'])
+        pm_slots = slots[premarket]
+        first_premarket = np.isnan(state['premarket_open'][pm_slots])
+        state['premarket_open'][pm_slots[first_premarket]] = opens[premarket][first_premarket]
+        higher = ~(highs[premarket] <= state['premarket_high'][pm_slots]) & ~np.isnan(highs[premarket])
+        state['premarket_high'][pm_slots[higher]] = highs[premarket][higher]
+        state['premarket_high_timestamp'][pm_slots[higher]] = timestamps[premarket][higher]
+        state['premarket_volume'][pm_slots] += volumes[premarket]
+
+        regular = (timestamps >= boundaries['market_open']) & (timestamps < boundaries['market_close'])
+        opening = slots[regular][np.isnan(state['open'][slots[regular]])]
+        state['open'][opening] = opens[regular][np.isnan(state['open'][slots[regular]])]
+
+        state['last_price'][slots] = closes
+        state['last_timestamp'][slots] = timestamps
+        state['volume'][slots] += volumes
+
+        # Close the 2-minute VWAP bucket of tickers whose bar starts a new one
+        buckets = timestamps // VWAP_BAR_MS
+        closing = slots[(buckets != state['bucket'][slots]) & (state['bucket'][slots] >= 0)]
+        if len(closing):
+            side = self._bucket_side(closing)
+            state['crosses'][closing] += (side * state['last_side'][closing] == -1)
+            state['last_side'][closing] = side
+        starting = slots[buckets != state['bucket'][slots]]
+        state['bucket'][starting] = buckets[buckets != state['bucket'][slots]]
+        state['bucket_weighted'][starting] = 0.0
+        state['bucket_volume'][starting] = 0.0
+
+        weighted = ~np.isnan(vwaps) & (volumes > 0)
+        state['bucket_weighted'][slots[weighted]] += vwaps[weighted] * volumes[weighted]
+        state['bucket_volume'][slots[weighted]] += volumes[weighted]
+        state['bucket_close'][slots] = closes
+        state['bucket_vwap'][slots] = vwaps
+
+    def _bucket_side(self, slots):
+        """Returns +1 / -1 / 0 for buckets that closed above / below / on (or without) their VWAP."""
+        state = self.state
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vwap = np.where(state['bucket_volume'][slots] > 0,
+                            state['bucket_weighted'][slots] / state['bucket_volume'][slots], state['bucket_vwap'][slots])
+        close = state['bucket_close'][slots]
+        return (close > vwap).astype(np.int64) - (close < vwap).astype(np.int64)
+
+    def gap_percent(self):
+        """Gap % of every slot: the regular open (or, before 09:30, the last price) over the previous close."""
+        used = len(self.tickers)
+        reference = np.where(np.isnan(self.state['open'][:used]), self.state['last_price'][:used],
+                             self.state['open'][:used])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (reference / self.state['previous_close'][:used] - 1) * 100
+
+    def top(self, count=20, min_gap=0.0, min_premarket_volume=0.0):
+        """
+        Ranks the gappers.
+
+        Args:
+            count (int): Number of tickers returned.
+            min_gap (float): Minimum gap %, see gap_percent.
+            min_premarket_volume (float): Minimum premarket volume.
+
+        Returns:
+            list: Dicts for the count largest gaps, largest first.
+        """
+        used = len(self.tickers)
+        if not used:
+            return []
+        state = self.state
+        gaps = self.gap_percent()
+        eligible = np.flatnonzero((gaps >= min_gap) & (state['premarket_volume'][:used] >= min_premarket_volume))
+        if len(eligible) > count:
+            eligible = eligible[np.argpartition(-gaps[eligible], count - 1)[:count]]
+        ranked = eligible[np.argsort(-gaps[eligible], kind='stable')]
+
+        # The bucket in progress counts too, as it would once it closes
+        open_side = self._bucket_side(ranked)
+        crosses = state['crosses'][ranked] + (open_side * state['last_side'][ranked] == -1)
+        midnight = self.boundaries['midnight']
+        return [{
+            'ticker': self.tickers[slot],
+            'gap %': float(gaps[slot]),
+            'price': float(state['last_price'][slot]),
+            'previous close': float(state['previous_close'][slot]),
+            'premarket open': _float_or_none(state['premarket_open'][slot]),
+            'premarket high': _float_or_none(state['premarket_high'][slot]),
+            'premarket high time': (format_local_time(int(state['premarket_high_timestamp'][slot]), midnight)
+                                    if state['premarket_high_timestamp'][slot] >= 0 else None),
+            'premarket volume': float(state['premarket_volume'][slot]),
+            'open': _float_or_none(state['open'][slot]),
+            'volume': float(state['volume'][slot]),
+            'VWAP Crosses': int(cross_count),
+            'updated': format_local_time(int(state['last_timestamp'][slot]), midnight),
+        } for slot, cross_count in zip(ranked, crosses)]
+
+
+def _float_or_none(value):
+    return None if np.isnan(value) else float(value)
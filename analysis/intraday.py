@@ -0,0 +1,228 @@
+# intraday.py
+"""
+Single-fetch intraday session engine.
+
+Pulls one extended-hours (04:00 - 20:00 EST, 17:00 on early closes) 1-minute series per
+ticker and date and derives every per-gap-day intraday metric from that single buffer,
+instead of issuing a separate REST call for each helper. Session boundaries come from the
+trading calendar; the bars are held in a BarArray, so windows are views and every metric is
+an array operation.
+"""
+import numpy as np
+
+from metrics import timed
+from market_data.bars import BarArray, fetch_bar_array
+from market_data.trading_calendar import session_boundaries, format_local_time
+
+# Width of the resampled bars used for VWAP cross detection, in milliseconds
+VWAP_BAR_MS = 2 * 60 * 1000
+
+
+@timed('fetch_session_bars')
+def fetch_session_bars(polygon_client, ticker, date_str):
+    """
+    Fetches the full extended-hours 1-minute series (04:00 AM to 8:00 PM EST) for a ticker and date.
+
+    Non-trading days have no session and are not fetched.
+
+    Args:
+        polygon_client: The initialized Polygon.io RESTClient.
+        ticker (str): The stock ticker symbol.
+        date_str (str): The date in 'YYYY-MM-DD' format.
+
+    Returns:
+        BarArray or None: The 1-minute bars in ascending time order, or None on error.
+    """
+    boundaries = session_boundaries(date_str)
+    if not boundaries['trading_day']:
+        return BarArray.empty()
+    try:
+        return fetch_bar_array(
+            polygon_client,
+            ticker=ticker,
+            multiplier=1,
+            timespan='minute',
+            from_=boundaries['premarket_start'],
+            to=boundaries['afterhours_end'],
+            limit=50000  # A full extended session is at most 960 bars
+        )
+    except Exception as e:
+        print(f"Error fetching extended-hours data for {ticker} on {date_str}: {e}")
+        return None
+
+
+def resample_vwap_bars(bars, bar_ms=VWAP_BAR_MS):
+    """
+    Resamples 1-minute bars into wider bars for VWAP cross detection.
+
+    Each resampled bar takes the close of its last constituent bar and the volume-weighted
+    average of the constituent VWAPs, matching what Polygon returns for a multi-minute bar.
+    Constituents without a VWAP or volume are left out of the average; a bar with none left
+    keeps the VWAP of its last constituent.
+
+    Args:
+        bars (BarArray): 1-minute bars in ascending time order.
+        bar_ms (int): The resampled bar width in milliseconds.
+
+    Returns:
+        tuple: (close, vwap) arrays, one entry per resampled bar.
+    """
+    if not len(bars):
+        return np.empty(0), np.empty(0)
+
+    buckets = bars.timestamp // bar_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+
+    weighted = ~np.isnan(bars.vwap) & (bars.volume > 0)
+    weighted_sum = np.add.reduceat(np.where(weighted, bars.vwap * bars.volume, 0.0), starts)
+    volume_sum = np.add.reduceat(np.where(weighted, bars.volume, 0.0), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vwap = np.where(volume_sum > 0, weighted_sum / volume_sum, bars.vwap[ends])
+    return bars.close[ends], vwap
+
+
+def count_crosses(close, vwap):
+    """
+    Counts how many times the close crossed the VWAP across consecutive bars.
+
+    Args:
+        close (np.ndarray): Closes in time order.
+        vwap (np.ndarray): The matching VWAPs. Pairs with a NaN on either side never count.
+
+    Returns:
+        int: The number of times the price crossed the VWAP.
+    """
+    if len(close) < 2:
+        return 0
+    # A cross: price goes from below VWAP to above, or vice versa
+    below = close < vwap
+    above = close > vwap
+    return int(np.count_nonzero((below[:-1] & above[1:]) | (above[:-1] & below[1:])))
+
+
+def _has_vwap(bars):
+    """Tells whether the crosses of a buffer can be counted: it is empty or some bar has a VWAP."""
+    return not len(bars) or not np.all(np.isnan(bars.vwap))
+
+
+@timed('compute_session_metrics')
+def compute_session_metrics(bars, date_str, daily_high=None):
+    """
+    Derives all per-gap-day intraday metrics from one extended-hours 1-minute buffer.
+
+    Windows are half-open, so the 09:30 opening bar counts towards the regular session
+    and not the premarket, and the closing bar (16:00, or 13:00 on early closes) counts
+    towards after hours.
+
+    Args:
+        bars (BarArray): The extended-hours 1-minute bars returned by fetch_session_bars.
+        date_str (str): The date in 'YYYY-MM-DD' format.
+        daily_high (float or None): The high of the daily bar, used for the high-within-30-min flag.
+
+    Returns:
+        dict: Premarket high/low/time/volume, regular-session high/low/time, VWAP crosses
+              on 2-minute bars (None when no bar has a VWAP, e.g. bars read from flat files),
+              and first-30-minute high/time/volume/high-within-30-min flag.
+    """
+    boundaries = session_boundaries(date_str)
+    midnight = boundaries['midnight']
+
+    premarket_bars = bars.window(boundaries['premarket_start'], boundaries['market_open'])
+    regular_bars = bars.window(boundaries['market_open'], boundaries['market_close'])
+    first_30_bars = bars.window(boundaries['market_open'], boundaries['first_30_min_end'])
+
+    premarket_high, premarket_high_ts, premarket_low, premarket_low_ts = premarket_bars.high_low()
+    day_high, day_high_ts, day_low, day_low_ts = regular_bars.high_low()
+    high_30min, high_30min_ts, _, _ = first_30_bars.high_low()
+
+    return {
+        'premarket_high': premarket_high,
+        'premarket_high_time': format_local_time(premarket_high_ts, midnight),
+        'premarket_low': premarket_low,
+        'premarket_low_time': format_local_time(premarket_low_ts, midnight),
+        'premarket_volume': premarket_bars.total_volume(),
+        'day_high': day_high,
+        'day_high_time': format_local_time(day_high_ts, midnight),
+        'day_low': day_low,
+        'day_low_time': format_local_time(day_low_ts, midnight),
+        'vwap_crosses': count_crosses(*resample_vwap_bars(bars)) if _has_vwap(bars) else None,
+        'high_30min': high_30min,
+        'high_30min_time': format_local_time(high_30min_ts, midnight),
+        'high_within_30min': daily_high is not None and bool(np.any(first_30_bars.high == daily_high)),
+        'volume_30min': first_30_bars.total_volume(),
+    }
+
+
+def get_session_metrics(polygon_client, ticker, date_str, daily_high=None):
+    """
+    Fetches the extended-hours series once and computes every intraday metric from it.
+
+    Args:
+        polygon_client: The initialized Polygon.io RESTClient.
+        ticker (str): The stock ticker symbol.
+        date_str (str): The date in 'YYYY-MM-DD' format.
+        daily_high (float or None): The high of the daily bar.
+
+    Returns:
+        dict or None: See compute_session_metrics, or None if the fetch failed.
+    """
+    bars = fetch_session_bars(polygon_client, ticker, date_str)
+    if bars is None:
+        return None
+    return compute_session_metrics(bars, date_str, daily_high)
+
+
+@timed('first_30_min_metrics')
+def first_30_min_metrics(sessions):
+    """
+    Computes the first-30-minute metrics of compute_session_metrics for many sessions at once.
+
+    The 09:30 - 10:00 windows of all sessions are joined into one set of arrays and reduced per
+    segment, so a backfill over thousands of stored gap days runs a handful of array operations
+    instead of a session engine pass per day.
+
+    Args:
+        sessions (list): (bars, date_str, daily_high) per session, bars as returned by fetch_session_bars.
+
+    Returns:
+        list: One dict per session with high_30min, high_30min_time, volume_30min and high_within_30min.
+    """
+    windows = []
+    for bars, date_str, daily_high in sessions:
+        boundaries = session_boundaries(date_str)
+        windows.append(bars.window(boundaries['market_open'], boundaries['first_30_min_end']))
+    lengths = np.array([len(window) for window in windows], dtype=np.int64)
+    results = [{'high_30min': None, 'high_30min_time': None, 'volume_30min': 0.0, 'high_within_30min': False}
+               for _ in sessions]
+    filled = np.flatnonzero(lengths)
+    if not len(filled):
+        return results
+
+    high = np.concatenate([windows[index].high for index in filled])
+    timestamp = np.concatenate([windows[index].timestamp for index in filled])
+    volume = np.concatenate([windows[index].volume for index in filled])
+    daily_high = np.array([np.nan if sessions[index][2] is None else sessions[index][2] for index in filled])
+    segment = np.repeat(np.arange(len(filled)), lengths[filled])
+    # Empty windows are left out, so each start is followed by exactly its own bars
+    starts = np.r_[0, np.cumsum(lengths[filled])[:-1]]
+
+    comparable = np.where(np.isnan(high), -np.inf, high)
+    segment_high = np.maximum.reduceat(comparable, starts)
+    # First bar reaching the high, like high_low's nanargmax
+    first_high = np.minimum.reduceat(np.where(comparable == segment_high[segment], np.arange(len(high)), len(high)),
+                                     starts)
+    segment_volume = np.add.reduceat(np.nan_to_num(volume), starts)
+    reaches_daily_high = np.maximum.reduceat(high == daily_high[segment], starts)
+
+    for position, index in enumerate(filled):
+        if segment_high[position] == -np.inf:
+            continue  # No bar with a high
+        results[index] = {
+            'high_30min': float(segment_high[position]),
+            'high_30min_time': format_local_time(int(timestamp[first_high[position]]),
+                                                 session_boundaries(sessions[index][1])['midnight']),
+            'volume_30min': float(segment_volume[position]),
+            'high_within_30min': bool(reaches_daily_high[position]),
+        }
+    return results
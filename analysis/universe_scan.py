@@ -0,0 +1,242 @@
+# universe_scan.py
+"""
+Universe-wide gap scanner built on Polygon's grouped daily bars.
+
+One grouped-daily call returns the daily bar of every ticker in the market for a date.
+Those snapshots are kept in a local columnar store (one Parquet file per date), synced
+incrementally, and scanned for gap-ups across all tickers in one vectorized pass. The
+resulting (ticker, date) candidates feed the existing intraday enrichment.
+
+Snapshots are stored unadjusted, since a stored file is never fetched again, and the
+splits executed since then are applied when they are read (see adjust_for_splits).
+"""
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from analysis.gap_scan import scan_gap_days
+from market_data.trading_calendar import (is_trading_day, local_dates, previous_trading_day, session_boundaries,
+                                          trading_days)
+
+est_timezone = pytz.timezone('America/New_York')
+
+GROUPED_DAILY_COLUMNS = ('ticker', 'timestamp', 'open', 'high', 'low', 'close', 'volume', 'vwap', 'transactions')
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'vwap')
+
+# Bumped when the meaning of the stored files changes; files of another version are deleted
+STORE_FORMAT_VERSION = '1'
+
+
+class GroupedDailyStore:
+    """
+    Local columnar store of grouped daily bars, one Parquet file per date.
+
+    A file is written only once its date has finished trading, so an existing file (empty for
+    market holidays) means the date is complete and never needs to be fetched again. Files hold
+    unadjusted bars; a directory written by an earlier version, which stored split-adjusted
+    bars, is emptied when the store is opened.
+
+    Args:
+        directory (str): Directory holding the YYYY-MM-DD.parquet files.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._check_format()
+
+    def _check_format(self):
+        """Deletes the stored files when they were written in another format."""
+        version_path = os.path.join(self.directory, 'FORMAT')
+        try:
+            with open(version_path) as version_file:
+                if version_file.read().strip() == STORE_FORMAT_VERSION:
+                    return
+        except FileNotFoundError:
+            pass
+        for name in os.listdir(self.directory):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(self.directory, name))
+        with open(version_path, 'w') as version_file:
+            version_file.write(STORE_FORMAT_VERSION + '\n')
+
+    def _path(self, date_str):
+        return os.path.join(self.directory, f"{date_str}.parquet")
+
+    def has(self, date_str):
+        return os.path.exists(self._path(date_str))
+
+    def missing_dates(self, start_date, end_date):
+        """Returns the trading days in [start_date, end_date] before today that are not stored yet."""
+        today = datetime.now(est_timezone).date()
+        dates = []
+        current = start_date
+        while current <= end_date and current < today:
+            if is_trading_day(current) and not self.has(current.isoformat()):
+                dates.append(current)
+            current += timedelta(days=1)
+        return dates
+
+    def write(self, date_str, grouped_aggs):
+        """Stores the grouped daily bars of one date."""
+        frame = pd.DataFrame({
+            field: [getattr(agg, field) for agg in grouped_aggs] for field in GROUPED_DAILY_COLUMNS
+        })
+        frame = frame.astype({'ticker': 'string', 'timestamp': 'int64', 'open': float, 'high': float,
+                              'low': float, 'close': float, 'volume': float, 'vwap': float,
+                              'transactions': float})
+        temp_path = self._path(date_str) + '.tmp'
+        frame.to_parquet(temp_path, index=False)
+        os.replace(temp_path, self._path(date_str))
+
+    def load(self, start_date, end_date, columns=('ticker', 'timestamp', 'open', 'high', 'close', 'volume')):
+        """
+        Loads the stored (unadjusted) bars for a date range into one DataFrame.
+
+        Returns:
+            pd.DataFrame: The requested columns, with ticker as a categorical.
+        """
+        frames = []
+        current = start_date
+        while current <= end_date:
+            if self.has(current.isoformat()):
+                frames.append(pd.read_parquet(self._path(current.isoformat()), columns=list(columns)))
+            current += timedelta(days=1)
+        if not frames:
+            return pd.DataFrame({column: [] for column in columns})
+        universe_df = pd.concat(frames, ignore_index=True)
+        universe_df['ticker'] = universe_df['ticker'].astype('category')
+        return universe_df
+
+
+def sync_grouped_daily(polygon_client, store, start_date, end_date):
+    """
+    Fetches the unadjusted grouped daily bars for every finished trading day in the range that
+    is not stored yet.
+
+    Args:
+        polygon_client: The initialized Polygon.io RESTClient.
+        store (GroupedDailyStore): The local store.
+        start_date (date): First date to cover.
+        end_date (date): Last date to cover.
+
+    Returns:
+        int: The number of dates fetched.
+    """
+    fetched = 0
+    for session_date in store.missing_dates(start_date, end_date):
+        date_str = session_date.isoformat()
+        try:
+            grouped_aggs = polygon_client.get_grouped_daily_aggs(date=date_str, adjusted='false')
+        except Exception as e:
+            print(f"Error fetching grouped daily bars for {date_str}: {e}")
+            continue
+        store.write(date_str, grouped_aggs)
+        fetched += 1
+    return fetched
+
+
+def fetch_splits(polygon_client, start_date, end_date=None):
+    """
+    Fetches the splits of every ticker executed in [start_date, end_date] (no end by default).
+
+    Returns:
+        pd.DataFrame or None: ticker, execution (midnight ms of the execution date) and factor
+                              (split_from / split_to); None if the splits could not be fetched.
+    """
+    try:
+        splits = [(split.ticker, session_boundaries(str(split.execution_date))['midnight'],
+                   split.split_from / split.split_to)
+                  for split in polygon_client.list_splits(
+                      execution_date_gte=start_date.isoformat(),
+                      execution_date_lte=end_date.isoformat() if end_date else None,
+                      limit=1000)
+                  if split.ticker and split.split_from and split.split_to]
+    except Exception as e:
+        print(f"Error fetching splits from {start_date}: {e}")
+        return None
+    return pd.DataFrame(splits, columns=['ticker', 'execution', 'factor'])
+
+
+def adjust_for_splits(universe_df, splits):
+    """
+    Adjusts stored bars the way Polygon's adjusted bars are: prices before a split's execution
+    are multiplied by its factor and volumes divided by it.
+
+    Args:
+        universe_df (pd.DataFrame): Bars as returned by GroupedDailyStore.load.
+        splits (pd.DataFrame): Splits as returned by fetch_splits.
+
+    Returns:
+        pd.DataFrame: The adjusted bars (universe_df itself when no split applies).
+    """
+    if splits is None or splits.empty or universe_df.empty:
+        return universe_df
+    codes = universe_df['ticker'].cat.codes.to_numpy()
+    split_codes = pd.Categorical(splits['ticker'], categories=universe_df['ticker'].cat.categories).codes
+    known = split_codes >= 0
+    rows = np.flatnonzero(np.isin(codes, split_codes[known]))
+    if not rows.size:
+        return universe_df
+
+    pairs = pd.DataFrame({'row': rows, 'code': codes[rows], 'timestamp': universe_df['timestamp'].to_numpy()[rows]})
+    pairs = pairs.merge(pd.DataFrame({'code': split_codes[known], 'execution': splits['execution'].to_numpy()[known],
+                                      'factor': splits['factor'].to_numpy()[known]}), on='code')
+    pairs = pairs[pairs['timestamp'].to_numpy() < pairs['execution'].to_numpy()]
+    factors = np.ones(len(universe_df))
+    np.multiply.at(factors, pairs['row'].to_numpy(), pairs['factor'].to_numpy())
+
+    adjusted_df = universe_df.copy()
+    for column in PRICE_COLUMNS:
+        if column in adjusted_df.columns:
+            adjusted_df[column] = adjusted_df[column].to_numpy() * factors
+    if 'volume' in adjusted_df.columns:
+        adjusted_df['volume'] = adjusted_df['volume'].to_numpy() / factors
+    return adjusted_df
+
+
+def scan_universe(store, splits, gap_threshold, start_date, end_date):
+    """
+    Finds every (ticker, date) in the store that gapped up by at least gap_threshold percent.
+
+    The previous close is the ticker's close on the previous trading day of the calendar, so the
+    day before start_date is loaded too; it is NaN (never a candidate) when the ticker has no bar
+    stored for that day, rather than the close of an older session.
+
+    Args:
+        store (GroupedDailyStore): The local store.
+        splits (pd.DataFrame): Splits executed from start_date on, see fetch_splits.
+        gap_threshold (float): Minimum gap up at the open, in percent.
+        start_date (date): First candidate date.
+        end_date (date): Last candidate date.
+
+    Returns:
+        pd.DataFrame: The candidates as returned by scan_gap_days, with a ticker column, sorted
+                      by date and ticker.
+    """
+    load_start = previous_trading_day(start_date)
+    universe_df = store.load(load_start, end_date)
+    if universe_df.empty:
+        return scan_gap_days(universe_df.assign(previous_close=pd.Series(dtype=float)), gap_threshold)
+    universe_df = adjust_for_splits(universe_df, splits)
+
+    # Key every bar by (ticker, trading day); the previous close is the bar keyed one day earlier
+    days = trading_days(load_start, end_date)
+    day_index = pd.Series(np.arange(1, len(days) + 1), index=[day.isoformat() for day in days])
+    day = day_index.reindex(local_dates(universe_df['timestamp'].to_numpy())).to_numpy()
+    stored = ~np.isnan(day)
+    universe_df = universe_df[stored]
+    # Day numbers start at 1, so key - 1 of a ticker's first day never reaches the previous ticker
+    key = universe_df['ticker'].cat.codes.to_numpy().astype(np.int64) * (len(days) + 1) + day[stored].astype(np.int64)
+    closes = pd.Series(universe_df['close'].to_numpy(), index=key)
+    universe_df = universe_df.assign(previous_close=closes[~closes.index.duplicated()].reindex(key - 1).to_numpy())
+
+    start_ms = session_boundaries(start_date.isoformat())['midnight']
+    universe_df = universe_df[universe_df['timestamp'].to_numpy() >= start_ms]
+
+    candidates = scan_gap_days(universe_df, gap_threshold)
+    candidates['ticker'] = candidates['ticker'].astype(str)
+    return candidates.sort_values(['date', 'ticker'], ignore_index=True)
@@ -1,639 +1,1201 @@
 # app.py (Full content with download route)
-from flask import Flask, request, render_template, send_file
-import pandas as pd
+"""
+The gap-up analysis web app and its CLI commands.
+
+create_app builds the application (gunicorn: 'app:create_app()', flask --app app). It does no
+I/O and starts no threads, so a worker boots in the time it takes to import this module, and
+the same app can be preloaded in a gunicorn master and forked. The database schema is set up
+once by the init-db command, the Polygon client is built on first use in each process, and the
+modules behind single routes or commands (pandas, pyarrow, xlsxwriter, the polygon package) are
+imported by the functions that need them.
+"""
+import importlib
+import threading
+
+from flask import Flask, Blueprint, current_app, request, render_template, send_file, jsonify, redirect, url_for, \
+    Response, stream_with_context
 import pytz
-from datetime import datetime, time, timedelta, timezone
+from datetime import datetime, timedelta, timezone
 import os
-from polygon import RESTClient
-import io
+import json
+import itertools
+import click
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from database.dbmodel import db, AnalysisJob, GapDay, TickerScanState
+from analysis.intraday import get_session_metrics, fetch_session_bars, first_30_min_metrics
+from market_data.trading_calendar import format_local_time, next_session_change
+from analysis.backtest import ENTRY_RULES, SIDES
+from market_data.bars import fetch_bar_array
+from market_data.scheduler import TokenBucket, SharedTokenBucket, run_concurrently
+from jobs import JobQueue, job_status
+from metrics import span, timed, start_request_timings, stop_request_timings, render_prometheus, \
+    REQUEST_SECONDS
+from database.gap_days import INCOMPLETE_KEY, load_enriched_days, upsert_gap_days, query_gap_days, page_gap_days, \
+    import_legacy_results, GapDayWriter, SORTABLE_COLUMNS, update_gap_days
+from database.gap_stats import DIMENSIONS as GAP_STAT_DIMENSIONS, query_gap_stats, rebuild_gap_stats, \
+    ensure_gap_stats
+from database.result_cache import cached_analysis
+from database.engine import engine_options, configure_sqlite
+from database.schema import upgrade_schema
+
+# Routes and CLI commands of the app, registered by create_app
+bp = Blueprint('gap_up', __name__, cli_group=None)
+
+# Instance folder of the app (bar cache, bar store, grouped daily store, gapper snapshot)
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 30000))
+
+# Concurrency settings for /analyze: worker pool sizes and the Polygon plan's request budget
+TICKER_WORKERS = int(os.environ.get('ANALYZE_TICKER_WORKERS', 4))
+GAP_DAY_WORKERS = int(os.environ.get('ANALYZE_GAP_DAY_WORKERS', 4))
+POLYGON_REQUESTS_PER_MINUTE = float(os.environ.get('POLYGON_REQUESTS_PER_MINUTE', 0))  # 0 = unlimited
+
+# Fetch resilience: retries of transient failures, the time budget of one call across its retries,
+# and the per-attempt timeouts
+POLYGON_MAX_RETRIES = int(os.environ.get('POLYGON_MAX_RETRIES', 4))
+POLYGON_CALL_DEADLINE = float(os.environ.get('POLYGON_CALL_DEADLINE', 60))
+POLYGON_CONNECT_TIMEOUT = float(os.environ.get('POLYGON_CONNECT_TIMEOUT', 5))
+POLYGON_READ_TIMEOUT = float(os.environ.get('POLYGON_READ_TIMEOUT', 30))
+
+# Settings of the layered Polygon client (see build_polygon_client), shared with the batch runner
+POLYGON_CLIENT_OPTIONS = {
+    'api_key': os.environ.get("POLYGON_API_KEY"),
+    'bar_cache_path': os.environ.get('BAR_CACHE_PATH', os.path.join(INSTANCE_PATH, 'bar_cache.db')),
+    # Bars ingested from Polygon flat files (see ingest-flat-files)
+    'bar_store_dir': os.environ.get('BAR_STORE_DIR', os.path.join(INSTANCE_PATH, 'bar_store')),
+    'max_retries': POLYGON_MAX_RETRIES,
+    'deadline': POLYGON_CALL_DEADLINE,
+    'connect_timeout': POLYGON_CONNECT_TIMEOUT,
+    'read_timeout': POLYGON_READ_TIMEOUT,
+}
+# Size limit of the bar cache; build_polygon_client's default unless set
+if os.environ.get('BAR_CACHE_MAX_BYTES'):
+    POLYGON_CLIENT_OPTIONS['bar_cache_max_bytes'] = int(os.environ['BAR_CACHE_MAX_BYTES'])
+
+# Local store of whole-market grouped daily bars for the universe scanner
+GROUPED_DAILY_DIR = os.environ.get('GROUPED_DAILY_DIR', os.path.join(INSTANCE_PATH, 'grouped_daily'))
+
+# Latest ranking of the live gap watcher (watch-gaps), served by /api/gappers
+GAPPERS_SNAPSHOT_PATH = os.environ.get('GAPPERS_SNAPSHOT_PATH', os.path.join(INSTANCE_PATH, 'gappers.json'))
+
+# Default gap-up selection: minimum gap at the open (percent) and calendar days of history
+DEFAULT_GAP_THRESHOLD = 25
+DEFAULT_LOOKBACK_DAYS = 1095
+
+# Per-request timing breakdown: sent as a Server-Timing header when enabled (or with ?timings=1),
+# and printed for any request slower than SLOW_REQUEST_SECONDS
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', '0') == '1'
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 30))
+
+# Shared result cache: results stay valid until the next session starts or ends, and for at most
+# RESULT_CACHE_LIVE_SECONDS while a session is trading; a worker computing a result holds its lock
+# for up to RESULT_CACHE_LEASE_SECONDS
+RESULT_CACHE_LIVE_SECONDS = float(os.environ.get('RESULT_CACHE_LIVE_SECONDS', 60))
+RESULT_CACHE_LEASE_SECONDS = float(os.environ.get('RESULT_CACHE_LEASE_SECONDS', 300))
+
+# Modules imported on first use rather than at boot; preload_modules imports them up front
+LAZY_MODULES = ('pandas', 'pyarrow', 'xlsxwriter', 'polygon', 'market_data.client', 'analysis.gap_scan',
+                'analysis.universe_scan', 'export')
+
+# Guards the first build of the per-process Polygon client and grouped daily store
+_lazy_lock = threading.Lock()
+
+
+def _lazy_extension(name, build):
+    """Returns current_app.extensions[name], building it once with build() on first use."""
+    extensions = current_app.extensions
+    if name not in extensions:
+        with _lazy_lock:
+            if name not in extensions:
+                extensions[name] = build()
+    return extensions[name]
+
+
+def _build_polygon_client():
+    """Builds the layered Polygon client, or returns None if it cannot be initialized."""
+    # Imports the polygon package and pyarrow
+    from market_data.client import build_polygon_client
+    try:
+        return build_polygon_client(token_bucket=TokenBucket(POLYGON_REQUESTS_PER_MINUTE),
+                                    pool_size=TICKER_WORKERS * max(1, GAP_DAY_WORKERS),
+                                    **POLYGON_CLIENT_OPTIONS)
+    except Exception as e:
+        print(f"Error initializing Polygon client: {e}")
+        return None  # Handle the case where the client cannot be initialized
 
-from database.dbmodel import db, GapUpResult
 
-# Initialize the Flask application
-app = Flask(__name__)
+def get_polygon_client():
+    """
+    Returns the Polygon client of the current app, built on first use in this process, so
+    neither booting a worker nor preloading the app opens the bar cache or a connection pool.
+
+    Returns:
+        The layered client of build_polygon_client, or None if it cannot be initialized
+        (e.g. no POLYGON_API_KEY).
+    """
+    return _lazy_extension('polygon_client', _build_polygon_client)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
-    'DATABASE_URL', 'sqlite:///gap_up_analysis.db'
-)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db.init_app(app)
+def get_grouped_daily_store():
+    """Returns the grouped daily store of the universe scanner, opened on first use."""
+    from analysis.universe_scan import GroupedDailyStore
+    return _lazy_extension('grouped_daily_store', lambda: GroupedDailyStore(GROUPED_DAILY_DIR))
 
-with app.app_context():
-    print("Creating tables...")
-    db.create_all()
 
+@bp.before_app_request
+def start_timings():
+    """Starts the timing breakdown of the request."""
+    start_request_timings()
 
-# Initialize the Polygon client (assuming POLYGON_API_KEY is already in userdata)
-try:
-    polygon_client = RESTClient(os.environ.get("POLYGON_API_KEY"))
-except Exception as e:
-    print(f"Error initializing Polygon client: {e}")
-    polygon_client = None  # Handle the case where the client cannot be initialized
 
-# Dictionary to store results for potential download
-all_tickers_gap_up_results = {}
+@bp.after_app_request
+def record_timings(response):
+    """Records the request latency and reports its timing breakdown."""
+    timings = stop_request_timings()
+    if timings is None:
+        return response
+    elapsed = timings.elapsed()
+    REQUEST_SECONDS.observe(elapsed, request.endpoint or 'unknown', str(response.status_code))
+    if SERVER_TIMING_HEADER or request.args.get('timings') == '1':
+        response.headers['Server-Timing'] = timings.server_timing()
+    if elapsed > SLOW_REQUEST_SECONDS:
+        print(f"Slow request {request.method} {request.path} ({elapsed:.1f}s): {timings.server_timing()}")
+    return response
 
 
-# Include the necessary functions directly
-def count_vwap_crosses(polygon_client, ticker, date):
+@bp.route('/metrics')
+def metrics():
+    """Exposes the timing spans, counters and latency histograms in the Prometheus text format."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@timed('fetch_daily_bars')
+def fetch_daily_bars(ticker, polygon_client, start_date, end_date):
     """
-    Fetches 2-minute bar data for a given ticker and date and counts VWAP crosses.
+    Fetches the daily bars of a ticker into a columnar DataFrame.
 
     Args:
-        polygon_client: The initialized Polygon.io RESTClient.
         ticker (str): The stock ticker symbol.
-        date (str): The date in 'YYYY-MM-DD' format.
+        polygon_client: The initialized Polygon.io RESTClient.
+        start_date (date): First date to fetch.
+        end_date (date): Last date to fetch.
 
     Returns:
-        int: The number of times the price crossed the VWAP.
+        pd.DataFrame or None: The bars as returned by daily_aggs_to_frame, or None on error.
     """
+    # gap_scan imports pandas
+    from analysis.gap_scan import daily_aggs_to_frame
     try:
-        # Fetch 2-minute bar data
-        aggs_data = polygon_client.list_aggs(
+        bars = fetch_bar_array(
+            polygon_client,
             ticker=ticker,
-            multiplier=2,
-            timespan='minute',
-            from_=date,
-            to=date,
-            # adjusted='true',
-            limit=50000  # Increased limit for potentially more bars
+            multiplier=1,
+            timespan='day',
+            from_=start_date.strftime('%Y-%m-%d'),
+            to=end_date.strftime('%Y-%m-%d'),
+            adjusted='true',
+            limit=10000
         )
-        aggs_list = list(aggs_data)
+        return daily_aggs_to_frame(bars)
     except Exception as e:
-        print(f"Error fetching 2-minute bar data for {ticker} on {date}: {e}")
-        return None  # Return None on error
+        print(f"Error fetching daily data for {ticker}: {e}")
+        return None
+
+
+def enrich_gap_days(ticker, polygon_client, daily_df, gap_threshold, max_workers=1, enriched_days=None):
+    """
+    Selects the gap-up days of a daily series and enriches them with intraday data.
+
+    Args:
+        ticker (str): The stock ticker symbol.
+        polygon_client: The initialized Polygon.io RESTClient.
+        daily_df (pd.DataFrame): Daily bars as returned by fetch_daily_bars.
+        gap_threshold (float): Minimum gap up at the open, in percent.
+        max_workers (int): Number of gap days enriched concurrently. 1 keeps the serial path.
+        enriched_days (dict or None): Previously enriched rows by 'YYYY-MM-DD'; qualifying days found
+                                      here are reused instead of fetching their intraday data again.
+    Returns:
+        list: A list of dictionaries, each representing a gap-up day with relevant data.
+    """
+    from analysis.gap_scan import scan_gap_days
+    enriched_days = enriched_days or {}
 
-    if not aggs_list:
-        return 0  # No data means no crosses
+    # Scan the whole daily series at once; only the qualifying days are enriched below
+    with span('scan_gap_days'):
+        gap_up_candidates = scan_gap_days(daily_df, gap_threshold).to_dict('records')
 
-    cross_count = 0
-    # Initialize previous close and vwap with the first bar's data
-    previous_close = aggs_list[0].close
-    previous_vwap = aggs_list[0].vwap
+    # Enrich the qualifying days that are not stored yet; results keep the order of the daily series
+    return run_concurrently(
+        lambda gap_day: enriched_days.get(gap_day['date']) or enrich_gap_up_day(ticker, polygon_client, gap_day),
+        gap_up_candidates,
+        max_workers
+    )
 
-    for i in range(1, len(aggs_list)):
-        current_bar = aggs_list[i]
-        current_close = current_bar.close
-        current_vwap = current_bar.vwap
 
-        # Check for a cross: price goes from below VWAP to above, or vice versa
-        if previous_close is not None and current_close is not None and previous_vwap is not None and current_vwap is not None:
-            if (previous_close < previous_vwap and current_close > current_vwap) or \
-                    (previous_close > previous_vwap and current_close < current_vwap):
-                cross_count += 1
+def get_gap_up_day_stats(ticker, polygon_client, max_workers=1, gap_threshold=DEFAULT_GAP_THRESHOLD,
+                         lookback_days=DEFAULT_LOOKBACK_DAYS, enriched_days=None):
+    """
+    Analyzes historical data for a given ticker to identify significant gap-ups.
 
-        previous_close = current_close
-        previous_vwap = current_vwap
+    Args:
+        ticker (str): The stock ticker symbol.
+        polygon_client: The initialized Polygon.io RESTClient.
+        max_workers (int): Number of gap days enriched concurrently. 1 keeps the serial path.
+        gap_threshold (float): Minimum gap up at the open, in percent.
+        lookback_days (int): Number of calendar days of history to scan, ending today.
+        enriched_days (dict or None): Previously enriched rows by 'YYYY-MM-DD'; qualifying days found
+                                      here are reused instead of fetching their intraday data again.
+    Returns:
+        list or None: A list of dictionaries, each representing a gap-up day with relevant data,
+                      or None if the daily bars could not be fetched.
+    """
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=lookback_days)
 
-    return cross_count
+    daily_df = fetch_daily_bars(ticker, polygon_client, start_date, end_date)
+    if daily_df is None:
+        return None
 
+    return enrich_gap_days(ticker, polygon_client, daily_df, gap_threshold, max_workers, enriched_days)
 
-def get_premarket_high_low_data(ticker, polygon_client, date_str):
+
+@timed('enrich_gap_up_day')
+def enrich_gap_up_day(ticker, polygon_client, gap_day):
     """
-    Fetches the daily high price, low price, and their timestamps for a given ticker and date
-    within the standard trading hours (9:30 AM to 4:00 PM EST).
+    Builds the result row for one gap-up day, fetching its intraday metrics.
 
     Args:
         ticker (str): The stock ticker symbol.
         polygon_client: The initialized Polygon.io RESTClient.
-        date_str (str): The date in 'YYYY-MM-DD' format.
+        gap_day (dict): A row of scan_gap_days with the day's daily bar and gap figures.
 
     Returns:
-        tuple: A tuple containing:
-            - max_high (float or None): The maximum high price for the day within trading hours.
-            - high_timestamp_est (str or None): The timestamp (HH:MM EST) of the daily high within trading hours.
-            - min_low (float or None): The minimum low price for the day within trading hours.
-            - low_timestamp_est (str or None): The timestamp (HH:MM EST) of the daily low within trading hours.
-            or (None, None, None, None) if data is not available or an error occurs.
+        dict: The gap-up day with relevant data.
     """
-    try:
-        est_timezone = pytz.timezone('America/New_York')
+    date_str = gap_day['date']
+    previous_day_close = gap_day['previous_close']
+    current_day_open = gap_day['open']
+    current_day_high = gap_day['high']
+    current_day_close = gap_day['close']
+
+    # Derive all intraday metrics from a single extended-hours 1-minute fetch
+    session_metrics = get_session_metrics(polygon_client, ticker, date_str, current_day_high)
+
+    # Fetch Daily Ticker Summary for pre-market open and after-hours close
+    daily_summary = None
+    summary_failed = False
+    if session_metrics is not None:
+        try:
+            with span('daily_summary'):
+                daily_summary = polygon_client.get_daily_open_close_agg(
+                    ticker=ticker,
+                    date=date_str,
+                    adjusted="true",
+                )
+        except Exception as e:
+            print(f"Error fetching daily summary for {ticker} on {date_str}: {e}")
+            from market_data.resilient import is_not_found
+            # Polygon has no summary for the day (404): nothing to retry
+            summary_failed = not is_not_found(e)
+
+    if session_metrics is None:
+        # The minute bars could not be fetched after their retries: leave every intraday field empty
+        # instead of storing made-up values. 'VWAP Crosses' stays None, so the row is not finalized
+        # and is fetched again. A missing daily summary only leaves premarket open and afterhours
+        # close empty; after a 404 the row is finalized on its minute-bar metrics, after any other
+        # failure it is marked incomplete and fetched again.
+        session_metrics = {}
+    current_day_high_time = session_metrics.get('day_high_time')
+    premarket_high = session_metrics.get('premarket_high')
+    premarket_high_time = session_metrics.get('premarket_high_time')
+    premarket_volume = session_metrics.get('premarket_volume')
+    vwap_crosses = session_metrics.get('vwap_crosses')
+    fade_category = session_fade_category(gap_day['runner_fader'], session_metrics, current_day_open)
+    premarket_open = daily_summary.pre_market if daily_summary and daily_summary.pre_market else None
+    afterhours_close = daily_summary.after_hours if daily_summary and daily_summary.after_hours else None
+
+    row = {
+        'date': date_str,
+        'pd close': previous_day_close,
+        'premarket open': premarket_open,
+        'premarket high': premarket_high,
+        'premarket high time': premarket_high_time,
+        'premarket volume': premarket_volume,  # Add pre-market volume
+        # 'premarket low' : premarket_low,
+        # 'premarket low time': premarket_low_time,
+        'open': current_day_open,
+        'gap up % at open': gap_day['gap_up_percent'],
+        'day high': current_day_high,
+        'day high time': current_day_high_time,
+        'day high %': gap_day['day_high_percent'],
+        # 'day low' : current_day_low,
+        # 'day low time': current_day_low_time,
+        # 'day low %': percent_gap_low,
+        'close price': current_day_close,
+        'closing percent': gap_day['closing_percent'],
+        'afterhours close': afterhours_close,
+        'total volume': gap_day['volume'],  # Add total volume
+        'VWAP Crosses': vwap_crosses,
+        'Runner/Fader': gap_day['runner_fader'],
+        '30 min high': session_metrics.get('high_30min'),
+        '30 min high time': session_metrics.get('high_30min_time'),
+        '30 min volume': session_metrics.get('volume_30min'),
+        'high within 30 min': session_metrics.get('high_within_30min'),
+        'fade category': fade_category,
+    }
+    if summary_failed:
+        row[INCOMPLETE_KEY] = True
+    return row
 
-        # Define the start and end times in EST for the trading day
-        start_datetime_est = est_timezone.localize(datetime.strptime(f"{date_str} 04:00", '%Y-%m-%d %H:%M'))
-        end_datetime_est = est_timezone.localize(datetime.strptime(f"{date_str} 9:30", '%Y-%m-%d %H:%M'))
 
-        # Convert EST datetimes to UTC timestamps (in milliseconds) for the API call
-        start_timestamp_utc_ms = int(start_datetime_est.timestamp() * 1000)
-        end_timestamp_utc_ms = int(end_datetime_est.timestamp() * 1000)
+def categorize_fade(runner_fader, high_within_30min, percent_high_from_open_30min):
+    """
+    Categorizes a 'Fader' day based on intraday price action.
 
-        # Fetch 1-minute bar data for the specified time range
-        aggs_data = polygon_client.list_aggs(
-            ticker=ticker,
-            multiplier=1,
-            timespan='minute',
-            from_=start_timestamp_utc_ms,
-            to=end_timestamp_utc_ms,
-            limit=50000  # Increased limit to get all bars for the specified range
-        )
-        aggs_list = list(aggs_data)
+    Args:
+        runner_fader (str): The 'Runner' or 'Fader' label for the day.
+        high_within_30min (bool): True if the daily high occurred within the first 30 minutes.
+        percent_high_from_open_30min (float or None): The percentage difference between the
+                                                    30-min high and the open price.
 
-        if not aggs_list:
-            print(f"No data available for {ticker} between 4:00 AM and 9:30 AM EST on {date_str}")
-            return None, None, None, None
+    Returns:
+        str or None: The fade category ('Straight Down Fade', 'Quick Swipe and Fade',
+                     'Steady gap up and Fade'), or None if not a Fader or category cannot be determined.
+    """
+    fade_category = None
+    if runner_fader == "Fader":
+        if high_within_30min and percent_high_from_open_30min is not None:
+            if percent_high_from_open_30min < 10:
+                fade_category = "Straight Down Fade"
+            elif 10 <= percent_high_from_open_30min < 40:
+                fade_category = "Quick Swipe and Fade"
+            elif 40 <= percent_high_from_open_30min < 100:
+                fade_category = "Steady gap up and Fade"
+        elif not high_within_30min:
+            fade_category = "Straight Down Fade"
+    return fade_category
 
-        # Find the maximum high price and its corresponding timestamp
-        max_high = -1
-        high_timestamp = None
-        min_low = float('inf')
-        low_timestamp = None
 
-        for bar in aggs_list:
-            if bar.high > max_high:
-                max_high = bar.high
-                high_timestamp = bar.timestamp
+def session_fade_category(runner_fader, session_metrics, open_price):
+    """
+    Categorizes a day from the first-30-minute metrics of its session (see compute_session_metrics).
 
-            if bar.low < min_low:
-                min_low = bar.low
-                low_timestamp = bar.timestamp
+    Returns:
+        str or None: See categorize_fade; None when the session has no bars in the first 30 minutes.
+    """
+    high_30min = session_metrics.get('high_30min')
+    if high_30min is None or not open_price:
+        return None
+    return categorize_fade(runner_fader, session_metrics['high_within_30min'],
+                           (high_30min - open_price) / open_price * 100)
 
-        high_timestamp_est = None
-        if high_timestamp:
-            high_datetime_utc = datetime.fromtimestamp(high_timestamp / 1000, tz=pytz.utc)
-            high_datetime_est = high_datetime_utc.astimezone(est_timezone)
-            high_timestamp_est = high_datetime_est.strftime('%H:%M')
 
-        low_timestamp_est = None
-        if low_timestamp:
-            low_datetime_utc = datetime.fromtimestamp(low_timestamp / 1000, tz=pytz.utc)
-            low_datetime_est = low_datetime_utc.astimezone(est_timezone)
-            low_timestamp_est = low_datetime_est.strftime('%H:%M')
+@bp.route('/')
+def index():
+    """Renders the home page with the stock ticker input form."""
+    return render_template('index.html', ticker_results={},
+                           gap_threshold=DEFAULT_GAP_THRESHOLD, lookback_days=DEFAULT_LOOKBACK_DAYS)
 
-        return max_high, high_timestamp_est, min_low, low_timestamp_est
 
-    except Exception as e:
-        print(f"Error fetching data for {ticker} on {date_str} between 4:00 AM and 9:30 AM EST: {e}")
-        return None, None, None, None
+def analyze_ticker(ticker, gap_threshold=DEFAULT_GAP_THRESHOLD, lookback_days=DEFAULT_LOOKBACK_DAYS, incremental=True):
+    """
+    Runs the gap-up analysis for one ticker with a configurable threshold and lookback.
 
+    Every gap day is upserted into the GapDay table, one row per (ticker, date) independently of
+    the threshold, so only qualifying days that were never enriched before trigger intraday fetches.
 
-def get_daily_high_low_data(ticker, polygon_client, date_str):
-    """
-    Fetches the daily high price, low price, and their timestamps for a given ticker and date
-    within the standard trading hours (9:30 AM to 4:00 PM EST).
+    In incremental mode, when the ticker's TickerScanState already covers the requested lookback
+    and threshold, only sessions after the last analyzed one are fetched (that session supplies the
+    prior close) and the result is read back from the stored gap days.
 
     Args:
         ticker (str): The stock ticker symbol.
-        polygon_client: The initialized Polygon.io RESTClient.
-        date_str (str): The date in 'YYYY-MM-DD' format.
+        gap_threshold (float): Minimum gap up at the open, in percent.
+        lookback_days (int): Number of calendar days of history to scan, ending today.
+        incremental (bool): Only analyze sessions newer than the last stored analysis when possible.
 
     Returns:
-        tuple: A tuple containing:
-            - max_high (float or None): The maximum high price for the day within trading hours.
-            - high_timestamp_est (str or None): The timestamp (HH:MM EST) of the daily high within trading hours.
-            - min_low (float or None): The minimum low price for the day within trading hours.
-            - low_timestamp_est (str or None): The timestamp (HH:MM EST) of the daily low within trading hours.
-            or (None, None, None, None) if data is not available or an error occurs.
+        list or None: A list of dictionaries, each representing a gap-up day with relevant data,
+                      or None if the daily bars could not be fetched.
     """
-    try:
-        est_timezone = pytz.timezone('America/New_York')
+    from analysis.gap_scan import last_finished_session
+    print(f"Analyzing gap ups for {ticker}...")
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=lookback_days)
+    today = datetime.now(pytz.timezone('America/New_York')).strftime('%Y-%m-%d')
+
+    with current_app.app_context():
+        state = db.session.get(TickerScanState, ticker)
+        refresh = incremental and state is not None and state.covers(start_date.isoformat(), gap_threshold)
+        if refresh:
+            # Scan new sessions at the stored threshold so the watermark keeps covering it, reaching
+            # back far enough to retry stored days that are not finalized (a week covers the prior close)
+            scan_from = datetime.strptime(state.scanned_through, '%Y-%m-%d').date()
+            pending = db.session.query(db.func.min(GapDay.date)).filter(
+                GapDay.ticker == ticker, GapDay.finalized.is_(False), GapDay.date >= start_date.isoformat()
+            ).scalar()
+            if pending is not None and pending <= state.scanned_through:
+                scan_from = datetime.strptime(pending, '%Y-%m-%d').date() - timedelta(days=7)
+            scan_threshold = state.gap_threshold
+        else:
+            scan_from = start_date
+            scan_threshold = gap_threshold
+
+        polygon_client = get_polygon_client()
+        daily_df = fetch_daily_bars(ticker, polygon_client, scan_from, end_date)
+        if daily_df is None:
+            return None
+
+        with span('db_read'):
+            enriched_days = load_enriched_days(ticker)
+        gap_up_days_list = enrich_gap_days(ticker, polygon_client, daily_df, scan_threshold,
+                                           max_workers=GAP_DAY_WORKERS, enriched_days=enriched_days)
+
+        with span('db_write'):
+            # The new gap days and the watermark are written in one transaction
+            upsert_gap_days(ticker, [row for row in gap_up_days_list if row['date'] not in enriched_days],
+                            finalized_before=today, commit=False)
+
+            scanned_through = last_finished_session(daily_df, today)
+            if refresh:
+                if scanned_through is not None and scanned_through > state.scanned_through:
+                    state.scanned_through = scanned_through
+            elif scanned_through is not None:
+                state = state or TickerScanState(ticker=ticker)
+                state.scanned_from = start_date.isoformat()
+                state.scanned_through = scanned_through
+                state.gap_threshold = gap_threshold
+                db.session.add(state)
+            db.session.commit()
+
+        if refresh:
+            # Merge: the stored gap days in the requested window, including the ones just added
+            with span('db_read'):
+                query = query_gap_days(ticker=ticker, min_gap=gap_threshold, start_date=start_date.isoformat())
+                gap_up_days_list = [gap_day.to_result() for gap_day in query]
+    return gap_up_days_list
+
+
+def analyze_ticker_cached(ticker, gap_threshold=DEFAULT_GAP_THRESHOLD, lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """
+    Serves analyze_ticker from the shared result cache, so a repeated lookup by any worker
+    returns without calling the API and concurrent identical lookups run the analysis once.
+    Results expire at the next session change; rewriting a ticker's gap days (upsert_gap_days,
+    update_gap_days, GapDayWriter) drops them earlier.
+
+    Returns:
+        list: A list of dictionaries, each representing a gap-up day, empty on error.
+    """
+    now = datetime.now(timezone.utc)
+    change_ms, live = next_session_change(int(now.timestamp() * 1000))
+    expires_at = change_ms / 1000
+    if live:
+        expires_at = min(expires_at, now.timestamp() + RESULT_CACHE_LIVE_SECONDS)
+    as_of = now.astimezone(pytz.timezone('America/New_York')).strftime('%Y-%m-%d')
 
-        # Define the start and end times in EST for the trading day
-        start_datetime_est = est_timezone.localize(datetime.strptime(f"{date_str} 09:30", '%Y-%m-%d %H:%M'))
-        end_datetime_est = est_timezone.localize(datetime.strptime(f"{date_str} 16:00", '%Y-%m-%d %H:%M'))
+    with current_app.app_context():
+        gap_up_days_list = cached_analysis(ticker, gap_threshold, lookback_days, as_of, expires_at,
+                                           lambda: analyze_ticker(ticker, gap_threshold, lookback_days),
+                                           lease_seconds=RESULT_CACHE_LEASE_SECONDS)
+    return gap_up_days_list or []
 
-        # Convert EST datetimes to UTC timestamps (in milliseconds) for the API call
-        start_timestamp_utc_ms = int(start_datetime_est.timestamp() * 1000)
-        end_timestamp_utc_ms = int(end_datetime_est.timestamp() * 1000)
 
-        # Fetch 1-minute bar data for the specified time range
-        aggs_data = polygon_client.list_aggs(
-            ticker=ticker,
-            multiplier=1,
-            timespan='minute',
-            from_=start_timestamp_utc_ms,
-            to=end_timestamp_utc_ms,
-            limit=50000  # Increased limit to get all bars for the specified range
-        )
-        aggs_list = list(aggs_data)
+def parse_analysis_options(form):
+    """
+    Reads the gap threshold and lookback from a submitted form.
+
+    Returns:
+        tuple: (gap_threshold, lookback_days), or raises ValueError for invalid input.
+    """
+    gap_threshold = float(form.get('gap_threshold') or DEFAULT_GAP_THRESHOLD)
+    lookback_days = int(form.get('lookback_days') or DEFAULT_LOOKBACK_DAYS)
+    if gap_threshold <= 0 or lookback_days <= 0:
+        raise ValueError("Gap threshold and lookback must be positive.")
+    return gap_threshold, lookback_days
 
-        if not aggs_list:
-            print(f"No data available for {ticker} between 9:30 AM and 4:00 PM EST on {date_str}")
-            return None, None, None, None
 
-        # Find the maximum high price and its corresponding timestamp
-        max_high = -1
-        high_timestamp = None
-        min_low = float('inf')
-        low_timestamp = None
+def parse_tickers(tickers_input):
+    """Splits the comma separated ticker form input into a list of upper-case symbols."""
+    return [t.strip() for t in tickers_input.strip().upper().split(',') if t.strip()]
 
-        for bar in aggs_list:
-            if bar.high > max_high:
-                max_high = bar.high
-                high_timestamp = bar.timestamp
 
-            if bar.low < min_low:
-                min_low = bar.low
-                low_timestamp = bar.timestamp
+@bp.route('/analyze', methods=['POST'])
+def analyze():
+    """Handles the ticker input, fetches data, and displays the results."""
+    tickers_input = request.form['ticker'].strip().upper()
+    if not tickers_input:
+        return render_template('index.html', error="Please enter a ticker symbol.", ticker_results={})
 
-        high_timestamp_est = None
-        if high_timestamp:
-            high_datetime_utc = datetime.fromtimestamp(high_timestamp / 1000, tz=pytz.utc)
-            high_datetime_est = high_datetime_utc.astimezone(est_timezone)
-            high_timestamp_est = high_datetime_est.strftime('%H:%M')
+    tickers = parse_tickers(tickers_input)
+    if not tickers:
+        return render_template('index.html', error="Please enter at least one valid ticker.",
+                               ticker_results={})
 
-        low_timestamp_est = None
-        if low_timestamp:
-            low_datetime_utc = datetime.fromtimestamp(low_timestamp / 1000, tz=pytz.utc)
-            low_datetime_est = low_datetime_utc.astimezone(est_timezone)
-            low_timestamp_est = low_datetime_est.strftime('%H:%M')
+    try:
+        gap_threshold, lookback_days = parse_analysis_options(request.form)
+    except ValueError:
+        return render_template('index.html', error="Please enter a positive gap threshold and lookback.",
+                               ticker_results={})
 
-        return max_high, high_timestamp_est, min_low, low_timestamp_est
+    if get_polygon_client() is None:
+        return render_template('index.html', error="Polygon API client not initialized. Check API key.",
+                               ticker_results={})
 
-    except Exception as e:
-        print(f"Error fetching data for {ticker} on {date_str} between 9:30 AM and 4:00 PM EST: {e}")
-        return None, None, None, None
+    # Fetch all tickers concurrently (or read them from the result cache)
+    gap_up_days_lists = run_concurrently(
+        lambda ticker: analyze_ticker_cached(ticker, gap_threshold, lookback_days),
+        tickers,
+        TICKER_WORKERS
+    )
 
+    # analyze_ticker has already stored every gap day in the database: the page only gets the counts
+    # and loads each table a page at a time from /api/gap-days
+    ticker_results = {ticker: len(gap_up_days_list) for ticker, gap_up_days_list in zip(tickers, gap_up_days_lists)}
+    start_date = (datetime.now().date() - timedelta(days=lookback_days)).isoformat()
 
-def get_premarket_volume(polygon_client, ticker, date_str):
-    """
-    Fetches the total volume for a given ticker and date during the pre-market hours (4:00 AM to 9:30 AM EST).
+    with span('render'):
+        return render_template('index.html', ticker_results=ticker_results, start_date=start_date,
+                               gap_threshold=gap_threshold, lookback_days=lookback_days)
 
-    Args:
-        polygon_client: The initialized Polygon.io RESTClient.
-        ticker (str): The stock ticker symbol.
-        date_str (str): The date in 'YYYY-MM-DD' format.
 
-    Returns:
-        float: The total pre-market volume, or 0.0 if no data is available or an error occurs.
-    """
+@bp.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queues a background analysis job and returns its id immediately."""
+    tickers = parse_tickers(request.form.get('ticker', ''))
+    if not tickers:
+        return jsonify(error="Please enter at least one valid ticker."), 400
+
     try:
-        est_timezone = pytz.timezone('America/New_York')
+        gap_threshold, lookback_days = parse_analysis_options(request.form)
+    except ValueError:
+        return jsonify(error="Please enter a positive gap threshold and lookback."), 400
 
-        # Define the start and end times in EST for the pre-market session
-        start_datetime_est = est_timezone.localize(datetime.strptime(f"{date_str} 04:00", '%Y-%m-%d %H:%M'))
-        end_datetime_est = est_timezone.localize(datetime.strptime(f"{date_str} 09:30", '%Y-%m-%d %H:%M'))
+    if get_polygon_client() is None:
+        return jsonify(error="Polygon API client not initialized. Check API key."), 503
 
-        # Convert EST datetimes to UTC timestamps (in milliseconds) for the API call
-        start_timestamp_utc_ms = int(start_datetime_est.timestamp() * 1000)
-        end_timestamp_utc_ms = int(end_datetime_est.timestamp() * 1000)
+    job_id = current_app.extensions['job_queue'].submit(tickers, gap_threshold, lookback_days)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job_id=job_id, status_url=url_for('gap_up.get_job_status', job_id=job_id),
+                       results_url=url_for('gap_up.get_job_results', job_id=job_id)), 202
+    return redirect(url_for('gap_up.get_job_results', job_id=job_id))
 
-        # Fetch 1-minute bar data for the specified pre-market range
-        aggs_data = polygon_client.list_aggs(
-            ticker=ticker,
-            multiplier=1,
-            timespan='minute',
-            from_=start_timestamp_utc_ms,
-            to=end_timestamp_utc_ms,
-            limit=50000  # Increased limit to get all bars for the specified range
-        )
-        aggs_list = list(aggs_data)
 
-        if not aggs_list:
-            # print(f"No pre-market data available for {ticker} on {date_str}")
-            return 0.0
+@bp.route('/jobs/<job_id>')
+def get_job_status(job_id):
+    """Reports the per-ticker progress of a background job as JSON."""
+    job = db.session.get(AnalysisJob, job_id)
+    if job is None:
+        return jsonify(error="Job not found."), 404
+    return jsonify(job_status(job))
 
-        # Calculate the total volume in the pre-market period
-        premarket_total_volume = sum(bar.volume for bar in aggs_list)
 
-        return premarket_total_volume
+@bp.route('/jobs/<job_id>/results')
+def get_job_results(job_id):
+    """Renders the tickers of a background job that have finished so far."""
+    job = db.session.get(AnalysisJob, job_id)
+    if job is None:
+        return "Job not found.", 404
 
-    except Exception as e:
-        print(f"Error fetching pre-market data for {ticker} on {date_str}: {e}")
-        return 0.0  # Return 0.0 on error
+    start_date = (job.created_at.date() - timedelta(days=job.lookback_days)).isoformat()
+    ticker_results = {job_ticker.ticker: job_ticker.gap_up_days or 0
+                      for job_ticker in job.tickers if job_ticker.status == 'done'}
 
+    return render_template('index.html', ticker_results=ticker_results, start_date=start_date,
+                           job=job_status(job), gap_threshold=job.gap_threshold, lookback_days=job.lookback_days)
 
-def get_gap_up_day_stats(ticker, polygon_client):
-    """
-    Analyzes historical data for a given ticker to identify significant gap-ups.
 
-    Args:
-        ticker (str): The stock ticker symbol.
-        polygon_client: The initialized Polygon.io RESTClient.
-    Returns:
-        list: A list of dictionaries, each representing a gap-up day with relevant data.
-    """
-    user_input_gap_up = 25
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=1095)  # Fetch data for the last 3 years
+# Page size of /api/gap-days: default and upper bound
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 
-    try:
-        aggs_data = polygon_client.list_aggs(
-            ticker=ticker,
-            multiplier=1,
-            timespan='day',
-            from_=start_date.strftime('%Y-%m-%d'),
-            to=end_date.strftime('%Y-%m-%d'),
-            adjusted='true',
-            limit=10000
-        )
-        aggs_list = list(aggs_data)
-    except Exception as e:
-        print(f"Error fetching daily data for {ticker}: {e}")
-        return []  # Return empty list on error
-
-    gap_up_days = []
-
-    for i in range(1, len(aggs_list)):
-        previous_day_agg = aggs_list[i - 1]
-        current_day_agg = aggs_list[i]
-
-        previous_day_close = previous_day_agg.close
-        current_day_open = current_day_agg.open
-        current_day_volume = current_day_agg.volume  # Get total volume for the day
-
-        if previous_day_close is not None and current_day_open is not None:
-            gap_up_percent = ((current_day_open - previous_day_close) / previous_day_close) * 100
-
-            if gap_up_percent >= user_input_gap_up:
-
-                current_day_high = current_day_agg.high
-
-                date_str = datetime.fromtimestamp(current_day_agg.timestamp / 1000).strftime('%Y-%m-%d')
-                current_day_high_time = get_daily_high_low_data(ticker, polygon_client, date_str)[1]
-                # print('current_day_high_time:', current_day_high_time)
-                current_day_close = current_day_agg.close
-                current_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                percent_gap_high = ((
-                                            current_day_high - previous_day_close) / previous_day_close) * 100 if previous_day_close is not None else None
-                closing_percent = ((
-                                           current_day_close - previous_day_close) / previous_day_close) * 100 if previous_day_close is not None else None
-
-                # Fetch pre-market volume using the new function
-                premarket_volume = get_premarket_volume(polygon_client, ticker, date_str)
-
-                # Fetch Daily Ticker Summary for pre-market open, high, and after-hours close
-                try:
-                    daily_summary = polygon_client.get_daily_open_close_agg(
-                        ticker=ticker,
-                        date=date_str,
-                        adjusted="true",
-                    )
-                    premarket_open = daily_summary.pre_market if daily_summary.pre_market else None
-                    # Re-fetch premarket high and time using the specific premarket range to ensure accuracy
-                    premarket_high, premarket_high_time, _, _ = get_premarket_high_low_data(ticker, polygon_client,
-                                                                                            date_str)
-                    afterhours_close = daily_summary.after_hours if daily_summary.after_hours else None
-                except Exception as e:
-                    print(f"Error fetching daily summary for {ticker} on {date_str}: {e}")
-                    premarket_open = None
-                    premarket_high = None
-                    premarket_high_time = None
-                    afterhours_close = None
-
-                # Determine if the day was a Runner or Fader
-                runner_fader = "Runner" if current_day_close > current_day_open else (
-                    "Fader" if current_day_close < current_day_open else "Neutral")
-
-                # Count VWAP crosses
-                vwap_crosses = count_vwap_crosses(polygon_client, ticker, date_str)
-
-                gap_up_days.append({
-                    'date': date_str,
-                    'pd close': previous_day_close,
-                    'premarket open': premarket_open,
-                    'premarket high': premarket_high,
-                    'premarket high time': premarket_high_time,
-                    'premarket volume': premarket_volume,  # Add pre-market volume
-                    # 'premarket low' : premarket_low,
-                    # 'premarket low time': premarket_low_time,
-                    'open': current_day_open,
-                    'gap up % at open': gap_up_percent,
-                    'day high': current_day_high,
-                    'day high time': current_day_high_time,
-                    'day high %': percent_gap_high,
-                    # 'day low' : current_day_low,
-                    # 'day low time': current_day_low_time,
-                    # 'day low %': percent_gap_low,
-                    'close price': current_day_close,
-                    'closing percent': closing_percent,
-                    'afterhours close': afterhours_close,
-                    'total volume': current_day_volume,  # Add total volume
-                    'VWAP Crosses': vwap_crosses,
-                    'Runner/Fader': runner_fader,
-
-                })
-    # print (gap_up_days)
-    return gap_up_days
-
-
-def fetch_intraday_1_min(polygon_client, ticker, date_str):
-    """
-    Fetches intraday 1-minute bar data for a given ticker and date for the first 30 minutes.
 
-    Args:
-        polygon_client: The initialized Polygon.io RESTClient.
-        ticker (str): The stock ticker symbol.
-        date_str (str): The date in 'YYYY-MM-DD' format.
+def parse_gap_day_filters(args):
+    """
+    Reads the query_gap_days filters of /api/gap-days: ticker, min_gap, max_gap, runner_fader,
+    start_date and end_date (YYYY-MM-DD), or days as a lookback ending today.
 
     Returns:
-        list: A list of intraday 1-minute bar aggregates for the first 30 minutes, or an empty list on error.
+        dict: Keyword arguments of query_gap_days, or raises ValueError for invalid input.
+    """
+    filters = {
+        'ticker': args.get('ticker', '').strip().upper() or None,
+        'min_gap': float(args['min_gap']) if args.get('min_gap') else None,
+        'max_gap': float(args['max_gap']) if args.get('max_gap') else None,
+        'runner_fader': args.get('runner_fader') or None,
+        'start_date': args.get('start_date') or None,
+        'end_date': args.get('end_date') or None,
+    }
+    if args.get('days'):
+        filters['start_date'] = (datetime.now().date() - timedelta(days=int(args['days']))).isoformat()
+    for key in ('start_date', 'end_date'):
+        if filters[key] is not None:
+            filters[key] = datetime.strptime(filters[key], '%Y-%m-%d').date().isoformat()
+    return filters
+
+
+def _json_value(value):
+    """Replaces NaN, which JSON cannot represent, with None."""
+    return None if isinstance(value, float) and value != value else value
+
+
+@bp.route('/api/gap-days')
+def api_gap_days():
+    """
+    Returns one page of the stored gap days as JSON.
+
+    Query parameters: the filters of parse_gap_day_filters, sort (a column name, default date),
+    order (asc or desc), page (1-based) and per_page (default 50, at most 500).
     """
     try:
-        est_timezone = pytz.timezone('America/New_York')
-        # Define the start and end times in EST for the first 30 minutes of trading
-        start_datetime_est = est_timezone.localize(datetime.strptime(f"{date_str} 09:30", '%Y-%m-%d %H:%M'))
-        end_datetime_est = est_timezone.localize(datetime.strptime(f"{date_str} 10:00", '%Y-%m-%d %H:%M'))
+        filters = parse_gap_day_filters(request.args)
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(MAX_PAGE_SIZE, max(1, int(request.args.get('per_page', DEFAULT_PAGE_SIZE))))
+    except ValueError:
+        return jsonify(error="Invalid filter, page or date."), 400
+    sort = request.args.get('sort', 'date')
+    if sort not in SORTABLE_COLUMNS:
+        return jsonify(error=f"Cannot sort by '{sort}'. Use one of: {', '.join(SORTABLE_COLUMNS)}."), 400
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+
+    with span('db_read'):
+        total, gap_days = page_gap_days(query_gap_days(**filters), sort, order == 'desc', page, per_page)
+    return jsonify(
+        total=total,
+        page=page,
+        per_page=per_page,
+        pages=(total + per_page - 1) // per_page,
+        sort=sort,
+        order=order,
+        columns=[{'name': column, 'label': label} for label, column in
+                 [('ticker', 'ticker'), *GapDay.RESULT_COLUMNS.items()]],
+        rows=[{column: _json_value(getattr(gap_day, column)) for column in SORTABLE_COLUMNS} for gap_day in gap_days],
+    )
+
+
+@bp.route('/api/gap-stats')
+def api_gap_stats():
+    """
+    Returns cross-ticker statistics of the stored gap days as JSON, from the incrementally
+    maintained gap_stat cells.
 
-        # Convert EST datetimes to UTC timestamps (in milliseconds) for the API call
-        start_timestamp_utc_ms = int(start_datetime_est.timestamp() * 1000)
-        end_timestamp_utc_ms = int(end_datetime_est.timestamp() * 1000)
+    Query parameters: group_by (comma separated dimensions, e.g. gap_bucket,runner_fader; none for
+    one overall row), and per dimension a comma separated list of accepted labels, e.g.
+    year=2024,2025 or gap_bucket=50-75,75-100.
+    """
+    group_by = [dimension.strip() for dimension in request.args.get('group_by', '').split(',') if dimension.strip()]
+    unknown = [dimension for dimension in group_by if dimension not in GAP_STAT_DIMENSIONS]
+    if unknown:
+        return jsonify(error=f"Cannot group by '{unknown[0]}'. Use any of: {', '.join(GAP_STAT_DIMENSIONS)}."), 400
+    filters = {dimension: request.args[dimension].split(',')
+               for dimension in GAP_STAT_DIMENSIONS if request.args.get(dimension)}
 
-        intraday_aggs_data = polygon_client.list_aggs(
-            ticker=ticker,
-            multiplier=1,
-            timespan='minute',
-            from_=start_timestamp_utc_ms,
-            to=end_timestamp_utc_ms,
-            limit=50000  # Increased limit to ensure all bars in the 30 mins are fetched
-        )
-        return list(intraday_aggs_data)
-    except Exception as e:
-        print(f"Error fetching intraday data for {ticker} on {date_str}: {e}")
-        return []
+    with span('db_read'):
+        rows = query_gap_stats(group_by, filters)
+    return jsonify(group_by=group_by, filters=filters, rows=rows)
 
 
-# Function from cell IwB-XnhKIW6f
-import pdb  # Keep import here for now, will remove if not needed
+@bp.route('/api/gappers')
+def api_gappers():
+    """Returns the latest gapper ranking written by the watch-gaps command."""
+    try:
+        with open(GAPPERS_SNAPSHOT_PATH) as snapshot_file:
+            return jsonify(json.load(snapshot_file))
+    except FileNotFoundError:
+        return jsonify(error="No gap watcher is running. Start one with: flask --app app watch-gaps"), 404
 
 
-def analyze_intraday_first_30_mins(intraday_aggs_list, daily_high):
+@bp.route('/scan')
+def scan():
     """
-    Analyzes intraday 1-minute bar data for the first 30 minutes of trading.
-
-    Args:
-        intraday_aggs_list (list): A list of intraday 1-minute bar aggregates.
-        daily_high (float): The high price for the entire trading day.
+    Scans the whole market for gap-ups using the local grouped daily store.
 
-    Returns:
-        tuple: A tuple containing:
-            - max_price_30min (float or None): The maximum price within the first 30 minutes.
-            - max_price_30min_timestamp (str or None): The timestamp (HH:MM) of the 30-min high.
-            - high_within_30min (bool): True if the daily high occurred within the first 30 minutes.
-            - volume_30min (float): The total volume within the first 30 minutes.
+    Query parameters: min_gap (percent, default 25), days (lookback, default 1095) and
+    enrich=1 to add the intraday metrics of every candidate.
     """
-    max_price_30min = None
-    max_price_30min_timestamp = None
-    interval_start_time = time(9, 30)
-    interval_end_time_30min = time(10, 0)
-    high_within_30min = False
-    bars_in_30min = []
-    volume_30min = 0  # Initialize volume for the first 30 minutes
-
-    est_timezone = pytz.timezone('America/New_York')  # Define est_timezone here
-
-    for bar in intraday_aggs_list:
-
-        bar_datetime_utc = datetime.fromtimestamp(bar.timestamp / 1000, tz=pytz.utc)  # Assume timestamp is in UTC
-        bar_datetime_est = bar_datetime_utc.astimezone(est_timezone)  # Convert to EST
-        bar_time = bar_datetime_est.time()
-
-        # pdb.set_trace() # Removed pdb trace
+    from analysis.universe_scan import fetch_splits, scan_universe
+    end_date = datetime.now().date()
+    try:
+        gap_threshold = float(request.args.get('min_gap', DEFAULT_GAP_THRESHOLD))
+        start_date = end_date - timedelta(days=int(request.args.get('days', DEFAULT_LOOKBACK_DAYS)))
+    except (ValueError, OverflowError):
+        return jsonify(error="Invalid min_gap or days."), 400
 
-        if interval_start_time <= bar_time < interval_end_time_30min:
-            # print('inside the intraday-aggs-list on ' + str(bar_datetime_est.strftime('%Y-%m-%d')) ) # Use EST datetime for printing
-            bars_in_30min.append(bar)
-            volume_30min += bar.volume  # Add volume of the bar
+    polygon_client = get_polygon_client()
+    if polygon_client is None:
+        return jsonify(error="Polygon API client not initialized. Check API key."), 503
+    # The stored snapshots are unadjusted; without the splits every split would look like a gap
+    splits = fetch_splits(polygon_client, start_date)
+    if splits is None:
+        return jsonify(error="Could not fetch splits from Polygon."), 503
+
+    candidates = scan_universe(get_grouped_daily_store(), splits, gap_threshold, start_date, end_date)
+    gap_days = candidates.drop(columns=['timestamp']).to_dict('records')
+
+    if request.args.get('enrich') == '1':
+        enriched = run_concurrently(
+            lambda gap_day: enrich_gap_up_day(gap_day['ticker'], polygon_client, gap_day),
+            gap_days,
+            TICKER_WORKERS * GAP_DAY_WORKERS
+        )
+        gap_days = [{'ticker': gap_day['ticker'], **row} for gap_day, row in zip(gap_days, enriched)]
 
-    if not bars_in_30min:
-        return None, None, False, 0  # Return 0 for volume if no bars in 30 mins
+    return jsonify(gap_days)
 
-    # Initialize max_price_30min with the high of the first bar
-    max_price_30min = bars_in_30min[0].high
-    # print('max_price_30min for RELI on: ' + str(datetime.fromtimestamp(bars_in_30min[0].timestamp / 1000).strftime('%Y-%m-%d')) + ' = ' + str( max_price_30min)) #datetime.strptime(date_str, '%Y-%m-%d').date()
-    max_price_30min_timestamp = datetime.fromtimestamp(bars_in_30min[0].timestamp / 1000, tz=pytz.utc).astimezone(
-        est_timezone).strftime('%H:%M')  # Convert and format timestamp
 
-    for bar in bars_in_30min:
-        if bar.high > max_price_30min:  # Corrected comparison to find max high
-            # print('bar.high:', bar.high)
-            max_price_30min = bar.high
-            max_price_30min_timestamp = datetime.fromtimestamp(bar.timestamp / 1000, tz=pytz.utc).astimezone(
-                est_timezone).strftime('%H:%M')  # Store as HH:MM string and convert timezone
+@bp.cli.command('sync-grouped-daily')
+@click.option('--days', default=DEFAULT_LOOKBACK_DAYS, help='Number of calendar days to cover, ending today.')
+def sync_grouped_daily_command(days):
+    """Fetches the grouped daily bars missing from the local store (one API call per date)."""
+    from analysis.universe_scan import sync_grouped_daily
+    end_date = datetime.now().date()
+    fetched = sync_grouped_daily(get_polygon_client(), get_grouped_daily_store(), end_date - timedelta(days=days),
+                                 end_date)
+    print(f"Fetched grouped daily bars for {fetched} dates.")
 
-        if bar.high == daily_high:
-            high_within_30min = True
 
-    return max_price_30min, max_price_30min_timestamp, high_within_30min, volume_30min  # Return volume_30min
+@bp.cli.command('rebuild-gap-stats')
+def rebuild_gap_stats_command():
+    """Recomputes the gap statistics behind /api/gap-stats from every stored gap day."""
+    print(f"Rebuilt {rebuild_gap_stats()} gap statistics cells.")
 
 
-def categorize_fade(runner_fader, high_within_30min, percent_high_from_open_30min):
+@bp.cli.command('ingest-flat-files')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--processes', default=os.cpu_count() or 4, help='Minute files ingested in parallel.')
+@click.option('--timespan', type=click.Choice(('minute', 'day')), default=None,
+              help="Timespan of the files; read from Polygon's minute_aggs/day_aggs directories by default.")
+def ingest_flat_files_command(paths, processes, timespan):
     """
-    Categorizes a 'Fader' day based on intraday price action.
+    Ingests Polygon aggregates flat files (YYYY-MM-DD.csv.gz, or directories of them) into the
+    local bar store, which then serves those dates instead of the REST API.
+    """
+    from market_data.flat_files import FlatFileBarStore, find_flat_files, flat_file_timespan, ingest_flat_file, \
+        FLAT_FILE_TIMESPANS
+    store_dir = POLYGON_CLIENT_OPTIONS['bar_store_dir']
+    files = find_flat_files(paths)
+    by_timespan = {name: [path for path in files if (timespan or flat_file_timespan(path)) == name]
+                   for name in FLAT_FILE_TIMESPANS}
+    skipped = len(files) - sum(len(group) for group in by_timespan.values())
+    if skipped:
+        print(f"Skipping {skipped} files outside a minute_aggs or day_aggs directory (use --timespan).")
+
+    started = datetime.now()
+    rows = 0
+    input_bytes = 0
+
+    def report(path, count):
+        nonlocal rows, input_bytes
+        rows += count
+        input_bytes += os.path.getsize(path)
+        print(f"{path}: {count} bars")
+
+    # Day files of one month share a store file, so they are ingested one at a time
+    store = FlatFileBarStore(store_dir)
+    for path in by_timespan['day']:
+        try:
+            report(path, store.ingest(path, 'day'))
+        except Exception as e:
+            print(f"Error ingesting {path}: {e}")
+    with ProcessPoolExecutor(max_workers=max(1, processes)) as executor:
+        futures = {executor.submit(ingest_flat_file, store_dir, path, 'minute'): path for path in by_timespan['minute']}
+        for future in as_completed(futures):
+            try:
+                report(futures[future], future.result())
+            except Exception as e:
+                print(f"Error ingesting {futures[future]}: {e}")
+
+    seconds = max((datetime.now() - started).total_seconds(), 1e-9)
+    print(f"Ingested {rows} bars from {input_bytes / 1e6:.1f} MB in {seconds:.1f} s "
+          f"({rows / seconds:,.0f} bars/s, {input_bytes / 1e6 / seconds:.1f} MB/s).")
+
+
+@bp.cli.command('watch-gaps')
+@click.option('--replay', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Replay a minute-aggregates file (flat-file CSV) instead of the live feed.')
+@click.option('--speed', type=float, default=None, help='Replay speed (60 = a minute per second); full speed by default.')
+@click.option('--date', 'session_date', default=None, help='Session date, YYYY-MM-DD; from the replay file name or today.')
+@click.option('--tickers', default=None, help='Comma separated symbols of the live feed; all by default.')
+@click.option('--top', default=20, help='Gappers shown.')
+@click.option('--min-gap', default=float(DEFAULT_GAP_THRESHOLD), help='Minimum gap, in percent.')
+@click.option('--min-premarket-volume', default=0.0, help='Minimum premarket volume.')
+@click.option('--interval', default=5.0, help='Seconds between ranking updates.')
+def watch_gaps_command(replay, speed, session_date, tickers, top, min_gap, min_premarket_volume, interval):
+    """
+    Streams minute bars and keeps a ranked list of today's gappers, printed every --interval
+    seconds and served by /api/gappers. Needs the previous session in the grouped daily store.
+    """
+    import pandas as pd
+    from analysis.gap_watcher import GapWatcher, load_previous_closes
+    from analysis.universe_scan import fetch_splits
+    from market_data.feeds import ReplayFeed, PolygonLiveFeed
+    from market_data.flat_files import flat_file_date
+    if session_date is None:
+        session_date = (flat_file_date(replay) if replay else None) or datetime.now(pytz.timezone('America/New_York')).date()
+    else:
+        session_date = datetime.strptime(session_date, '%Y-%m-%d').date()
+    polygon_client = get_polygon_client()
+    splits = fetch_splits(polygon_client, session_date, session_date) if polygon_client else None
+    if splits is None:
+        print("Splits executing on the session are not applied to the previous closes.")
+    previous_closes = load_previous_closes(get_grouped_daily_store(), session_date, splits)
+    if not previous_closes:
+        print("No grouped daily bars for the previous session. Run sync-grouped-daily first.")
+        return
+
+    watcher = GapWatcher(session_date.isoformat(), previous_closes)
+    feed = ReplayFeed(replay, speed=speed) if replay else PolygonLiveFeed(
+        POLYGON_CLIENT_OPTIONS['api_key'], parse_choices(tickers, str.upper) if tickers else None)
+
+    def report():
+        gappers = watcher.top(top, min_gap, min_premarket_volume)
+        as_of = format_local_time(watcher.last_timestamp) if watcher.last_timestamp else None
+        snapshot = {'session_date': session_date.isoformat(), 'as_of': as_of, 'tickers': len(watcher.tickers),
+                    'gappers': [{key: _json_value(value) for key, value in row.items()} for row in gappers]}
+        os.makedirs(os.path.dirname(GAPPERS_SNAPSHOT_PATH), exist_ok=True)
+        temporary_path = GAPPERS_SNAPSHOT_PATH + '.tmp'
+        with open(temporary_path, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(temporary_path, GAPPERS_SNAPSHOT_PATH)
+
+        print(f"\n{session_date} {as_of}: {len(watcher.tickers)} tickers, {watcher.bars_seen} bars")
+        if gappers:
+            columns = ['ticker', 'gap %', 'price', 'premarket high', 'premarket high time', 'premarket volume',
+                       'VWAP Crosses']
+            print(pd.DataFrame(gappers)[columns].round(2).to_string(index=False))
+
+    last_report = None
+    for batch in feed:
+        watcher.update(batch)
+        if last_report is None or (datetime.now() - last_report).total_seconds() >= interval:
+            report()
+            last_report = datetime.now()
+    report()
+
+
+def parse_choices(value, cast):
+    """Parses a comma separated CLI option into a list of values."""
+    return [cast(part.strip()) for part in value.split(',') if part.strip()]
+
+
+@bp.cli.command('backtest')
+@click.option('--ticker', default=None, help='Only the gap days of this ticker.')
+@click.option('--min-gap', type=float, default=None, help='Minimum gap up at the open, in percent.')
+@click.option('--max-gap', type=float, default=None, help='Maximum gap up at the open, in percent.')
+@click.option('--runner-fader', type=click.Choice(('Runner', 'Fader', 'Neutral')), default=None)
+@click.option('--start-date', default=None, help='First date, YYYY-MM-DD.')
+@click.option('--end-date', default=None, help='Last date, YYYY-MM-DD.')
+@click.option('--entry', default='market', help=f"Entry rules, comma separated: {', '.join(ENTRY_RULES)}.")
+@click.option('--entry-minute', default='0', help='Entry minutes after 09:30, comma separated.')
+@click.option('--stop', default='20', help='Stop distances in percent, comma separated (0 = none).')
+@click.option('--target', default='0', help='Profit targets in percent, comma separated (0 = none).')
+@click.option('--exit-minute', default='390', help='Time exits in minutes after 09:30, comma separated.')
+@click.option('--side', type=click.Choice(SIDES), default='short')
+@click.option('--cost', type=float, default=0.0, help='Round-trip costs, in percent.')
+@click.option('--processes', default=os.cpu_count() or 4, help='Worker processes of the sweep.')
+@click.option('--fetch-workers', default=GAP_DAY_WORKERS, help='Gap days whose bars are loaded concurrently.')
+@click.option('--top', default=20, help='Parameter sets printed, best average return first.')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='CSV of every parameter set.')
+@click.option('--trades-output', type=click.Path(dir_okay=False), default=None,
+              help='CSV of the trades of the best parameter set.')
+def backtest_command(ticker, min_gap, max_gap, runner_fader, start_date, end_date, entry, entry_minute, stop, target,
+                     exit_minute, side, cost, processes, fetch_workers, top, output, trades_output):
+    """
+    Backtests intraday rules over the stored gap days, e.g. shorting at 10:00 with a 20% stop:
+    flask --app app backtest --entry-minute 30 --stop 10,20,30 --target 0,25.
+    """
+    import pandas as pd
+    from analysis.backtest import load_sessions, parameter_grid, run_sweep, simulate, trade_frame
+    polygon_client = get_polygon_client()
+    if polygon_client is None:
+        print("Polygon API client not initialized. Check API key.")
+        return
+    gap_days = [{'ticker': gap_day.ticker, 'date': gap_day.date, 'gap up % at open': gap_day.gap_up_percent,
+                 'Runner/Fader': gap_day.runner_fader}
+                for gap_day in query_gap_days(ticker=ticker, min_gap=min_gap, max_gap=max_gap, runner_fader=runner_fader,
+                                              start_date=start_date, end_date=end_date)]
+    try:
+        param_sets = parameter_grid(entry=parse_choices(entry, str), entry_minute=parse_choices(entry_minute, int),
+                                    stop_percent=parse_choices(stop, float), target_percent=parse_choices(target, float),
+                                    exit_minute=parse_choices(exit_minute, int), side=[side], cost_percent=[cost])
+    except ValueError as e:
+        print(f"Invalid parameter list: {e}")
+        return
+
+    started = datetime.now()
+    session = load_sessions(polygon_client, gap_days, max_workers=fetch_workers)
+    loaded_seconds = (datetime.now() - started).total_seconds()
+    print(f"Loaded {len(session['days'])} of {len(gap_days)} gap days in {loaded_seconds:.1f} s.")
+    if not len(session['days']):
+        return
+
+    started = datetime.now()
+    try:
+        results = run_sweep(session, param_sets, processes=processes)
+    except ValueError as e:
+        print(f"Invalid parameters: {e}")
+        return
+    print(f"Evaluated {len(param_sets)} parameter sets in {(datetime.now() - started).total_seconds():.2f} s.")
+
+    results_df = pd.DataFrame(results).sort_values('avg_return', ascending=False, na_position='last')
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results_df.head(top).round(2).to_string(index=False))
+    if output:
+        results_df.to_csv(output, index=False)
+    if trades_output:
+        best = {name: results_df.iloc[0][name] for name in param_sets[0]}
+        trade_frame(session, simulate(session, best)).to_csv(trades_output, index=False)
+
+
+@bp.cli.command('batch-analyze')
+@click.argument('ticker_file', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('--processes', default=os.cpu_count() or 4, help='Worker processes.')
+@click.option('--gap-day-workers', default=GAP_DAY_WORKERS, help='Gap days enriched concurrently per process.')
+@click.option('--requests-per-minute', default=POLYGON_REQUESTS_PER_MINUTE,
+              help='Polygon request budget shared by all processes (0 = unlimited).')
+@click.option('--gap-threshold', default=float(DEFAULT_GAP_THRESHOLD), help='Minimum gap up at the open, in percent.')
+@click.option('--lookback-days', default=DEFAULT_LOOKBACK_DAYS, help='Calendar days of history, ending today.')
+@click.option('--format', 'output_format', type=click.Choice(('parquet', 'csv')), default='parquet',
+              help='Format of the result partitions.')
+@click.option('--partition-size', default=100, help='Tickers per result partition.')
+@click.option('--store', is_flag=True, help='Also upsert the results into the gap_day table, one transaction per partition.')
+def batch_analyze_command(ticker_file, output_dir, processes, gap_day_workers, requests_per_minute, gap_threshold,
+                          lookback_days, output_format, partition_size, store):
+    """
+    Analyzes every ticker of TICKER_FILE (one or more comma separated symbols per line) into raw
+    Parquet or CSV partitions in OUTPUT_DIR. Rerunning with the same OUTPUT_DIR resumes after the
+    tickers already stored.
+    """
+    from batch import read_ticker_file, run_batch
+    if get_polygon_client() is None:
+        print("Polygon API client not initialized. Check API key.")
+        return
+    writer = GapDayWriter()
+    today = datetime.now(pytz.timezone('America/New_York')).strftime('%Y-%m-%d')
+
+    def store_partition(partition_rows):
+        for ticker, rows in itertools.groupby(partition_rows, key=lambda row: row['ticker']):
+            writer.add(ticker, list(rows), finalized_before=today)
+        writer.flush()
+
+    tickers = read_ticker_file(ticker_file)
+    summary = run_batch(
+        tickers,
+        get_gap_up_day_stats,
+        output_dir,
+        client_options={**POLYGON_CLIENT_OPTIONS, 'pool_size': max(1, gap_day_workers)},
+        token_bucket=SharedTokenBucket(requests_per_minute),
+        processes=processes,
+        partition_size=partition_size,
+        output_format=output_format,
+        analyze_options={'max_workers': gap_day_workers, 'gap_threshold': gap_threshold,
+                         'lookback_days': lookback_days},
+        on_partition=store_partition if store else None,
+    )
+    print(f"Analyzed {summary['done']} tickers ({summary['gap_up_days']} gap up days), "
+          f"{summary['failed']} failed, {summary['skipped']} already stored.")
+
+
+@bp.cli.command('import-legacy-results')
+def import_legacy_results_command():
+    """Copies the latest legacy JSON result of every ticker into the gap_day table."""
+    print(f"Imported {import_legacy_results()} gap days.")
+
+
+def backfill_fade_categories(polygon_client, gap_days, fetch_workers=GAP_DAY_WORKERS, chunk_size=500):
+    """
+    Fills the first-30-minute fields and the fade category of stored gap days.
+
+    Each day's extended-hours series is requested exactly as the analysis requests it, so the
+    bar cache (and the flat-file store) serves the days already fetched without an API call.
+    Every chunk of days is then reduced at once by first_30_min_metrics and written with one
+    UPDATE.
 
     Args:
-        runner_fader (str): The 'Runner' or 'Fader' label for the day.
-        high_within_30min (bool): True if the daily high occurred within the first 30 minutes.
-        percent_high_from_open_30min (float or None): The percentage difference between the
-                                                    30-min high and the open price.
+        polygon_client: The initialized Polygon.io RESTClient.
+        gap_days (list): Dicts with ticker, date, open, day_high and runner_fader of the days to fill.
+        fetch_workers (int): Gap days whose bars are loaded concurrently.
+        chunk_size (int): Gap days loaded, computed and committed together.
 
     Returns:
-        str or None: The fade category ('Straight Down Fade', 'Quick Swipe and Fade',
-                     'Steady gap up and Fade'), or None if not a Fader or category cannot be determined.
+        tuple: (gap days filled, gap days whose bars could not be loaded).
     """
-    fade_category = None
-    if runner_fader == "Fader":
-        if high_within_30min and percent_high_from_open_30min is not None:
-            if percent_high_from_open_30min < 10:
-                fade_category = "Straight Down Fade"
-            elif 10 <= percent_high_from_open_30min < 40:
-                fade_category = "Quick Swipe and Fade"
-            elif 40 <= percent_high_from_open_30min < 100:
-                fade_category = "Steady gap up and Fade"
-        elif not high_within_30min:
-            fade_category = "Straight Down Fade"
-    return fade_category
-
-
-@app.route('/')
-def index():
-    """Renders the home page with the stock ticker input form."""
-    return render_template('index.html', all_tickers_gap_up_results={})
-
+    filled = failed = 0
+    for start in range(0, len(gap_days), chunk_size):
+        chunk = gap_days[start:start + chunk_size]
+        chunk_bars = run_concurrently(
+            lambda gap_day: fetch_session_bars(polygon_client, gap_day['ticker'], gap_day['date']),
+            chunk,
+            fetch_workers
+        )
+        loaded = [(gap_day, bars) for gap_day, bars in zip(chunk, chunk_bars) if bars is not None]
+        failed += len(chunk) - len(loaded)
+
+        sessions_metrics = first_30_min_metrics([(bars, gap_day['date'], gap_day['day_high'])
+                                                 for gap_day, bars in loaded])
+        update_gap_days([{
+            'ticker': gap_day['ticker'],
+            'date': gap_day['date'],
+            **session_metrics,
+            'fade_category': session_fade_category(gap_day['runner_fader'], session_metrics, gap_day['open']),
+        } for (gap_day, _), session_metrics in zip(loaded, sessions_metrics)])
+        filled += len(loaded)
+        print(f"Filled {filled} of {len(gap_days)} gap days.")
+    return filled, failed
+
+
+@bp.cli.command('backfill-fade-categories')
+@click.option('--ticker', default=None, help='Restrict to one ticker.')
+@click.option('--refill', is_flag=True, help='Recompute days that already have the fields.')
+@click.option('--fetch-workers', default=GAP_DAY_WORKERS, help='Gap days whose bars are loaded concurrently.')
+@click.option('--chunk-size', default=500, help='Gap days computed and committed together.')
+def backfill_fade_categories_command(ticker, refill, fetch_workers, chunk_size):
+    """Fills the 30-minute high, time and volume, high-within-30-min flag and fade category of stored gap days."""
+    polygon_client = get_polygon_client()
+    if polygon_client is None:
+        print("Polygon API client not initialized. Check API key.")
+        return
+    query = query_gap_days(ticker=ticker.upper() if ticker else None)
+    if not refill:
+        query = query.filter(GapDay.high_within_30min.is_(None))
+    gap_days = [{'ticker': gap_day.ticker, 'date': gap_day.date, 'open': gap_day.open, 'day_high': gap_day.day_high,
+                 'runner_fader': gap_day.runner_fader} for gap_day in query]
+    filled, failed = backfill_fade_categories(polygon_client, gap_days, fetch_workers, chunk_size)
+    print(f"Filled {filled} gap days, {failed} could not be loaded.")
+
+
+def download_filters(args):
+    """
+    Reads the min_gap and days query parameters of the download routes into query_gap_days filters.
 
-@app.route('/analyze', methods=['POST'])
-def analyze():
-    """Handles the ticker input, fetches data, and displays the results."""
-    tickers_input = request.form['ticker'].strip().upper()
-    if not tickers_input:
-        return render_template('index.html', error="Please enter a ticker symbol.", all_tickers_gap_up_results={})
+    Returns:
+        dict: Keyword arguments of query_gap_days, or raises ValueError for invalid input.
+    """
+    lookback_days = int(args.get('days', DEFAULT_LOOKBACK_DAYS))
+    try:
+        start_date = datetime.now().date() - timedelta(days=lookback_days)
+    except OverflowError:
+        raise ValueError(f"days out of range: {lookback_days}")
+    return {
+        'min_gap': float(args.get('min_gap', DEFAULT_GAP_THRESHOLD)),
+        'start_date': start_date.isoformat(),
+    }
 
-    tickers = [t.strip() for t in tickers_input.split(',') if t.strip()]
-    if not tickers:
-        return render_template('index.html', error="Please enter at least one valid ticker.",
-                               all_tickers_gap_up_results={})
 
-    if polygon_client is None:
-        return render_template('index.html', error="Polygon API client not initialized. Check API key.",
-                               all_tickers_gap_up_results={})
+def export_response(query, download_basename):
+    """
+    Exports the rows of a GapDay query in the format chosen by the format query parameter.
 
-    global all_tickers_gap_up_results
-    all_tickers_gap_up_results = {}
+    CSV is streamed as it is read; Parquet and Excel are written batch by batch into a
+    temporary file, so memory stays flat regardless of how many tickers are exported.
+    """
+    # export imports pyarrow and xlsxwriter
+    from export import EXPORT_FORMATS, stream_csv, write_parquet, write_excel
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return f"Unsupported format '{export_format}'. Use one of: {', '.join(EXPORT_FORMATS)}.", 400
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    download_name = f'{download_basename}.{extension}'
+
+    if export_format == 'csv':
+        return Response(stream_with_context(stream_csv(query)), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={download_name}'})
+    output = write_parquet(query) if export_format == 'parquet' else write_excel(query)
+    return send_file(output, mimetype=mimetype, download_name=download_name, as_attachment=True)
+
+
+@bp.route('/download/<ticker>')
+def download_excel(ticker):
+    """Provides the analysis results of one ticker for download (format=xlsx, csv or parquet)."""
+    try:
+        query = query_gap_days(ticker=ticker, **download_filters(request.args))
+    except ValueError:
+        return "Invalid min_gap or days.", 400
+    if query.first() is None:
+        return "Data not found for this ticker.", 404
+    return export_response(query, f'{ticker}_gap_up_analysis')
 
-    for ticker in tickers:
-        print(f"Analyzing gap ups for {ticker}...")
-        gap_up_days_list = get_gap_up_day_stats(ticker, polygon_client)
-        if not gap_up_days_list:
-            all_tickers_gap_up_results[ticker] = pd.DataFrame()  # Empty DataFrame for no results
-            continue
 
-        gap_up_results_df = pd.DataFrame(gap_up_days_list)
+@bp.route('/download/all')
+def download_all_excel():
+    """Provides the stored gap days of every ticker for download (format=xlsx, csv or parquet)."""
+    try:
+        query = query_gap_days(**download_filters(request.args))
+    except ValueError:
+        return "Invalid min_gap or days.", 400
+    if query.first() is None:
+        return "No data available to download.", 404
+    return export_response(query, 'all_gap_up_analysis')
 
-        # Store the results in SQLite database
 
-        result_json = gap_up_results_df.to_json(orient='records')
-        gapup = GapUpResult(ticker=ticker, result_json=result_json)
-        db.session.add(gapup)
-        db.session.commit()
+def init_db():
+    """
+    Creates or upgrades the database schema and builds the gap statistics if they are missing.
+    Run it once per deploy (flask --app app init-db), before the web workers start.
+    """
+    print("Creating tables...")
+    upgrade_schema()
+    db.create_all()
+    ensure_gap_stats()
 
-        # Format the percentage columns
-        for col in ['gap up % at open', 'day high %', 'closing percent']:
-            if col in gap_up_results_df.columns:
-                gap_up_results_df[col] = gap_up_results_df[col].apply(lambda x: f'{x:.2f}%' if pd.notna(x) else '')
 
-        # Format volume columns in millions
-        for col in ['total volume', '30min volume', 'premarket volume']:
-            if col in gap_up_results_df.columns:
-                gap_up_results_df[col] = gap_up_results_df[col].apply(
-                    lambda x: f'{x / 1_000_000:.2f}M' if pd.notna(x) and x > 0 else (
-                        '0M' if pd.notna(x) and x == 0 else ''))
+@bp.cli.command('init-db')
+def init_db_command():
+    """Creates or upgrades the database tables; run before starting the web workers."""
+    init_db()
 
-        all_tickers_gap_up_results[ticker] = gap_up_results_df
 
-    return render_template('index.html', all_tickers_gap_up_results=all_tickers_gap_up_results)
+def preload_modules():
+    """
+    Imports LAZY_MODULES now, e.g. in a gunicorn master that preloads the app (gunicorn.conf.py),
+    so forked workers share them instead of importing them on their first request.
+    """
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
 
 
-@app.route('/download/<ticker>')
-def download_excel(ticker):
-    """Provides the analysis results as an Excel file for download."""
-    gapup = GapUpResult.query.filter_by(ticker=ticker).order_by(GapUpResult.created_at.desc()).first()
-    if gapup:
-        df = pd.read_json(gapup.result_json)
-        output = io.BytesIO()
-        writer = pd.ExcelWriter(output, engine='xlsxwriter')
-        df.to_excel(writer, index=False, sheet_name=f'{ticker}_GapUps')
-        writer.close()
-        output.seek(0)
-        return send_file(output, download_name=f'{ticker}_gap_up_analysis.xlsx', as_attachment=True)
-    else:
-        return "Data not found for this ticker.", 404
+def create_app(config=None):
+    """
+    Builds the Flask application (gunicorn 'app:create_app()', flask --app app).
 
+    Nothing here connects to the database, the Polygon API or the bar cache, and no thread is
+    started, so the app can be built in a gunicorn master and forked into workers. The schema is
+    set up by init-db; the Polygon client is built on first use (get_polygon_client).
 
-@app.route('/download/all')
-def download_all_excel():
-    gapups = GapUpResult.query.order_by(GapUpResult.ticker, GapUpResult.created_at.desc()).all()
-    if not gapups:
-        return "No data available to download.", 404
+    Args:
+        config (dict or None): Settings applied over the environment defaults, e.g. a test database.
 
-    output = io.BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    tickers_added = set()
-    for gapup in gapups:
-        if gapup.ticker not in tickers_added:
-            # df = pd.read_json(gapup.result_json)
-            df = pd.read_json(io.StringIO(gapup.result_json))
-            if not df.empty:
-                # writer.sheets = {}  # Fix for xlsxwriter bug
-                df.to_excel(writer, index=False, sheet_name=gapup.ticker[:31])
-            tickers_added.add(gapup.ticker)
-    writer.close()
-    output.seek(0)
-    return send_file(output, download_name="all_gap_up_analysis.xlsx", as_attachment=True)
-
-
-# Note: In a production environment, you would not run app.run() directly.
-# You would use a production-ready WSGI server like Gunicorn.
-# if __name__ == '__main__':
-#     with app.app_context():
-#         db.create_all()
-#     app.run(debug=True)
+    Returns:
+        Flask: The application.
+    """
+    app = Flask(__name__)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'DATABASE_URL', 'sqlite:///gap_up_analysis.db'
+    )
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config or {})
+
+    # Database engine: connection pool of a server database, and the SQLite pragmas (WAL journal,
+    # synchronous level, how long a writer waits for the lock)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(
+        app.config['SQLALCHEMY_DATABASE_URI'],
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    ))
+
+    db.init_app(app)
+    with app.app_context():
+        # Registers the pragmas for new connections; the engine connects on first use
+        configure_sqlite(db.engine, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS)
+
+    app.register_blueprint(bp)
+
+    # Background queue for analysis jobs submitted through /jobs; its threads start with the first job
+    app.extensions['job_queue'] = JobQueue(app, analyze_ticker_cached, max_workers=TICKER_WORKERS)
+    return app
@@ -0,0 +1,187 @@
+# batch.py
+"""
+Headless batch runner for large ticker lists.
+
+Tickers are analyzed on a process pool. Each worker process builds its own Polygon client and
+takes its tokens from one shared rate budget. Raw numeric results (no '%' or 'M' formatting)
+are written to numbered Parquet or CSV partitions. A checkpoint file records the tickers of
+each partition once it is on disk, so a run that crashed or was stopped resumes with the
+tickers that are not stored yet.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from export import EXPORT_HEADERS, PARQUET_SCHEMA
+from market_data.client import build_polygon_client
+
+BATCH_FORMATS = ('parquet', 'csv')
+CHECKPOINT_FILE = 'checkpoint.jsonl'
+
+# Polygon client of the current worker process, built by _init_worker
+_worker_client = None
+
+
+def read_ticker_file(path):
+    """
+    Reads a ticker list: one or more comma separated symbols per line, '#' starts a comment.
+
+    Returns:
+        list: Upper-case symbols in file order, without duplicates.
+    """
+    tickers = {}
+    with open(path) as ticker_file:
+        for line in ticker_file:
+            for symbol in line.split('#', 1)[0].split(','):
+                if symbol.strip():
+                    tickers.setdefault(symbol.strip().upper(), None)
+    return list(tickers)
+
+
+def read_checkpoint(output_dir):
+    """
+    Reads the checkpoint of a batch output directory.
+
+    Returns:
+        tuple: (set of tickers already stored, number of partitions written).
+    """
+    done = set()
+    partitions = set()
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if os.path.exists(path):
+        with open(path) as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash
+                if entry.get('status') == 'done':
+                    done.add(entry['ticker'])
+                    partitions.add(entry['partition'])
+    return done, len(partitions)
+
+
+def write_partition(output_dir, number, rows, output_format):
+    """
+    Writes the result rows of one partition, atomically.
+
+    Args:
+        output_dir (str): The batch output directory.
+        number (int): Partition number, used in the file name.
+        rows (list): Result rows with a 'ticker' key plus the get_gap_up_day_stats keys.
+        output_format (str): 'parquet' or 'csv'.
+
+    Returns:
+        str: The partition file name.
+    """
+    name = f"part-{number:05d}.{output_format}"
+    path = os.path.join(output_dir, name)
+    temporary_path = path + '.tmp'
+    if output_format == 'parquet':
+        table = pa.Table.from_pylist([{header: row.get(header) for header in EXPORT_HEADERS} for row in rows],
+                                     schema=PARQUET_SCHEMA)
+        pq.write_table(table, temporary_path)
+    else:
+        with open(temporary_path, 'w', newline='') as partition_file:
+            writer = csv.writer(partition_file)
+            writer.writerow(EXPORT_HEADERS)
+            writer.writerows([row.get(header) for header in EXPORT_HEADERS] for row in rows)
+    os.replace(temporary_path, path)
+    return name
+
+
+def _init_worker(client_options, token_bucket):
+    global _worker_client
+    _worker_client = build_polygon_client(token_bucket=token_bucket, **client_options)
+
+
+def _analyze_in_worker(analyze, ticker, analyze_options):
+    """Runs analyze for one ticker in a worker process; returns (ticker, rows or None, error or None)."""
+    try:
+        rows = analyze(ticker, _worker_client, **analyze_options)
+    except Exception as e:
+        return ticker, None, str(e)
+    if rows is None:
+        return ticker, None, 'fetch failed'
+    return ticker, rows, None
+
+
+def run_batch(tickers, analyze, output_dir, client_options, token_bucket, processes=4, partition_size=100,
+              output_format='parquet', analyze_options=None, on_partition=None):
+    """
+    Analyzes tickers on a process pool and writes their result rows to partitions.
+
+    Args:
+        tickers (list): Symbols to analyze; the ones already in the checkpoint are skipped.
+        analyze (callable): analyze(ticker, polygon_client, **analyze_options) -> rows, or None on
+                            failure. Must be a module-level function so worker processes can run it.
+        output_dir (str): Directory of the partitions and the checkpoint; created if missing.
+        client_options (dict): Keyword arguments of build_polygon_client, except token_bucket.
+        token_bucket (SharedTokenBucket): The rate budget shared by every worker process.
+        processes (int): Worker processes.
+        partition_size (int): Tickers per partition file.
+        output_format (str): 'parquet' or 'csv'.
+        analyze_options (dict or None): Extra keyword arguments of analyze.
+        on_partition (callable or None): Called with the rows of each partition once its file is
+                                         written and before its tickers are checkpointed, e.g. to
+                                         store them in the database as well.
+
+    Returns:
+        dict: Counts of tickers 'done', 'failed' and 'skipped' (already stored), and 'gap_up_days' written.
+    """
+    if output_format not in BATCH_FORMATS:
+        raise ValueError(f"Unsupported format '{output_format}'. Use one of: {', '.join(BATCH_FORMATS)}.")
+    os.makedirs(output_dir, exist_ok=True)
+    done, partition_count = read_checkpoint(output_dir)
+    pending = [ticker for ticker in tickers if ticker not in done]
+    summary = {'done': 0, 'failed': 0, 'skipped': len(tickers) - len(pending), 'gap_up_days': 0}
+    if summary['skipped']:
+        print(f"Resuming: {summary['skipped']} tickers already stored, {len(pending)} to go.")
+
+    checkpoint_file = open(os.path.join(output_dir, CHECKPOINT_FILE), 'a')
+    partition_rows = []
+    partition_tickers = []
+
+    def flush():
+        nonlocal partition_count, partition_rows, partition_tickers
+        if not partition_tickers:
+            return
+        name = write_partition(output_dir, partition_count, partition_rows, output_format)
+        if on_partition is not None:
+            on_partition(partition_rows)
+        for ticker, gap_up_days in partition_tickers:
+            checkpoint_file.write(json.dumps({'ticker': ticker, 'status': 'done', 'gap_up_days': gap_up_days,
+                                              'partition': name}) + '\n')
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+        partition_count += 1
+        partition_rows, partition_tickers = [], []
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, processes), initializer=_init_worker,
+                                 initargs=(client_options, token_bucket)) as executor:
+            futures = [executor.submit(_analyze_in_worker, analyze, ticker, analyze_options or {})
+                       for ticker in pending]
+            for completed, future in enumerate(as_completed(futures), start=1):
+                ticker, rows, error = future.result()
+                if error is not None:
+                    summary['failed'] += 1
+                    checkpoint_file.write(json.dumps({'ticker': ticker, 'status': 'failed', 'error': error}) + '\n')
+                    print(f"[{completed}/{len(pending)}] Error analyzing {ticker}: {error}")
+                    continue
+
+                summary['done'] += 1
+                summary['gap_up_days'] += len(rows)
+                partition_rows.extend({'ticker': ticker, **row} for row in rows)
+                partition_tickers.append((ticker, len(rows)))
+                print(f"[{completed}/{len(pending)}] {ticker}: {len(rows)} gap up days")
+                if len(partition_tickers) >= partition_size:
+                    flush()
+        flush()
+    finally:
+        checkpoint_file.close()
+    return summary
@@ -0,0 +1,134 @@
+# cold_start_benchmark.py
+"""
+Cold start of a web worker: how long a fresh process takes to import the app, build it and
+serve its first requests.
+
+Every run starts a new interpreter, as a gunicorn worker without preload_app does, and reports:
+
+    import     import app
+    create     create_app() (trees without the factory build the app while importing)
+    first /    the first GET / through the test client
+    first api  the first GET /api/gap-days
+    process    interpreter start to the end of the first requests, measured outside the process
+
+With --preload the app is built once and LAZY_MODULES are imported (preload_modules), then every
+run forks from that process, as gunicorn workers do with preload_app; import and create are paid
+once by the master and each worker reports only its first requests.
+
+--repo points at another checkout, e.g. a git worktree of an earlier commit, to compare against it.
+
+Usage:
+    python benchmarks/cold_start_benchmark.py [--runs 7] [--repo PATH] [--preload]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as time_module
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+PHASES = ('import', 'create', 'first /', 'first api', 'process')
+
+# Runs in the measured process; prints the phase times of one worker as JSON
+WORKER_SCRIPT = '''
+import json, os, sys, time
+started = time.perf_counter()
+import app as gap_up_app
+imported = time.perf_counter()
+flask_app = gap_up_app.create_app() if hasattr(gap_up_app, 'create_app') else gap_up_app.app
+created = time.perf_counter()
+
+
+def first_requests():
+    begin = time.perf_counter()
+    client = flask_app.test_client()
+    assert client.get('/').status_code == 200
+    index = time.perf_counter()
+    assert client.get('/api/gap-days').status_code == 200
+    return {'first /': index - begin, 'first api': time.perf_counter() - index}
+
+
+if os.environ.get('COLD_START_PRELOAD') != '1':
+    print(json.dumps({'import': imported - started, 'create': created - imported, **first_requests()}))
+    sys.exit(0)
+
+gap_up_app.preload_modules()
+for _ in range(int(os.environ['COLD_START_RUNS'])):
+    read_end, write_end = os.pipe()
+    forked = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        timings = first_requests()
+        timings['process'] = time.perf_counter() - forked
+        os.write(write_end, json.dumps(timings).encode())
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as child_output:
+        print(child_output.read())
+    os.waitpid(pid, 0)
+'''
+
+
+def prepare_database(repo, env):
+    """Creates the scratch database's schema once, so no run pays for it."""
+    subprocess.run([sys.executable, '-c', 'import app\n'
+                    'if hasattr(app, "init_db"):\n'
+                    '    flask_app = app.create_app()\n'
+                    '    with flask_app.app_context():\n'
+                    '        app.init_db()'],
+                   cwd=repo, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def run_cold(repo, env, runs):
+    """Starts a fresh process per run; returns one dict of phase seconds per run."""
+    results = []
+    for _ in range(runs):
+        started = time_module.perf_counter()
+        output = subprocess.run([sys.executable, '-c', WORKER_SCRIPT], cwd=repo, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        timings['process'] = time_module.perf_counter() - started
+        results.append(timings)
+    return results
+
+
+def run_preloaded(repo, env, runs):
+    """Builds the app once and forks a worker per run; returns one dict of phase seconds per run."""
+    output = subprocess.run([sys.executable, '-c', WORKER_SCRIPT], cwd=repo, check=True, capture_output=True,
+                            text=True, env={**env, 'COLD_START_PRELOAD': '1', 'COLD_START_RUNS': str(runs)}).stdout
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold start of a web worker.')
+    parser.add_argument('--runs', type=int, default=7, help='Worker starts measured; medians are reported.')
+    parser.add_argument('--repo', default=REPO_DIR, help='Checkout whose app is measured.')
+    parser.add_argument('--preload', action='store_true', help='Fork workers from a preloaded app.')
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.mkdtemp(prefix='gap-up-cold-start-')
+    env = {**os.environ,
+           'DATABASE_URL': 'sqlite:///' + os.path.join(scratch_dir, 'cold_start.db'),
+           'BAR_CACHE_PATH': os.path.join(scratch_dir, 'bar_cache.db'),
+           'GROUPED_DAILY_DIR': os.path.join(scratch_dir, 'grouped_daily')}
+    env.setdefault('POLYGON_API_KEY', 'benchmark')
+
+    repo = os.path.abspath(args.repo)
+    prepare_database(repo, env)
+    results = run_preloaded(repo, env, args.runs) if args.preload else run_cold(repo, env, args.runs)
+
+    print(f"{repo}: {len(results)} {'forked' if args.preload else 'cold'} worker starts, median seconds")
+    for phase in PHASES:
+        values = [timings[phase] for timings in results if phase in timings]
+        if values:
+            print(f"{phase:<12}{statistics.median(values):>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
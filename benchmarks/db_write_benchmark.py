@@ -0,0 +1,161 @@
+# db_write_benchmark.py
+"""
+Throughput of the gap_day write path under concurrent writers.
+
+Several writer processes store synthetic result rows into a scratch database at the same time
+and the benchmark reports rows per second for each write mode:
+
+    per_row     one upsert and commit per row
+    per_ticker  one upsert_gap_days call (one transaction) per ticker
+    buffered    a GapDayWriter per process, one transaction per flush
+
+The database settings of the app apply, so running with SQLITE_JOURNAL_MODE=delete (or
+SQLITE_SYNCHRONOUS=FULL) compares against the rollback journal, and DATABASE_URL can point at
+a PostgreSQL server instead of the scratch SQLite file.
+
+Usage:
+    python benchmarks/db_write_benchmark.py [--writers 4] [--tickers 50] [--rows-per-ticker 40]
+                                            [--modes per_row,per_ticker,buffered]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time as time_module
+from datetime import date, timedelta
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix='gap-up-db-benchmark-')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(SCRATCH_DIR, 'benchmark.db'))
+os.environ['BAR_CACHE_PATH'] = os.path.join(SCRATCH_DIR, 'bar_cache.db')
+os.environ.setdefault('POLYGON_API_KEY', 'benchmark')
+
+import app as gap_up_app  # noqa: E402
+from database.dbmodel import db, GapDay, GapStat  # noqa: E402
+from database.gap_days import GapDayWriter, upsert_gap_days  # noqa: E402
+
+flask_app = gap_up_app.create_app()
+
+WRITE_MODES = ('per_row', 'per_ticker', 'buffered')
+
+
+def synthetic_rows(ticker, count, seed):
+    """Builds result rows in the get_gap_up_day_stats format for consecutive dates."""
+    rng = random.Random(seed)
+    first = date(2020, 1, 2)
+    rows = []
+    for offset in range(count):
+        previous_close = rng.uniform(1, 20)
+        open_price = previous_close * rng.uniform(1.2, 3)
+        day_high = open_price * rng.uniform(1, 1.5)
+        close = open_price * rng.uniform(0.5, 1.5)
+        rows.append({
+            'date': (first + timedelta(days=offset)).strftime('%Y-%m-%d'),
+            'pd close': previous_close,
+            'premarket open': previous_close * rng.uniform(1, 2),
+            'premarket high': open_price * rng.uniform(1, 1.2),
+            'premarket high time': '08:15',
+            'premarket volume': rng.uniform(1e5, 1e7),
+            'open': open_price,
+            'gap up % at open': (open_price / previous_close - 1) * 100,
+            'day high': day_high,
+            'day high time': '09:45',
+            'day high %': (day_high / open_price - 1) * 100,
+            'close price': close,
+            'closing percent': (close / open_price - 1) * 100,
+            'afterhours close': close * rng.uniform(0.9, 1.1),
+            'total volume': rng.uniform(1e6, 1e8),
+            'VWAP Crosses': rng.randint(0, 20),
+            'Runner/Fader': rng.choice(('Runner', 'Fader', 'Neutral')),
+        })
+    return rows
+
+
+def _writer(mode, writer_index, tickers, rows_per_ticker, start_barrier, results):
+    with flask_app.app_context():
+        db.engine.dispose(close=False)  # Connections inherited from the parent belong to it
+        batches = [(ticker, synthetic_rows(ticker, rows_per_ticker, hash((writer_index, ticker)))) for ticker in tickers]
+        start_barrier.wait()
+        started = time_module.perf_counter()
+        if mode == 'per_row':
+            for ticker, rows in batches:
+                for row in rows:
+                    upsert_gap_days(ticker, [row], finalized_before='2100-01-01')
+        elif mode == 'per_ticker':
+            for ticker, rows in batches:
+                upsert_gap_days(ticker, rows, finalized_before='2100-01-01')
+        else:
+            with GapDayWriter() as writer:
+                for ticker, rows in batches:
+                    writer.add(ticker, rows, finalized_before='2100-01-01')
+        results.put(time_module.perf_counter() - started)
+
+
+def run_mode(mode, writers, tickers, rows_per_ticker):
+    """
+    Runs one write mode with concurrent writer processes on an empty gap_day table.
+
+    Returns:
+        dict: Rows written, wall seconds (first start to last finish) and rows per second.
+    """
+    with flask_app.app_context():
+        GapDay.query.delete()
+        GapStat.query.delete()
+        db.session.commit()
+        db.engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    start_barrier = context.Barrier(writers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_writer, args=(mode, index, [f"W{index}T{number:04d}" for number in range(tickers)],
+                                              rows_per_ticker, start_barrier, results))
+        for index in range(writers)
+    ]
+    for process in processes:
+        process.start()
+    start_barrier.wait()
+    started = time_module.perf_counter()
+    for _ in processes:
+        results.get()
+    seconds = time_module.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    with flask_app.app_context():
+        stored = GapDay.query.count()
+    expected = writers * tickers * rows_per_ticker
+    if stored != expected:
+        print(f"Warning: {mode} stored {stored} rows, expected {expected}")
+    return {'rows': stored, 'seconds': round(seconds, 3), 'rows_per_second': round(stored / seconds)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure gap_day write throughput under concurrent writers.')
+    parser.add_argument('--writers', type=int, default=4, help='Concurrent writer processes.')
+    parser.add_argument('--tickers', type=int, default=50, help='Tickers written by each process.')
+    parser.add_argument('--rows-per-ticker', type=int, default=40, help='Gap up days per ticker.')
+    parser.add_argument('--modes', default=','.join(WRITE_MODES), help='Comma separated write modes.')
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = [mode for mode in modes if mode not in WRITE_MODES]
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(unknown)}. Use: {', '.join(WRITE_MODES)}.")
+
+    with flask_app.app_context():
+        gap_up_app.init_db()
+    print(f"Database: {flask_app.config['SQLALCHEMY_DATABASE_URI']} "
+          f"(journal_mode={gap_up_app.SQLITE_JOURNAL_MODE}, synchronous={gap_up_app.SQLITE_SYNCHRONOUS})")
+    print(f"{args.writers} writers x {args.tickers} tickers x {args.rows_per_ticker} rows")
+    for mode in modes:
+        result = run_mode(mode, args.writers, args.tickers, args.rows_per_ticker)
+        print(f"{mode:<12}{result['rows']:>8} rows{result['seconds']:>9.2f} s{result['rows_per_second']:>10} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+# fake_polygon.py
+"""
+Drop-in stand-in for the Polygon RESTClient used by the benchmarks.
+
+FakeRESTClient answers list_aggs, get_daily_open_close_agg, get_grouped_daily_aggs and
+list_splits from recorded fixtures or from deterministic synthetic bars (with no splits), sleeps for a configurable injected
+latency per call, and counts calls, bars returned and time spent per endpoint.
+RecordingClient wraps a real client and captures its responses as a fixture file.
+"""
+import json
+import random
+import threading
+import time as time_module
+import zlib
+from collections import Counter
+from datetime import datetime, date, timedelta
+
+import numpy as np
+import pytz
+from polygon.rest.models import Agg, DailyOpenCloseAgg, GroupedDailyAgg, Split
+
+from market_data.trading_calendar import is_trading_day
+
+est_timezone = pytz.timezone('America/New_York')
+
+AGG_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'vwap', 'timestamp', 'transactions')
+
+
+def _request_key(endpoint, *parts):
+    return ':'.join([endpoint] + [str(part) for part in parts])
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.astimezone(est_timezone).date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, int):
+        return datetime.fromtimestamp(value / 1000, tz=pytz.utc).astimezone(est_timezone).date()
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _to_ms(value, end_of_day=False):
+    if isinstance(value, int):
+        return value
+    session_date = _to_date(value)
+    midnight = est_timezone.localize(datetime(session_date.year, session_date.month, session_date.day))
+    if end_of_day:
+        midnight += timedelta(days=1)
+    return int(midnight.timestamp() * 1000) - (1 if end_of_day else 0)
+
+
+class TickerProfile:
+    """
+    Shape of a ticker's synthetic history.
+
+    Args:
+        gap_probability (float): Share of sessions that open with a large gap up.
+        price (float): Typical price level.
+        daily_volume (float): Typical daily volume.
+    """
+
+    def __init__(self, gap_probability=0.06, price=5.0, daily_volume=2_000_000):
+        self.gap_probability = gap_probability
+        self.price = price
+        self.daily_volume = daily_volume
+
+
+class FakeRESTClient:
+    """
+    Replays fixtures or synthesizes bars in place of the Polygon RESTClient.
+
+    Synthetic bars are seeded by ticker and by the number of weekdays between the session and
+    today, so a workload sees the same history whichever day it runs on (up to the sessions that
+    enter and leave a calendar-day lookback window).
+
+    Args:
+        latency_ms (float): Injected latency per call, in milliseconds.
+        profiles (dict or None): ticker -> TickerProfile; other tickers use default_profile.
+        default_profile (TickerProfile or None): Profile for tickers not in profiles.
+        fixtures (dict or None): Recorded responses keyed by request, as written by RecordingClient.
+    """
+
+    def __init__(self, latency_ms=0.0, profiles=None, default_profile=None, fixtures=None):
+        self.latency_ms = latency_ms
+        self.profiles = profiles or {}
+        self.default_profile = default_profile or TickerProfile()
+        self.fixtures = fixtures or {}
+        self.today = datetime.now(est_timezone).date()
+        self.calls = Counter()
+        self.bars = Counter()
+        self.api_seconds = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_fixture_file(cls, path, **kwargs):
+        with open(path) as fixture_file:
+            return cls(fixtures=json.load(fixture_file), **kwargs)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.bars.clear()
+            self.api_seconds.clear()
+
+    def _record(self, endpoint, bars, started):
+        if self.latency_ms:
+            time_module.sleep(self.latency_ms / 1000)
+        with self._lock:
+            self.calls[endpoint] += 1
+            self.bars[endpoint] += bars
+            self.api_seconds[endpoint] += time_module.perf_counter() - started
+
+    def _seed_key(self, ticker, session_date, *salt):
+        return _request_key(ticker, int(np.busday_count(session_date, self.today)), *salt)
+
+    def _random(self, ticker, session_date, *salt):
+        return random.Random(self._seed_key(ticker, session_date, *salt))
+
+    def _daily_bar(self, ticker, session_date):
+        profile = self.profiles.get(ticker, self.default_profile)
+        rng = self._random(ticker, session_date, 'day')
+        previous_session = session_date - timedelta(days=1)
+        while not is_trading_day(previous_session):
+            previous_session -= timedelta(days=1)
+        previous_close = profile.price * (0.9 + 0.2 * self._random(ticker, previous_session, 'close').random())
+        gap = 1.25 + rng.random() if rng.random() < profile.gap_probability else 0.97 + 0.06 * rng.random()
+        open_ = previous_close * gap
+        close = profile.price * (0.9 + 0.2 * self._random(ticker, session_date, 'close').random())
+        close = max(close, open_ * 0.5) if gap > 1.2 else close
+        high = max(open_, close) * (1 + 0.2 * rng.random())
+        low = min(open_, close) * (1 - 0.1 * rng.random())
+        volume = profile.daily_volume * (0.5 + rng.random()) * (5 if gap > 1.2 else 1)
+        return open_, high, low, close, volume
+
+    def _synthetic_aggs(self, ticker, multiplier, timespan, from_, to):
+        start_date, end_date = _to_date(from_), _to_date(to)
+        aggs = []
+        session_date = start_date
+        while session_date <= end_date:
+            if is_trading_day(session_date) and session_date <= self.today:
+                if timespan == 'day':
+                    open_, high, low, close, volume = self._daily_bar(ticker, session_date)
+                    timestamp = int(est_timezone.localize(
+                        datetime(session_date.year, session_date.month, session_date.day)).timestamp() * 1000)
+                    aggs.append(Agg(open_, high, low, close, volume, (open_ + close) / 2, timestamp, 1000))
+                else:
+                    aggs.extend(self._minute_bars(ticker, session_date, multiplier))
+            session_date += timedelta(days=1)
+
+        start_ms, end_ms = _to_ms(from_), _to_ms(to, end_of_day=True)
+        return [agg for agg in aggs if start_ms <= agg.timestamp <= end_ms]
+
+    def _minute_bars(self, ticker, session_date, multiplier):
+        open_, high, low, close, volume = self._daily_bar(ticker, session_date)
+        seed = zlib.crc32(self._seed_key(ticker, session_date, 'minute', multiplier).encode())
+        rng = np.random.default_rng(seed)
+        session_start = est_timezone.localize(datetime(session_date.year, session_date.month, session_date.day, 4))
+        start_ms = int(session_start.timestamp() * 1000)
+        step_ms = 60_000 * multiplier
+        bar_count = 960 // multiplier
+
+        # A random walk from below the open to the close, pinned at both ends, peaking at the day high
+        steps = np.linspace(0.0, 1.0, bar_count + 1)
+        walk = np.cumsum(np.concatenate(([0.0], rng.normal(0.0, 0.01 * open_, bar_count))))
+        path = np.clip(open_ * 0.9 + (close - open_ * 0.9) * steps + walk - steps * walk[-1], low, high)
+        bar_opens, bar_closes = path[:-1], path[1:]
+        bar_highs = np.minimum(np.maximum(bar_opens, bar_closes) * (1 + 0.005 * rng.random(bar_count)), high)
+        bar_lows = np.maximum(np.minimum(bar_opens, bar_closes) * (1 - 0.005 * rng.random(bar_count)), low)
+        bar_highs[330 // multiplier + rng.integers(390 // multiplier)] = high
+        bar_volumes = volume / bar_count * (0.2 + 1.6 * rng.random(bar_count))
+        vwaps = np.cumsum(bar_volumes * (bar_highs + bar_lows + bar_closes) / 3) / np.cumsum(bar_volumes)
+        timestamps = start_ms + step_ms * np.arange(bar_count)
+
+        return [Agg(*bar, 10) for bar in zip(bar_opens.tolist(), bar_highs.tolist(), bar_lows.tolist(),
+                                            bar_closes.tolist(), bar_volumes.tolist(), vwaps.tolist(),
+                                            timestamps.tolist())]
+
+    def list_aggs(self, ticker, multiplier, timespan, from_, to, adjusted=None, sort=None, limit=None, **kwargs):
+        started = time_module.perf_counter()
+        key = _request_key('list_aggs', ticker, multiplier, timespan, from_, to)
+        if key in self.fixtures:
+            aggs = [Agg(**bar) for bar in self.fixtures[key]]
+        else:
+            aggs = self._synthetic_aggs(ticker, multiplier, timespan, from_, to)
+        self._record(f'list_aggs/{timespan}', len(aggs), started)
+        return iter(aggs)
+
+    def get_daily_open_close_agg(self, ticker, date, adjusted=None, **kwargs):
+        started = time_module.perf_counter()
+        key = _request_key('get_daily_open_close_agg', ticker, date)
+        if key in self.fixtures:
+            summary = DailyOpenCloseAgg(**self.fixtures[key])
+        else:
+            session_date = _to_date(date)
+            open_, high, low, close, volume = self._daily_bar(ticker, session_date)
+            summary = DailyOpenCloseAgg(after_hours=close * 0.98, close=close, from_=str(date), high=high, low=low,
+                                        open=open_, pre_market=open_ * 0.95, symbol=ticker, volume=volume)
+        self._record('get_daily_open_close_agg', 1, started)
+        return summary
+
+    def get_grouped_daily_aggs(self, date, adjusted=None, tickers=(), **kwargs):
+        started = time_module.perf_counter()
+        key = _request_key('get_grouped_daily_aggs', date)
+        if key in self.fixtures:
+            grouped = [GroupedDailyAgg(**bar) for bar in self.fixtures[key]]
+        else:
+            grouped = []
+            for ticker in tickers or self.profiles:
+                for agg in self._synthetic_aggs(ticker, 1, 'day', date, date):
+                    grouped.append(GroupedDailyAgg(ticker, agg.open, agg.high, agg.low, agg.close, agg.volume,
+                                                   agg.vwap, agg.timestamp, agg.transactions))
+        self._record('get_grouped_daily_aggs', len(grouped), started)
+        return grouped
+
+    def list_splits(self, ticker=None, **kwargs):
+        started = time_module.perf_counter()
+        splits = [Split(**split) for split in self.fixtures.get(_request_key('list_splits', ticker), [])]
+        self._record('list_splits', len(splits), started)
+        return iter(splits)
+
+
+class RecordingClient:
+    """
+    Wraps a real RESTClient and records every list_aggs, get_daily_open_close_agg and list_splits response,
+    so a live session can be replayed offline with FakeRESTClient.from_fixture_file.
+    """
+
+    def __init__(self, polygon_client):
+        self.polygon_client = polygon_client
+        self.fixtures = {}
+
+    def __getattr__(self, name):
+        return getattr(self.polygon_client, name)
+
+    def list_aggs(self, ticker, multiplier, timespan, from_, to, **kwargs):
+        aggs = list(self.polygon_client.list_aggs(ticker=ticker, multiplier=multiplier, timespan=timespan,
+                                                  from_=from_, to=to, **kwargs))
+        self.fixtures[_request_key('list_aggs', ticker, multiplier, timespan, from_, to)] = [
+            {field: getattr(agg, field) for field in AGG_FIELDS} for agg in aggs
+        ]
+        return iter(aggs)
+
+    def get_daily_open_close_agg(self, ticker, date, **kwargs):
+        summary = self.polygon_client.get_daily_open_close_agg(ticker=ticker, date=date, **kwargs)
+        self.fixtures[_request_key('get_daily_open_close_agg', ticker, date)] = {
+            field: getattr(summary, field) for field in ('after_hours', 'close', 'high', 'low', 'open',
+                                                         'pre_market', 'volume')
+        }
+        return summary
+
+    def list_splits(self, ticker=None, **kwargs):
+        splits = list(self.polygon_client.list_splits(ticker=ticker, **kwargs))
+        self.fixtures[_request_key('list_splits', ticker)] = [
+            {field: getattr(split, field) for field in ('execution_date', 'split_from', 'split_to', 'ticker')}
+            for split in splits
+        ]
+        return iter(splits)
+
+    def save(self, path):
+        with open(path, 'w') as fixture_file:
+            json.dump(self.fixtures, fixture_file)
@@ -0,0 +1,257 @@
+# run_benchmarks.py
+"""
+Offline benchmarks for the gap-up analysis.
+
+Runs representative workloads against FakeRESTClient, without the live Polygon API, and reports
+per phase the wall time, API calls and bars by endpoint, time spent inside the API and peak
+traced memory (from a second, traced pass). Results are written as JSON and can be compared with
+a stored baseline, so a change in the fetch pattern (more calls or bars for the same workload)
+is flagged before deploy.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--latency-ms 20] [--output results.json]
+                                        [--baseline benchmarks/baseline.json] [--write-baseline]
+                                        [--skip-memory]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time as time_module
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+# The app reads its storage locations at import time: keep every benchmark file in a scratch directory
+SCRATCH_DIR = tempfile.mkdtemp(prefix='gap-up-benchmarks-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(SCRATCH_DIR, 'benchmark.db')
+os.environ['BAR_CACHE_PATH'] = os.path.join(SCRATCH_DIR, 'bar_cache.db')
+os.environ['GROUPED_DAILY_DIR'] = os.path.join(SCRATCH_DIR, 'grouped_daily')
+os.environ.setdefault('POLYGON_API_KEY', 'benchmark')
+
+import app as gap_up_app  # noqa: E402
+from database.dbmodel import db  # noqa: E402
+from database.result_cache import clear_result_cache  # noqa: E402
+from market_data.bar_cache import BarCache, CachedPolygonClient  # noqa: E402
+from market_data.resilient import ResilientClient  # noqa: E402
+from market_data.scheduler import RateLimitedClient, TokenBucket  # noqa: E402
+
+flask_app = gap_up_app.create_app()
+
+from fake_polygon import FakeRESTClient, TickerProfile  # noqa: E402
+
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+# Allowed slowdown before wall time or peak memory count as a regression: relative and absolute floor
+TIME_TOLERANCE = 0.25
+TIME_FLOOR_SECONDS = 0.5
+MEMORY_TOLERANCE = 0.25
+MEMORY_FLOOR_MB = 5.0
+# Slack on call and bar counts: the calendar-day lookback window gains or loses a session as the week moves
+COUNT_TOLERANCE = 0.05
+COUNT_FLOOR = 2
+
+WATCHLIST = [f"WL{index:02d}" for index in range(50)]
+
+# name -> tickers, profiles and lookback of each workload
+WORKLOADS = {
+    'single_ticker': {
+        'tickers': ['SNGL'],
+        'profiles': {'SNGL': TickerProfile(gap_probability=0.04, price=20.0, daily_volume=5_000_000)},
+        'lookback_days': 1095,
+    },
+    'watchlist_50': {
+        'tickers': WATCHLIST,
+        'profiles': {ticker: TickerProfile(gap_probability=0.03) for ticker in WATCHLIST},
+        'lookback_days': 365,
+    },
+    'gap_heavy_small_cap': {
+        'tickers': ['GAPR'],
+        'profiles': {'GAPR': TickerProfile(gap_probability=0.25, price=1.5, daily_volume=20_000_000)},
+        'lookback_days': 1095,
+    },
+}
+
+
+def measure(fake_client, func, trace_memory):
+    """
+    Runs func once and collects its cost.
+
+    tracemalloc slows Python code down several times, so wall time is only meaningful from a run
+    without trace_memory and peak memory only from a run with it.
+
+    Returns:
+        tuple: (func's return value, dict of metrics).
+    """
+    fake_client.reset_counters()
+    if trace_memory:
+        tracemalloc.start()
+    started = time_module.perf_counter()
+    value = func()
+    wall_seconds = time_module.perf_counter() - started
+    peak_bytes = 0
+    if trace_memory:
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return value, {
+        'wall_seconds': round(wall_seconds, 4),
+        'api_calls': dict(sorted(fake_client.calls.items())),
+        'api_calls_total': sum(fake_client.calls.values()),
+        'bars_processed': dict(sorted(fake_client.bars.items())),
+        'api_seconds': round(sum(fake_client.api_seconds.values()), 4),
+        'peak_memory_mb': round(peak_bytes / 1_000_000, 2),
+    }
+
+
+def run_workload(name, workload, latency_ms, trace_memory=False):
+    """
+    Runs the phases of one workload against a fresh database and bar cache.
+
+    Phases:
+        get_gap_up_day_stats: every ticker through the uncached client, serially (the raw fetch pattern).
+        analyze_cold: POST /analyze with an empty database and bar cache.
+        analyze_warm: the same POST again with the result cache cleared, served from the stored gap
+                      days and the bar cache.
+        analyze_repeat: the same POST once more, served from the result cache.
+
+    Returns:
+        dict: phase -> metrics, plus the number of gap-up days found.
+    """
+    fake_client = FakeRESTClient(latency_ms=latency_ms, profiles=workload['profiles'])
+    tickers = workload['tickers']
+    lookback_days = workload['lookback_days']
+
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    cache_path = os.path.join(SCRATCH_DIR, f"bar_cache_{name}.db")
+    flask_app.extensions['polygon_client'] = CachedPolygonClient(
+        ResilientClient(RateLimitedClient(fake_client, TokenBucket(0))), BarCache(cache_path)
+    )
+
+    results = {}
+    gap_up_days, results['get_gap_up_day_stats'] = measure(fake_client, lambda: sum(
+        len(gap_up_app.get_gap_up_day_stats(ticker, fake_client, lookback_days=lookback_days))
+        for ticker in tickers
+    ), trace_memory)
+
+    client = flask_app.test_client()
+    form = {'ticker': ','.join(tickers), 'gap_threshold': gap_up_app.DEFAULT_GAP_THRESHOLD,
+            'lookback_days': lookback_days}
+    for phase in ('analyze_cold', 'analyze_warm', 'analyze_repeat'):
+        if phase == 'analyze_warm':
+            with flask_app.app_context():
+                clear_result_cache()
+        response, results[phase] = measure(fake_client, lambda: client.post('/analyze', data=form),
+                                           trace_memory)
+        if response.status_code != 200:
+            raise RuntimeError(f"{name} {phase}: /analyze returned {response.status_code}")
+
+    return {'tickers': len(tickers), 'lookback_days': lookback_days, 'gap_up_days': gap_up_days,
+            'phases': results}
+
+
+def compare(results, baseline):
+    """
+    Compares results with a baseline of the same shape.
+
+    API calls, bars, wall time and peak memory regress when they exceed the baseline by both the
+    relative tolerance and the absolute floor of their kind.
+
+    Returns:
+        list: Human-readable regression messages, empty when nothing regressed.
+    """
+    regressions = []
+    for name, workload in results['workloads'].items():
+        baseline_workload = baseline.get('workloads', {}).get(name)
+        if baseline_workload is None:
+            continue
+        for phase, metrics in workload['phases'].items():
+            expected = baseline_workload['phases'].get(phase)
+            if expected is None:
+                continue
+            label = f"{name}/{phase}"
+            for counter in ('api_calls', 'bars_processed'):
+                for endpoint, count in metrics[counter].items():
+                    expected_count = expected[counter].get(endpoint, 0)
+                    if count - expected_count > max(COUNT_FLOOR, expected_count * COUNT_TOLERANCE):
+                        regressions.append(f"{label}: {counter} {endpoint} {expected_count} -> {count}")
+            if (metrics['wall_seconds'] > expected['wall_seconds'] * (1 + TIME_TOLERANCE)
+                    and metrics['wall_seconds'] - expected['wall_seconds'] > TIME_FLOOR_SECONDS):
+                regressions.append(f"{label}: wall time {expected['wall_seconds']:.2f}s"
+                                   f" -> {metrics['wall_seconds']:.2f}s")
+            if (metrics['peak_memory_mb']
+                    and metrics['peak_memory_mb'] > expected['peak_memory_mb'] * (1 + MEMORY_TOLERANCE)
+                    and metrics['peak_memory_mb'] - expected['peak_memory_mb'] > MEMORY_FLOOR_MB):
+                regressions.append(f"{label}: peak memory {expected['peak_memory_mb']:.1f}MB"
+                                   f" -> {metrics['peak_memory_mb']:.1f}MB")
+    return regressions
+
+
+def print_report(results):
+    print(f"{'workload/phase':<42}{'wall s':>9}{'api s':>9}{'calls':>7}{'bars':>10}{'peak MB':>9}")
+    for name, workload in results['workloads'].items():
+        for phase, metrics in workload['phases'].items():
+            print(f"{name + '/' + phase:<42}{metrics['wall_seconds']:>9.2f}{metrics['api_seconds']:>9.2f}"
+                  f"{metrics['api_calls_total']:>7}{sum(metrics['bars_processed'].values()):>10}"
+                  f"{metrics['peak_memory_mb']:>9.1f}")
+            for endpoint, count in metrics['api_calls'].items():
+                print(f"    {endpoint:<38}{count:>7} calls {metrics['bars_processed'].get(endpoint, 0):>10} bars")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Injected latency per API call.')
+    parser.add_argument('--workload', action='append', choices=sorted(WORKLOADS),
+                        help='Workload to run; repeat for several. Defaults to all.')
+    parser.add_argument('--skip-memory', action='store_true',
+                        help='Skip the second, traced pass that measures peak memory.')
+    parser.add_argument('--output', help='Write the results JSON to this path.')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='Baseline JSON to compare with.')
+    parser.add_argument('--write-baseline', action='store_true', help='Store the results as the new baseline.')
+    args = parser.parse_args()
+
+    results = {
+        'config': {'latency_ms': args.latency_ms, 'time_tolerance': TIME_TOLERANCE,
+                   'memory_tolerance': MEMORY_TOLERANCE},
+        'workloads': {},
+    }
+    for name in args.workload or WORKLOADS:
+        print(f"Running {name}...")
+        results['workloads'][name] = run_workload(name, WORKLOADS[name], args.latency_ms)
+        if not args.skip_memory:
+            traced = run_workload(name, WORKLOADS[name], args.latency_ms, trace_memory=True)
+            for phase, metrics in results['workloads'][name]['phases'].items():
+                metrics['peak_memory_mb'] = traced['phases'][phase]['peak_memory_mb']
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.write_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --write-baseline to create one.")
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get('config', {}).get('latency_ms') != args.latency_ms:
+        print("Warning: baseline was recorded with a different injected latency; times are not comparable.")
+
+    regressions = compare(results, baseline)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if not regressions:
+        print("No regressions against the baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,6 +6,7 @@ from flask_sqlalchemy import SQLAlchemy
 db = SQLAlchemy()
 
 class GapUpResult(db.Model):
+    """Legacy whole-DataFrame JSON results; superseded by GapDay and only read by import_legacy_results."""
     __tablename__ = 'gap_up_result'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -18,4 +19,190 @@ class GapUpResult(db.Model):
     #db.create_all()
 
     def __repr__(self):
-        return f"<GapUpResult {self.ticker} at {self.created_at.isoformat()}>"
\ No newline at end of file
+        return f"<GapUpResult {self.ticker} at {self.created_at.isoformat()}>"
+
+
+class AnalysisJob(db.Model):
+    """A background /analyze run over a list of tickers."""
+    __tablename__ = 'analysis_job'
+
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(16), default='queued')  # queued, running, finished
+    gap_threshold = db.Column(db.Float)
+    lookback_days = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime)
+    tickers = db.relationship('AnalysisJobTicker', backref='job', order_by='AnalysisJobTicker.position')
+
+    def __repr__(self):
+        return f"<AnalysisJob {self.id} {self.status}>"
+
+
+class AnalysisJobTicker(db.Model):
+    """Progress of one ticker within an AnalysisJob."""
+    __tablename__ = 'analysis_job_ticker'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('analysis_job.id'), index=True)
+    position = db.Column(db.Integer)
+    ticker = db.Column(db.String(16))
+    status = db.Column(db.String(16), default='queued')  # queued, running, done, failed
+    gap_up_days = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<AnalysisJobTicker {self.ticker} {self.status}>"
+
+
+class GapDay(db.Model):
+    """
+    One enriched gap-up day of a ticker: the daily bar figures plus its intraday metrics.
+
+    Rows are keyed by (ticker, date) and do not depend on the gap threshold that selected them,
+    so a different threshold is a filter over stored rows and only new dates need enriching.
+    The unique key doubles as the ticker index and as the conflict target for upserts. Rows for
+    sessions that were still trading, or whose intraday fetch failed, are not finalized and are
+    re-enriched on the next analysis.
+    """
+    __tablename__ = 'gap_day'
+    __table_args__ = (db.UniqueConstraint('ticker', 'date', name='uq_gap_day_ticker_date'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    ticker = db.Column(db.String(16), nullable=False)
+    date = db.Column(db.String(10), nullable=False, index=True)  # YYYY-MM-DD
+    previous_close = db.Column(db.Float)
+    premarket_open = db.Column(db.Float)
+    premarket_high = db.Column(db.Float)
+    premarket_high_time = db.Column(db.String(5))
+    premarket_volume = db.Column(db.Float)
+    open = db.Column(db.Float)
+    gap_up_percent = db.Column(db.Float, index=True)
+    day_high = db.Column(db.Float)
+    day_high_time = db.Column(db.String(5))
+    day_high_percent = db.Column(db.Float)
+    close = db.Column(db.Float)
+    closing_percent = db.Column(db.Float)
+    afterhours_close = db.Column(db.Float)
+    volume = db.Column(db.Float)
+    vwap_crosses = db.Column(db.Integer)
+    runner_fader = db.Column(db.String(8))
+    high_30min = db.Column(db.Float)
+    high_30min_time = db.Column(db.String(5))
+    volume_30min = db.Column(db.Float)
+    high_within_30min = db.Column(db.Boolean)
+    fade_category = db.Column(db.String(32))
+    finalized = db.Column(db.Boolean, default=False, nullable=False)
+    enriched_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    # Result row key (as produced by get_gap_up_day_stats) -> column
+    RESULT_COLUMNS = {
+        'date': 'date',
+        'pd close': 'previous_close',
+        'premarket open': 'premarket_open',
+        'premarket high': 'premarket_high',
+        'premarket high time': 'premarket_high_time',
+        'premarket volume': 'premarket_volume',
+        'open': 'open',
+        'gap up % at open': 'gap_up_percent',
+        'day high': 'day_high',
+        'day high time': 'day_high_time',
+        'day high %': 'day_high_percent',
+        'close price': 'close',
+        'closing percent': 'closing_percent',
+        'afterhours close': 'afterhours_close',
+        'total volume': 'volume',
+        'VWAP Crosses': 'vwap_crosses',
+        'Runner/Fader': 'runner_fader',
+        '30 min high': 'high_30min',
+        '30 min high time': 'high_30min_time',
+        '30 min volume': 'volume_30min',
+        'high within 30 min': 'high_within_30min',
+        'fade category': 'fade_category',
+    }
+
+    def to_result(self):
+        return {key: getattr(self, column) for key, column in self.RESULT_COLUMNS.items()}
+
+    def __repr__(self):
+        return f"<GapDay {self.ticker} {self.date}>"
+
+
+class GapStat(db.Model):
+    """
+    Aggregates of the stored gap days in one cell of the bucketed dimensions (see gap_stats).
+
+    Rows hold counts and sums rather than averages, so storing a gap day adds its values to one
+    cell and re-enriching it moves them, without rescanning gap_day. Premarket volume and VWAP
+    crosses are summed over intraday_days, the days whose intraday fetch succeeded.
+    """
+    __tablename__ = 'gap_stat'
+    __table_args__ = (db.UniqueConstraint('year', 'gap_bucket', 'premarket_volume_bucket', 'day_high_bucket',
+                                          'runner_fader', 'fade_category', name='uq_gap_stat_cell'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.String(4), nullable=False)
+    gap_bucket = db.Column(db.String(16), nullable=False)
+    premarket_volume_bucket = db.Column(db.String(16), nullable=False)
+    day_high_bucket = db.Column(db.String(5), nullable=False)  # HH:MM start of a 15-minute bucket
+    runner_fader = db.Column(db.String(8), nullable=False)
+    fade_category = db.Column(db.String(32), nullable=False)
+    days = db.Column(db.Integer, nullable=False, default=0)
+    intraday_days = db.Column(db.Integer, nullable=False, default=0)
+    gap_percent_sum = db.Column(db.Float, nullable=False, default=0.0)
+    day_high_percent_sum = db.Column(db.Float, nullable=False, default=0.0)
+    closing_percent_sum = db.Column(db.Float, nullable=False, default=0.0)
+    premarket_volume_sum = db.Column(db.Float, nullable=False, default=0.0)
+    vwap_crosses_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<GapStat {self.year} {self.gap_bucket} {self.premarket_volume_bucket} {self.day_high_bucket} " \
+               f"{self.runner_fader} {self.fade_category} {self.days}>"
+
+
+class TickerScanState(db.Model):
+    """
+    Watermark of a ticker's analysis: every gap day of at least gap_threshold percent between
+    scanned_from and scanned_through (the last finished session analyzed) is stored in gap_day.
+    """
+    __tablename__ = 'ticker_scan_state'
+
+    ticker = db.Column(db.String(16), primary_key=True)
+    scanned_from = db.Column(db.String(10), nullable=False)  # YYYY-MM-DD
+    scanned_through = db.Column(db.String(10), nullable=False)  # YYYY-MM-DD
+    gap_threshold = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc),
+                           onupdate=lambda: datetime.now(timezone.utc))
+
+    def covers(self, start_date, gap_threshold):
+        """True if the stored gap days already cover a scan from start_date at gap_threshold."""
+        return self.scanned_from <= start_date and self.gap_threshold <= gap_threshold
+
+    def __repr__(self):
+        return f"<TickerScanState {self.ticker} {self.scanned_from}..{self.scanned_through}>"
+
+
+class CachedAnalysis(db.Model):
+    """
+    Result of one analysis, shared by every worker until it expires.
+
+    Keyed by (ticker, gap_threshold, lookback_days, as_of). A 'pending' row is the lock of the
+    worker computing the result: others wait for it to turn 'ready' instead of repeating the
+    analysis, and take over once lease_until has passed. Times are epoch seconds.
+    """
+    __tablename__ = 'cached_analysis'
+    __table_args__ = (db.UniqueConstraint('ticker', 'gap_threshold', 'lookback_days', 'as_of',
+                                          name='uq_cached_analysis_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    ticker = db.Column(db.String(16), nullable=False)
+    gap_threshold = db.Column(db.Float, nullable=False)
+    lookback_days = db.Column(db.Integer, nullable=False)
+    as_of = db.Column(db.String(10), nullable=False)  # YYYY-MM-DD, the exchange date of the analysis
+    status = db.Column(db.String(8), nullable=False)  # pending, ready
+    result_json = db.Column(db.Text)
+    lease_until = db.Column(db.Float)
+    expires_at = db.Column(db.Float, index=True)
+
+    def __repr__(self):
+        return f"<CachedAnalysis {self.ticker} {self.gap_threshold} {self.lookback_days} {self.as_of} {self.status}>"
@@ -0,0 +1,57 @@
+# engine.py
+"""
+Engine settings for the application database.
+
+SQLite files get WAL journaling, so readers no longer block the writer and a commit appends to
+the log instead of rewriting pages, with synchronous=NORMAL (fsync at checkpoints rather than on
+every commit, which is durable across application crashes in WAL mode) and a busy timeout, so
+concurrent writers wait for the lock instead of failing. Server databases (PostgreSQL, MySQL)
+get a sized connection pool that checks connections before use and recycles them.
+"""
+import sqlite3
+
+from sqlalchemy import event
+
+
+def engine_options(database_url, pool_size=10, max_overflow=20, pool_recycle=1800):
+    """
+    Builds SQLALCHEMY_ENGINE_OPTIONS for a database URL.
+
+    Args:
+        database_url (str): The SQLAlchemy database URL.
+        pool_size (int): Connections kept open to a server database.
+        max_overflow (int): Extra connections opened under load.
+        pool_recycle (int): Seconds after which a server connection is replaced.
+
+    Returns:
+        dict: Engine options; SQLite keeps SQLAlchemy's defaults.
+    """
+    if database_url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': True,
+    }
+
+
+def configure_sqlite(engine, journal_mode='WAL', synchronous='NORMAL', busy_timeout_ms=30000):
+    """
+    Applies the SQLite pragmas to every new connection of an engine; other databases are left alone.
+
+    Call it before the engine's first connection.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
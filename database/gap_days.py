@@ -0,0 +1,267 @@
+# gap_days.py
+"""
+Persistence and query helpers for enriched gap-up days (the GapDay table).
+"""
+import io
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.dbmodel import db, GapDay, GapUpResult
+from database.gap_stats import stored_gap_days, update_gap_stats
+from database.result_cache import clear_result_cache
+
+# Columns page_gap_days can sort by: the ticker and every result column
+SORTABLE_COLUMNS = {column: getattr(GapDay, column) for column in ('ticker', *GapDay.RESULT_COLUMNS.values())}
+
+
+def load_enriched_days(ticker):
+    """
+    Loads every finalized enriched day of a ticker.
+
+    Returns:
+        dict: 'YYYY-MM-DD' -> result row in the get_gap_up_day_stats format.
+    """
+    return {gap_day.date: gap_day.to_result() for gap_day in GapDay.query.filter_by(ticker=ticker, finalized=True)}
+
+
+# Result row flag of a day whose fetch failed in a way worth retrying; such rows are not finalized
+INCOMPLETE_KEY = 'incomplete'
+
+
+def _gap_day_records(ticker, gap_up_days_list, finalized_before, enriched_at):
+    """Converts result rows to GapDay column dicts."""
+    records = []
+    for row in gap_up_days_list:
+        record = {column: row.get(key) for key, column in GapDay.RESULT_COLUMNS.items()}
+        record['ticker'] = ticker
+        record['finalized'] = (row['date'] < finalized_before and row.get('VWAP Crosses') is not None
+                               and not row.get(INCOMPLETE_KEY))
+        record['enriched_at'] = enriched_at
+        records.append(record)
+    return records
+
+
+def _upsert_records(records):
+    """
+    Writes GapDay column dicts with one upsert statement executed for all of them, without committing.
+
+    The statement is compiled once and run as an executemany on the session's connection: a
+    prepared statement stepped per row on SQLite, multi-row VALUES pages on PostgreSQL. Building
+    a literal multi-row VALUES clause instead costs more to compile than to execute. The gap
+    statistics move from the rows being replaced to the written ones in the same transaction.
+    """
+    if not records:
+        return
+    replaced = stored_gap_days((record['ticker'], record['date']) for record in records)
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(GapDay.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=['ticker', 'date'],
+            set_={column: statement.excluded[column] for column in records[0] if column not in ('ticker', 'date')}
+        )
+        db.session.connection().execute(statement, records)
+    else:
+        for record in records:
+            gap_day = GapDay.query.filter_by(ticker=record['ticker'], date=record['date']).first() or GapDay()
+            for column, value in record.items():
+                setattr(gap_day, column, value)
+            db.session.add(gap_day)
+    # The last record of a key is the one stored
+    update_gap_stats(replaced, list({(record['ticker'], record['date']): record for record in records}.values()))
+
+
+def upsert_gap_days(ticker, gap_up_days_list, finalized_before, commit=True):
+    """
+    Inserts or updates enriched days of a ticker, one row per (ticker, date), and drops the
+    ticker's cached analyses in the same transaction.
+
+    Args:
+        ticker (str): The stock ticker symbol.
+        gap_up_days_list (list): Result rows in the get_gap_up_day_stats format.
+        finalized_before (str): 'YYYY-MM-DD'; rows for earlier dates whose intraday fetch succeeded
+                                are stored as finalized.
+        commit (bool): Commit the session; pass False to write more in the same transaction.
+    """
+    if not gap_up_days_list:
+        return
+
+    _upsert_records(_gap_day_records(ticker, gap_up_days_list, finalized_before, datetime.now(timezone.utc)))
+    clear_result_cache([ticker], commit=False)
+    if commit:
+        db.session.commit()
+
+
+def update_gap_days(records, commit=True):
+    """
+    Sets some columns of stored gap days, e.g. the fields filled in by a backfill, with one
+    UPDATE executed for all of them. The gap statistics follow the changed columns and the
+    cached analyses of the tickers are dropped.
+
+    Args:
+        records (list): Dicts with ticker, date and the new column values; every dict has the same columns.
+        commit (bool): Commit the session; pass False to write more in the same transaction.
+    """
+    if not records:
+        return
+    replaced = stored_gap_days((record['ticker'], record['date']) for record in records)
+    columns = [column for column in records[0] if column not in ('ticker', 'date')]
+    statement = update(GapDay.__table__).where(GapDay.ticker == bindparam('key_ticker'),
+                                               GapDay.date == bindparam('key_date'))
+    db.session.connection().execute(statement, [
+        {'key_ticker': record['ticker'], 'key_date': record['date'], **{column: record[column] for column in columns}}
+        for record in records
+    ])
+    changes = {(record['ticker'], record['date']): record for record in records}
+    update_gap_stats(replaced, [{**gap_day, **{column: value for column, value in
+                                               changes[(gap_day['ticker'], gap_day['date'])].items()
+                                               if column in gap_day}}
+                                for gap_day in replaced])
+    clear_result_cache({record['ticker'] for record in records}, commit=False)
+    if commit:
+        db.session.commit()
+
+
+class GapDayWriter:
+    """
+    Buffers the enriched days of many tickers and writes them with batched multi-row upserts,
+    one transaction per flush instead of one per ticker, dropping the cached analyses of the
+    tickers written. Thread-safe; use it as a context manager, or call flush, to write what is left.
+
+    Used by batch-analyze --store. analyze_ticker keeps writing through upsert_gap_days, since it
+    commits a ticker's gap days with its TickerScanState watermark and may read them back at once.
+
+    Args:
+        flush_rows (int): Buffered rows that trigger a flush.
+    """
+
+    def __init__(self, flush_rows=5000):
+        self.flush_rows = flush_rows
+        self.rows_written = 0
+        self._records = []
+        self._lock = threading.Lock()
+
+    def add(self, ticker, gap_up_days_list, finalized_before):
+        """Buffers result rows of a ticker; see upsert_gap_days for the arguments."""
+        records = _gap_day_records(ticker, gap_up_days_list, finalized_before, datetime.now(timezone.utc))
+        with self._lock:
+            self._records.extend(records)
+            full = len(self._records) >= self.flush_rows
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes and commits the buffered rows."""
+        with self._lock:
+            records, self._records = self._records, []
+            if not records:
+                return
+            _upsert_records(records)
+            clear_result_cache({record['ticker'] for record in records}, commit=False)
+            db.session.commit()
+            self.rows_written += len(records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+def query_gap_days(ticker=None, min_gap=None, max_gap=None, runner_fader=None, start_date=None, end_date=None):
+    """
+    Builds an indexed query over stored gap days, e.g. all faders with a gap over 50% in 2025:
+    query_gap_days(runner_fader='Fader', min_gap=50, start_date='2025-01-01', end_date='2025-12-31').
+
+    Args:
+        ticker (str or None): Restrict to one ticker.
+        min_gap (float or None): Minimum gap up at the open, in percent.
+        max_gap (float or None): Maximum gap up at the open, in percent.
+        runner_fader (str or None): 'Runner', 'Fader' or 'Neutral'.
+        start_date (str or None): First date, 'YYYY-MM-DD'.
+        end_date (str or None): Last date, 'YYYY-MM-DD'.
+
+    Returns:
+        Query: GapDay rows ordered by ticker and date.
+    """
+    query = GapDay.query
+    if ticker is not None:
+        query = query.filter(GapDay.ticker == ticker)
+    if min_gap is not None:
+        query = query.filter(GapDay.gap_up_percent >= min_gap)
+    if max_gap is not None:
+        query = query.filter(GapDay.gap_up_percent <= max_gap)
+    if runner_fader is not None:
+        query = query.filter(GapDay.runner_fader == runner_fader)
+    if start_date is not None:
+        query = query.filter(GapDay.date >= start_date)
+    if end_date is not None:
+        query = query.filter(GapDay.date <= end_date)
+    return query.order_by(GapDay.ticker, GapDay.date)
+
+
+def page_gap_days(query, sort='date', descending=False, page=1, per_page=50):
+    """
+    Sorts a GapDay query by one column and returns one page of it.
+
+    Args:
+        query: A GapDay query, e.g. from query_gap_days.
+        sort (str): Column to sort by, one of SORTABLE_COLUMNS; rows without a value come last.
+        descending (bool): Sort in descending order.
+        page (int): 1-based page number.
+        per_page (int): Rows per page.
+
+    Returns:
+        tuple: (total number of rows, list of GapDay rows on the page).
+    """
+    column = SORTABLE_COLUMNS[sort]
+    total = query.order_by(None).count()
+    ordering = column.desc() if descending else column.asc()
+    rows = query.order_by(None).order_by(ordering.nulls_last(), GapDay.ticker, GapDay.date) \
+        .limit(per_page).offset((page - 1) * per_page).all()
+    return total, rows
+
+
+def gap_days_frame(query, include_ticker=False):
+    """
+    Loads the rows of a GapDay query into a DataFrame with the result column names.
+
+    Args:
+        query: A GapDay query, e.g. from query_gap_days.
+        include_ticker (bool): Prepend a ticker column.
+
+    Returns:
+        pd.DataFrame: One row per gap day, columns as produced by get_gap_up_day_stats.
+    """
+    import pandas as pd
+    columns = list(GapDay.RESULT_COLUMNS)
+    if include_ticker:
+        return pd.DataFrame([{'ticker': gap_day.ticker, **gap_day.to_result()} for gap_day in query],
+                            columns=['ticker'] + columns)
+    return pd.DataFrame([gap_day.to_result() for gap_day in query], columns=columns)
+
+
+def import_legacy_results():
+    """
+    Copies the latest legacy GapUpResult JSON blob of every ticker into GapDay rows.
+
+    Returns:
+        int: The number of gap days imported.
+    """
+    import pandas as pd
+    latest = {}
+    for gapup in GapUpResult.query.order_by(GapUpResult.ticker, GapUpResult.created_at.desc()):
+        latest.setdefault(gapup.ticker, gapup)
+
+    imported = 0
+    for ticker, gapup in latest.items():
+        df = pd.read_json(io.StringIO(gapup.result_json), convert_dates=False, dtype={'date': str})
+        rows = df.astype(object).where(pd.notna(df), None).to_dict('records')
+        # Legacy rows predate the finalized flag and are re-enriched on the next analysis
+        upsert_gap_days(ticker, rows, finalized_before='0000-00-00')
+        imported += len(rows)
+    return imported
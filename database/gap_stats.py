@@ -0,0 +1,291 @@
+# gap_stats.py
+"""
+Cross-ticker statistics of the stored gap days (the GapStat table).
+
+Every gap day falls into one cell of a few bucketed dimensions: the year, its gap % at the open,
+its premarket volume, the 15-minute bucket of its day high time, its Runner/Fader label and its
+fade category. A cell keeps counts and sums, so each write to gap_day moves the written days
+between cells (update_gap_stats, called by the gap_day upsert) instead of rescanning the table,
+and a dashboard query aggregates a few thousand cells rather than every gap day.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.dbmodel import db, GapDay, GapStat
+
+# Bucket edges: a value v falls into [edge, next edge); values from the last edge up share one bucket
+GAP_PERCENT_EDGES = (0, 10, 20, 30, 40, 50, 75, 100, 150, 200, 300)
+PREMARKET_VOLUME_EDGES = (0, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000)
+DAY_HIGH_BUCKET_MINUTES = 15
+# Label of a day without a value for the dimension (e.g. a failed intraday fetch)
+MISSING = 'n/a'
+
+DIMENSIONS = ('year', 'gap_bucket', 'premarket_volume_bucket', 'day_high_bucket', 'runner_fader', 'fade_category')
+MEASURES = ('days', 'intraday_days', 'gap_percent_sum', 'day_high_percent_sum', 'closing_percent_sum',
+            'premarket_volume_sum', 'vwap_crosses_sum')
+# GapDay columns a day's cell and measures are computed from
+SOURCE_COLUMNS = ('date', 'gap_up_percent', 'premarket_volume', 'day_high_time', 'runner_fader', 'fade_category',
+                  'day_high_percent', 'closing_percent', 'vwap_crosses')
+
+# Tickers per lookup of the stored rows a write replaces
+LOOKUP_CHUNK = 500
+
+
+def _format_volume(value):
+    for divisor, suffix in ((1_000_000, 'M'), (1_000, 'K')):
+        if value >= divisor:
+            return f"{value / divisor:g}{suffix}"
+    return f"{value:g}"
+
+
+def _bucket_labels(edges, format_edge):
+    """Labels of the buckets of edges, lowest first: below the first edge, each range, and from the last edge up."""
+    return ([f"<{format_edge(edges[0])}"]
+            + [f"{format_edge(low)}-{format_edge(high)}" for low, high in zip(edges, edges[1:])]
+            + [f"{format_edge(edges[-1])}+"])
+
+
+GAP_BUCKETS = _bucket_labels(GAP_PERCENT_EDGES, lambda edge: f"{edge:g}")
+PREMARKET_VOLUME_BUCKETS = _bucket_labels(PREMARKET_VOLUME_EDGES, _format_volume)
+RUNNER_FADER_LABELS = ('Runner', 'Neutral', 'Fader')
+FADE_CATEGORY_LABELS = ('Straight Down Fade', 'Quick Swipe and Fade', 'Steady gap up and Fade')
+
+# Dimension -> label -> rank, for labels that do not sort as text
+LABEL_ORDER = {
+    'gap_bucket': {label: rank for rank, label in enumerate(GAP_BUCKETS)},
+    'premarket_volume_bucket': {label: rank for rank, label in enumerate(PREMARKET_VOLUME_BUCKETS)},
+    'runner_fader': {label: rank for rank, label in enumerate(RUNNER_FADER_LABELS)},
+    'fade_category': {label: rank for rank, label in enumerate(FADE_CATEGORY_LABELS)},
+}
+
+
+def _bucket(value, edges, labels):
+    if value is None or value != value:
+        return MISSING
+    return labels[bisect_right(edges, value)]
+
+
+def _day_high_bucket(day_high_time):
+    """Floors an 'HH:MM' time to the start of its DAY_HIGH_BUCKET_MINUTES bucket."""
+    if not day_high_time:
+        return MISSING
+    hours, minutes = day_high_time.split(':')
+    minute = int(hours) * 60 + int(minutes)
+    minute -= minute % DAY_HIGH_BUCKET_MINUTES
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def gap_stat_cell(gap_day):
+    """
+    Returns the cell of a gap day.
+
+    Args:
+        gap_day (dict): GapDay column values, at least SOURCE_COLUMNS.
+
+    Returns:
+        tuple: The labels of DIMENSIONS.
+    """
+    return (
+        gap_day['date'][:4],
+        _bucket(gap_day['gap_up_percent'], GAP_PERCENT_EDGES, GAP_BUCKETS),
+        _bucket(gap_day['premarket_volume'], PREMARKET_VOLUME_EDGES, PREMARKET_VOLUME_BUCKETS),
+        _day_high_bucket(gap_day['day_high_time']),
+        gap_day['runner_fader'] or MISSING,
+        gap_day['fade_category'] or MISSING,
+    )
+
+
+def _accumulate(cells, gap_days, sign):
+    """Adds (sign 1) or removes (sign -1) the measures of gap days to their cells."""
+    for gap_day in gap_days:
+        cell = cells[gap_stat_cell(gap_day)]
+        cell['days'] += sign
+        cell['gap_percent_sum'] += sign * (gap_day['gap_up_percent'] or 0.0)
+        cell['day_high_percent_sum'] += sign * (gap_day['day_high_percent'] or 0.0)
+        cell['closing_percent_sum'] += sign * (gap_day['closing_percent'] or 0.0)
+        if gap_day['vwap_crosses'] is not None:
+            cell['intraday_days'] += sign
+            cell['premarket_volume_sum'] += sign * (gap_day['premarket_volume'] or 0.0)
+            cell['vwap_crosses_sum'] += sign * gap_day['vwap_crosses']
+
+
+def _new_cells():
+    return defaultdict(lambda: dict.fromkeys(MEASURES, 0))
+
+
+def _add_to_cells(cells):
+    """
+    Adds measure deltas to the stored cells with one upsert executed for all of them, without committing.
+
+    Args:
+        cells (dict): Cell (DIMENSIONS labels) -> MEASURES deltas.
+    """
+    records = [{**dict(zip(DIMENSIONS, cell)), **measures} for cell, measures in cells.items()
+               if any(measures.values())]
+    if not records:
+        return
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        table = GapStat.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(DIMENSIONS),
+            set_={measure: table.c[measure] + statement.excluded[measure] for measure in MEASURES}
+        )
+        db.session.connection().execute(statement, records)
+    else:
+        for record in records:
+            gap_stat = GapStat.query.filter_by(**{dimension: record[dimension] for dimension in DIMENSIONS}).first()
+            if gap_stat is None:
+                gap_stat = GapStat(**{dimension: record[dimension] for dimension in DIMENSIONS},
+                                   **dict.fromkeys(MEASURES, 0))
+                db.session.add(gap_stat)
+            for measure in MEASURES:
+                setattr(gap_stat, measure, getattr(gap_stat, measure) + record[measure])
+        db.session.flush()
+    if any(record['days'] < 0 for record in records):
+        GapStat.query.filter(GapStat.days <= 0).delete(synchronize_session=False)
+
+
+def stored_gap_days(keys):
+    """
+    Reads the SOURCE_COLUMNS of the stored gap days among (ticker, date) keys, e.g. the rows an
+    upsert is about to replace.
+
+    Returns:
+        list: One dict per stored gap day.
+    """
+    keys = set(keys)
+    if not keys:
+        return []
+    tickers = sorted({ticker for ticker, _ in keys})
+    dates = [date for _, date in keys]
+    columns = [GapDay.ticker, *(getattr(GapDay, column) for column in SOURCE_COLUMNS)]
+    gap_days = []
+    for start in range(0, len(tickers), LOOKUP_CHUNK):
+        statement = select(*columns).where(GapDay.ticker.in_(tickers[start:start + LOOKUP_CHUNK]),
+                                           GapDay.date.between(min(dates), max(dates)))
+        gap_days.extend(row._asdict() for row in db.session.execute(statement) if (row.ticker, row.date) in keys)
+    return gap_days
+
+
+def update_gap_stats(replaced, written):
+    """
+    Moves the measures of rewritten gap days from their old cells to their new ones, without committing.
+
+    Args:
+        replaced (list): The stored rows being overwritten, from stored_gap_days.
+        written (list): The GapDay column dicts written in their place (and new rows).
+    """
+    cells = _new_cells()
+    _accumulate(cells, replaced, -1)
+    _accumulate(cells, written, 1)
+    _add_to_cells(cells)
+
+
+def rebuild_gap_stats():
+    """
+    Recomputes every cell from the gap_day table and commits, e.g. after the bucket edges changed.
+
+    Returns:
+        int: The number of cells.
+    """
+    cells = _new_cells()
+    statement = select(*(getattr(GapDay, column) for column in SOURCE_COLUMNS)).execution_options(yield_per=10000)
+    _accumulate(cells, (row._asdict() for row in db.session.execute(statement)), 1)
+    GapStat.query.delete()
+    _add_to_cells(cells)
+    db.session.commit()
+    return len(cells)
+
+
+def ensure_gap_stats():
+    """
+    Builds the cells once for a database whose gap days predate the gap_stat table; later
+    writes keep them current.
+
+    Returns:
+        int: The number of cells built, 0 if there was nothing to do.
+    """
+    if db.session.query(GapStat.id).first() is not None or db.session.query(GapDay.id).first() is None:
+        return 0
+    return rebuild_gap_stats()
+
+
+def _median_minute(bucket_days):
+    """
+    Median day high time in minutes after midnight, interpolated within the day high buckets.
+
+    Args:
+        bucket_days (dict): 'HH:MM' bucket start -> number of days.
+    """
+    half = sum(bucket_days.values()) / 2
+    seen = 0
+    for bucket, count in sorted(bucket_days.items()):
+        minute = int(bucket[:2]) * 60 + int(bucket[3:])
+        if seen + count >= half:
+            return minute + (half - seen) / count * DAY_HIGH_BUCKET_MINUTES
+        seen += count
+    return None
+
+
+def query_gap_stats(group_by=(), filters=None):
+    """
+    Aggregates the stored cells into one row per combination of the group_by dimensions, e.g. the
+    runner rate by gap bucket for 2025: query_gap_stats(['gap_bucket'], {'year': ['2025']}).
+
+    Args:
+        group_by (list): Names from DIMENSIONS; empty for a single row over every gap day.
+        filters (dict or None): Dimension -> accepted labels.
+
+    Returns:
+        list: Dicts with the group_by labels, 'days', 'runner %', 'fader %', 'avg gap %',
+              'avg day high %', 'avg closing %', 'avg premarket volume', 'avg VWAP Crosses' and
+              'median day high time' (HH:MM), in bucket order.
+    """
+    group_by = list(group_by)
+    group_columns = [getattr(GapStat, dimension) for dimension in group_by]
+    conditions = [GapStat.days > 0] + [getattr(GapStat, dimension).in_(labels)
+                                       for dimension, labels in (filters or {}).items()]
+
+    # Sum the cells in the database; only one row per group (and per day high bucket) is read back
+    def runner_fader_days(label):
+        return func.sum(case((GapStat.runner_fader == label, GapStat.days), else_=0))
+
+    statement = select(*group_columns, *(func.sum(getattr(GapStat, measure)) for measure in MEASURES),
+                       runner_fader_days('Runner'), runner_fader_days('Fader')).where(*conditions).group_by(*group_columns)
+    totals = {tuple(row[:len(group_by)]): dict(zip(MEASURES + ('runners', 'faders'), row[len(group_by):]))
+              for row in db.session.execute(statement) if row[len(group_by)]}
+    statement = select(*group_columns, GapStat.day_high_bucket, func.sum(GapStat.days)) \
+        .where(*conditions, GapStat.day_high_bucket != MISSING).group_by(*group_columns, GapStat.day_high_bucket)
+    day_highs = defaultdict(dict)  # group -> day high bucket -> days
+    for row in db.session.execute(statement):
+        day_highs[tuple(row[:len(group_by)])][row[-2]] = row[-1]
+
+    def order(group):
+        return tuple((LABEL_ORDER.get(dimension, {}).get(label, len(LABEL_ORDER.get(dimension, {}))),
+                      label == MISSING, label) for dimension, label in zip(group_by, group))
+
+    rows = []
+    for group in sorted(totals, key=order):
+        total = totals[group]
+        days = total['days']
+        intraday_days = total['intraday_days']
+        median = _median_minute(day_highs[group]) if group in day_highs else None
+        rows.append({
+            **dict(zip(group_by, group)),
+            'days': days,
+            'runner %': total['runners'] / days * 100,
+            'fader %': total['faders'] / days * 100,
+            'avg gap %': total['gap_percent_sum'] / days,
+            'avg day high %': total['day_high_percent_sum'] / days,
+            'avg closing %': total['closing_percent_sum'] / days,
+            'avg premarket volume': total['premarket_volume_sum'] / intraday_days if intraday_days else None,
+            'avg VWAP Crosses': total['vwap_crosses_sum'] / intraday_days if intraday_days else None,
+            'median day high time': f"{int(median) // 60:02d}:{int(median) % 60:02d}" if median is not None else None,
+        })
+    return rows
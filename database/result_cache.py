@@ -0,0 +1,129 @@
+# result_cache.py
+"""
+Shared cache of analysis results (the CachedAnalysis table).
+
+Results live in the application database, so every gunicorn worker sees them. The first
+worker to ask for a missing key stores a 'pending' row that acts as a lock and runs the
+analysis; concurrent requests for the same key wait for its result instead of paying for the
+same Polygon calls again.
+"""
+import json
+import time as time_module
+
+from sqlalchemy.exc import IntegrityError
+
+from database.dbmodel import db, CachedAnalysis
+from metrics import RESULT_CACHE
+
+# Seconds between checks while another worker computes a result
+POLL_SECONDS = 0.25
+
+
+def _json_default(value):
+    """Converts NumPy scalars, which json cannot serialize, to Python values."""
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def cached_analysis(ticker, gap_threshold, lookback_days, as_of, expires_at, compute, lease_seconds=300):
+    """
+    Returns the cached result rows of an analysis, computing them once across all workers when
+    they are missing or expired.
+
+    Args:
+        ticker (str): The stock ticker symbol.
+        gap_threshold (float): Minimum gap up at the open, in percent.
+        lookback_days (int): Number of calendar days of history.
+        as_of (str): 'YYYY-MM-DD' exchange date the analysis is valid for.
+        expires_at (float): Epoch seconds after which a stored result is recomputed.
+        compute (callable): Runs the analysis; returns the result rows, or None on failure.
+        lease_seconds (float): How long a pending computation may hold the lock before another
+                               worker takes it over.
+
+    Returns:
+        list or None: The result rows, or None if compute failed (failures are not cached).
+    """
+    key = {'ticker': ticker, 'gap_threshold': gap_threshold, 'lookback_days': lookback_days, 'as_of': as_of}
+    waited = False
+    while True:
+        now = time_module.time()
+        entry = CachedAnalysis.query.filter_by(**key).first()
+
+        if entry is None:
+            db.session.add(CachedAnalysis(**key, status='pending', lease_until=now + lease_seconds))
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()  # Another worker inserted it first
+                continue
+
+        if entry.status == 'ready' and entry.expires_at > now:
+            RESULT_CACHE.inc(1, 'wait' if waited else 'hit')
+            rows = json.loads(entry.result_json)
+            db.session.commit()
+            return rows
+
+        if entry.status == 'pending' and entry.lease_until > now:
+            # Another worker is computing it: end this transaction so its result becomes visible
+            db.session.rollback()
+            waited = True
+            time_module.sleep(POLL_SECONDS)
+            continue
+
+        # Expired result or abandoned lock: take it over, unless another worker just did
+        version = (CachedAnalysis.expires_at == entry.expires_at if entry.status == 'ready'
+                   else CachedAnalysis.lease_until == entry.lease_until)
+        claimed = CachedAnalysis.query.filter(
+            CachedAnalysis.id == entry.id, CachedAnalysis.status == entry.status, version
+        ).update({'status': 'pending', 'lease_until': now + lease_seconds, 'result_json': None},
+                 synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            break
+
+    RESULT_CACHE.inc(1, 'miss')
+    try:
+        rows = compute()
+    except Exception:
+        _release(key)
+        raise
+    if rows is None:
+        _release(key)
+        return None
+
+    now = time_module.time()
+    CachedAnalysis.query.filter_by(**key).update({
+        'status': 'ready',
+        'result_json': json.dumps(rows, default=_json_default),
+        'expires_at': expires_at,
+        'lease_until': None,
+    }, synchronize_session=False)
+    CachedAnalysis.query.filter(CachedAnalysis.status == 'ready', CachedAnalysis.expires_at <= now).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return rows
+
+
+def _release(key):
+    """Drops the lock of a computation that failed, so the next request retries it."""
+    db.session.rollback()
+    CachedAnalysis.query.filter_by(**key, status='pending').delete(synchronize_session=False)
+    db.session.commit()
+
+
+def clear_result_cache(tickers=None, commit=True):
+    """
+    Drops cached results, e.g. after the stored gap days of some tickers were rewritten.
+
+    Args:
+        tickers (iterable or None): Only drop the results of these tickers.
+        commit (bool): Commit the session; pass False to drop them in the caller's transaction.
+    """
+    query = CachedAnalysis.query.filter(CachedAnalysis.status == 'ready')
+    if tickers is not None:
+        query = query.filter(CachedAnalysis.ticker.in_(list(tickers)))
+    query.delete(synchronize_session=False)
+    if commit:
+        db.session.commit()
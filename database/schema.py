@@ -0,0 +1,45 @@
+# schema.py
+"""
+In-place upgrades of an existing application database.
+
+db.create_all only creates missing tables, so a column added to a model never reaches a
+database created before it. upgrade_schema adds such columns with ALTER TABLE (all of them
+nullable, so existing rows keep working and are filled by a backfill or the next analysis).
+Derived tables, whose rows are recomputed from other tables, are dropped and created again
+instead, since their unique keys may have changed too.
+"""
+from sqlalchemy import inspect, text
+
+from database.dbmodel import db
+
+
+def upgrade_schema(derived_tables=('gap_stat',)):
+    """
+    Brings the tables of an existing database up to the models; call it before db.create_all.
+
+    Args:
+        derived_tables (tuple): Tables that are dropped when they lack a column, to be rebuilt
+                                by their owner (gap_stat: ensure_gap_stats).
+
+    Returns:
+        list: 'table.column' of every added column and 'table' of every dropped table.
+    """
+    inspector = inspect(db.engine)
+    changes = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if not missing:
+            continue
+        if table.name in derived_tables:
+            table.drop(db.engine)
+            changes.append(table.name)
+            continue
+        with db.engine.begin() as connection:
+            for column in missing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                changes.append(f"{table.name}.{column.name}")
+    return changes
@@ -0,0 +1,111 @@
+# export.py
+"""
+Constant-memory exports of stored gap days.
+
+Rows are read from the database in fixed-size batches and written out as they arrive:
+CSV is streamed straight into the HTTP response, while Parquet and Excel (xlsxwriter's
+constant_memory mode) are written batch by batch into a temporary file that is then sent.
+"""
+import csv
+import io
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+from database.dbmodel import db, GapDay
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+# Header names (the result row keys) and the matching GapDay columns, ticker first
+EXPORT_HEADERS = ['ticker'] + list(GapDay.RESULT_COLUMNS)
+EXPORT_COLUMNS = [GapDay.ticker] + [getattr(GapDay, column) for column in GapDay.RESULT_COLUMNS.values()]
+
+PARQUET_SCHEMA = pa.schema([
+    (header, pa.string() if isinstance(column.type, db.String) else
+     pa.int64() if isinstance(column.type, db.Integer) else
+     pa.bool_() if isinstance(column.type, db.Boolean) else pa.float64())
+    for header, column in zip(EXPORT_HEADERS, EXPORT_COLUMNS)
+])
+
+
+def iter_row_batches(query, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yields the export rows of a GapDay query in batches of tuples, without loading the whole result.
+
+    Args:
+        query: A GapDay query, e.g. from query_gap_days, whose filters and ordering are kept.
+        batch_size (int): Rows fetched from the database per batch.
+    """
+    statement = query.with_entities(*EXPORT_COLUMNS).statement
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield [tuple(row) for row in partition]
+
+
+def stream_csv(query):
+    """Yields CSV text chunks, one per batch of rows, starting with the header."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADERS)
+    for batch in iter_row_batches(query):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_parquet(query):
+    """
+    Writes the rows to a temporary Parquet file, one row group per batch.
+
+    Returns:
+        file: The temporary file, rewound; it is deleted when closed.
+    """
+    output = tempfile.TemporaryFile()
+    with pq.ParquetWriter(output, PARQUET_SCHEMA) as writer:
+        for batch in iter_row_batches(query):
+            columns = list(zip(*batch))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, PARQUET_SCHEMA)],
+                schema=PARQUET_SCHEMA
+            ))
+    output.seek(0)
+    return output
+
+
+def write_excel(query):
+    """
+    Writes the rows to a temporary workbook with one sheet per ticker, in constant-memory mode.
+
+    Returns:
+        file: The temporary file, rewound; it is deleted when closed.
+    """
+    output = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'nan_inf_to_errors': True})
+    worksheet = None
+    current_ticker = None
+    row_number = 0
+    for batch in iter_row_batches(query):
+        for row in batch:
+            ticker = row[0]
+            if ticker != current_ticker:
+                worksheet = workbook.add_worksheet(ticker[:31])
+                worksheet.write_row(0, 0, EXPORT_HEADERS[1:])
+                current_ticker = ticker
+                row_number = 1
+            worksheet.write_row(row_number, 0, row[1:])
+            row_number += 1
+    if worksheet is None:
+        workbook.add_worksheet('GapUps')
+    workbook.close()
+    output.seek(0)
+    return output
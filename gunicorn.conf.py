@@ -0,0 +1,20 @@
+# gunicorn.conf.py
+"""
+gunicorn settings of the web app: gunicorn -c gunicorn.conf.py 'app:create_app()'.
+
+The master builds the app once (preload_app) and imports the modules that routes load lazily,
+so workers are forked ready to serve; each worker opens its own database connections and
+Polygon client on first use. Run flask --app app init-db before starting the server.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+timeout = 120
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+
+def when_ready(server):
+    """Imports the lazily loaded modules in the master, so forked workers share them."""
+    if preload_app:
+        import app
+        app.preload_modules()
@@ -0,0 +1,109 @@
+# jobs.py
+"""
+In-process background job queue for /analyze.
+
+A job is created with one row per ticker and returns immediately. Tickers are analyzed on a
+bounded thread pool; each ticker's gap days are stored as soon as it completes, so any
+gunicorn worker can report progress and render the finished tickers from the database.
+"""
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from database.dbmodel import db, AnalysisJob, AnalysisJobTicker
+
+
+class JobQueue:
+    """
+    Runs analysis jobs on a thread pool inside the current process.
+
+    Args:
+        app: The Flask application, used to push an app context in worker threads.
+        analyze_ticker (callable): Analyzes and stores (ticker, gap_threshold, lookback_days), returning the rows.
+        max_workers (int): Number of tickers analyzed at the same time.
+    """
+
+    def __init__(self, app, analyze_ticker, max_workers=4):
+        self.app = app
+        self.analyze_ticker = analyze_ticker
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='analysis-job')
+
+    def submit(self, tickers, gap_threshold, lookback_days):
+        """
+        Creates a job for the tickers and queues every ticker for analysis.
+
+        Returns:
+            str: The job id.
+        """
+        job = AnalysisJob(id=uuid.uuid4().hex, status='queued', gap_threshold=gap_threshold,
+                          lookback_days=lookback_days)
+        for position, ticker in enumerate(tickers):
+            job.tickers.append(AnalysisJobTicker(position=position, ticker=ticker, status='queued'))
+        db.session.add(job)
+        db.session.commit()
+
+        for job_ticker in job.tickers:
+            self.executor.submit(self._run_ticker, job.id, job_ticker.id)
+        return job.id
+
+    def _run_ticker(self, job_id, job_ticker_id):
+        with self.app.app_context():
+            job_ticker = db.session.get(AnalysisJobTicker, job_ticker_id)
+            job_ticker.status = 'running'
+            job = db.session.get(AnalysisJob, job_id)
+            if job.status == 'queued':
+                job.status = 'running'
+            db.session.commit()
+            ticker = job_ticker.ticker
+            gap_threshold, lookback_days = job.gap_threshold, job.lookback_days
+
+            try:
+                gap_up_days_list = self.analyze_ticker(ticker, gap_threshold, lookback_days)
+                job_ticker.gap_up_days = len(gap_up_days_list)
+                job_ticker.status = 'done'
+            except Exception as e:
+                print(f"Error analyzing {ticker} in job {job_id}: {e}")
+                db.session.rollback()
+                job_ticker = db.session.get(AnalysisJobTicker, job_ticker_id)
+                job_ticker.status = 'failed'
+                job_ticker.error = str(e)
+            job_ticker.finished_at = datetime.now(timezone.utc)
+            db.session.commit()
+
+            self._finish_if_complete(job_id)
+            db.session.remove()
+
+    def _finish_if_complete(self, job_id):
+        remaining = AnalysisJobTicker.query.filter(
+            AnalysisJobTicker.job_id == job_id,
+            AnalysisJobTicker.status.in_(('queued', 'running'))
+        ).count()
+        if remaining == 0:
+            job = db.session.get(AnalysisJob, job_id)
+            job.status = 'finished'
+            job.finished_at = datetime.now(timezone.utc)
+            db.session.commit()
+
+
+def job_status(job):
+    """
+    Summarizes a job's progress.
+
+    Returns:
+        dict: Job id, status and per-ticker status, gap-up day count and error.
+    """
+    tickers = [{
+        'ticker': job_ticker.ticker,
+        'status': job_ticker.status,
+        'gap_up_days': job_ticker.gap_up_days,
+        'error': job_ticker.error,
+    } for job_ticker in job.tickers]
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'gap_threshold': job.gap_threshold,
+        'lookback_days': job.lookback_days,
+        'completed': sum(1 for t in tickers if t['status'] in ('done', 'failed')),
+        'total': len(tickers),
+        'tickers': tickers,
+    }
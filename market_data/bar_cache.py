@@ -0,0 +1,401 @@
+# bar_cache.py
+"""
+Persistent on-disk bar cache for Polygon aggregates.
+
+Bars are stored in a local SQLite file, one row per (ticker, timespan, date). Dates that
+have finished trading are kept permanently (until evicted for space), so repeated analyses
+only fetch the dates that are not cached yet, typically just "today".
+
+Bars are fetched and stored unadjusted, which never changes once a session has finished, and
+split-adjusted when they are read with the ticker's current splits (one list_splits call per
+ticker, remembered for SPLITS_MAX_AGE_SECONDS). A split therefore applies to the cached history
+as soon as Polygon lists it, instead of leaving pre-split bars next to post-split ones.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time as time_module
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytz
+from polygon.rest.models import Agg, DailyOpenCloseAgg
+
+from metrics import CACHE_DAYS
+from market_data.bars import BarArray
+from market_data.trading_calendar import is_trading_day, local_dates, session_boundaries
+
+est_timezone = pytz.timezone('America/New_York')
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Timespans whose bars are cached; anything else is passed straight through to Polygon
+CACHED_TIMESPANS = ('minute', 'day')
+
+# Fields of an Agg, in the order they are serialized
+AGG_FIELDS = ('timestamp', 'open', 'high', 'low', 'close', 'volume', 'vwap', 'transactions')
+OPEN_CLOSE_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'pre_market', 'after_hours')
+
+# Fields multiplied by the split price factor; volumes are divided by it
+PRICE_FIELDS = ('open', 'high', 'low', 'close', 'vwap', 'pre_market', 'after_hours')
+
+# How long the splits of a ticker are reused before they are fetched again
+SPLITS_MAX_AGE_SECONDS = 6 * 3600
+
+# Format of the stored rows: version 0 caches held split-adjusted bars
+CACHE_FORMAT_VERSION = 1
+
+
+def today_est():
+    """Returns the current date in the exchange timezone."""
+    return datetime.now(est_timezone).date()
+
+
+def _to_date(value):
+    """Converts a Polygon from_/to argument (YYYY-MM-DD, ms timestamp, date or datetime) to an EST date."""
+    if isinstance(value, datetime):
+        return value.astimezone(est_timezone).date() if value.tzinfo else value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, int):
+        return date.fromisoformat(local_dates([value])[0])
+    return date.fromisoformat(value)
+
+
+def _to_ms(value):
+    """Returns a millisecond bound for from_/to arguments that carry a time component, else None."""
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, int):
+        return value
+    return None
+
+
+def _is_false(value):
+    return value is False or (isinstance(value, str) and value.lower() == 'false')
+
+
+def _is_cacheable(timespan, sort, kwargs):
+    """Tells whether a list_aggs request can be served from the cache."""
+    return timespan in CACHED_TIMESPANS and sort in (None, 'asc') and not kwargs
+
+
+def split_factors(timestamps, splits):
+    """
+    Price factors that adjust unadjusted bars the way Polygon does: prices before a split's
+    execution are multiplied by split_from / split_to (volumes divided by it).
+
+    Args:
+        timestamps (np.ndarray): Epoch ms of the bars.
+        splits (list): (execution midnight ms, split_from, split_to) tuples, see SplitHistory.
+
+    Returns:
+        np.ndarray: One factor per timestamp, 1.0 where no later split applies.
+    """
+    factors = np.ones(len(timestamps))
+    for execution_ms, split_from, split_to in splits:
+        factors[np.asarray(timestamps) < execution_ms] *= split_from / split_to
+    return factors
+
+
+def adjust_for_splits(bars, splits):
+    """Applies splits (see split_factors) to a BarArray of unadjusted bars."""
+    if not splits or not len(bars):
+        return bars
+    factors = split_factors(bars.timestamp, splits)
+    return BarArray(bars.timestamp, bars.open * factors, bars.high * factors, bars.low * factors,
+                    bars.close * factors, bars.volume / factors, bars.vwap * factors)
+
+
+def _adjust_values(values, factor):
+    """Applies a split price factor to a dict of Agg or DailyOpenCloseAgg fields."""
+    if factor == 1.0:
+        return values
+    adjusted = dict(values)
+    for field, value in values.items():
+        if value is None:
+            continue
+        if field in PRICE_FIELDS:
+            adjusted[field] = value * factor
+        elif field == 'volume':
+            adjusted[field] = value / factor
+    return adjusted
+
+
+class SplitHistory:
+    """
+    The splits of every ticker, fetched with one list_splits call per ticker and reused for
+    SPLITS_MAX_AGE_SECONDS. Shared by the clients that adjust stored unadjusted bars.
+
+    Args:
+        polygon_client: The client list_splits is called on.
+        max_age_seconds (float): How long the splits of a ticker are reused.
+    """
+
+    def __init__(self, polygon_client, max_age_seconds=SPLITS_MAX_AGE_SECONDS):
+        self.polygon_client = polygon_client
+        self.max_age_seconds = max_age_seconds
+        self._splits = {}  # ticker -> (fetched at, [(execution midnight ms, split_from, split_to)])
+        self._lock = threading.Lock()
+
+    def get(self, ticker):
+        """Returns the splits of a ticker as (execution midnight ms, split_from, split_to), or None on error."""
+        with self._lock:
+            cached = self._splits.get(ticker)
+        if cached is not None and time_module.time() - cached[0] < self.max_age_seconds:
+            return cached[1]
+        try:
+            splits = [(session_boundaries(str(split.execution_date))['midnight'], split.split_from, split.split_to)
+                      for split in self.polygon_client.list_splits(ticker=ticker, limit=1000)
+                      if split.split_from and split.split_to]
+        except Exception as e:
+            print(f"Error fetching splits for {ticker}: {e}")
+            return None
+        with self._lock:
+            self._splits[ticker] = (time_module.time(), splits)
+        return splits
+
+
+class BarCache:
+    """
+    SQLite-backed store of bars keyed by (ticker, timespan, date).
+
+    Each row holds every bar of one date (an empty list for non-trading days), so the set of
+    rows doubles as the cached coverage. Rows for dates that have not finished trading are
+    stored as not finalized and are always refetched. When the store grows past max_bytes the
+    least recently used rows are evicted.
+
+    Rows hold unadjusted bars (see CachedPolygonClient); a cache file written by an earlier
+    version, which stored split-adjusted bars, is emptied when it is opened.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Batch worker processes share the file: WAL lets them read while one of them writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS bars (
+                ticker TEXT NOT NULL,
+                timespan TEXT NOT NULL,
+                date TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                nbytes INTEGER NOT NULL,
+                finalized INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (ticker, timespan, date)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_bars_last_access ON bars (last_access)")
+        self._conn.commit()
+        self._conn.execute("BEGIN IMMEDIATE")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < CACHE_FORMAT_VERSION:
+            self._conn.execute("DELETE FROM bars")
+            self._conn.execute(f"PRAGMA user_version = {CACHE_FORMAT_VERSION}")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM bars").fetchone()[0]
+
+    def load(self, ticker, timespan, start_date, end_date):
+        """
+        Loads the finalized rows for a date range.
+
+        Returns:
+            dict: 'YYYY-MM-DD' -> list of decoded rows, for the dates that are cached and finalized.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, payload FROM bars WHERE ticker = ? AND timespan = ? AND date BETWEEN ? AND ? "
+                "AND finalized = 1",
+                (ticker, timespan, start_date.isoformat(), end_date.isoformat())
+            ).fetchall()
+            if rows:
+                self._conn.execute(
+                    "UPDATE bars SET last_access = ? WHERE ticker = ? AND timespan = ? AND date BETWEEN ? AND ?",
+                    (time_module.time(), ticker, timespan, start_date.isoformat(), end_date.isoformat())
+                )
+                self._conn.commit()
+        return {date_str: json.loads(payload) for date_str, payload in rows}
+
+    def store(self, ticker, timespan, rows_by_date, finalized_before):
+        """
+        Stores one row per date, replacing any existing rows.
+
+        Args:
+            rows_by_date (dict): 'YYYY-MM-DD' -> list of encoded rows (may be empty).
+            finalized_before (date): Dates strictly before this are stored as finalized.
+        """
+        now = time_module.time()
+        records = []
+        for date_str, rows in rows_by_date.items():
+            payload = json.dumps(rows, separators=(',', ':'))
+            finalized = int(date_str < finalized_before.isoformat())
+            records.append((ticker, timespan, date_str, payload, len(payload), finalized, now))
+
+        with self._lock:
+            replaced = self._conn.execute(
+                "SELECT COALESCE(SUM(nbytes), 0) FROM bars WHERE ticker = ? AND timespan = ? AND date IN (%s)"
+                % ','.join('?' * len(records)),
+                (ticker, timespan, *rows_by_date.keys())
+            ).fetchone()[0] if records else 0
+            self._conn.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+            self._total_bytes += sum(record[4] for record in records) - replaced
+            self._evict()
+            self._conn.commit()
+
+    def invalidate(self, ticker):
+        """Drops every cached row for a ticker, e.g. after Polygon corrects its history."""
+        with self._lock:
+            self._conn.execute("DELETE FROM bars WHERE ticker = ?", (ticker,))
+            self._conn.commit()
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM bars").fetchone()[0]
+
+    def _evict(self):
+        """Evicts least recently used rows until the store is back under 90% of max_bytes."""
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        cursor = self._conn.execute("SELECT ticker, timespan, date, nbytes FROM bars ORDER BY last_access")
+        evicted = []
+        for ticker, timespan, date_str, nbytes in cursor:
+            if self._total_bytes <= target:
+                break
+            evicted.append((ticker, timespan, date_str))
+            self._total_bytes -= nbytes
+        self._conn.executemany("DELETE FROM bars WHERE ticker = ? AND timespan = ? AND date = ?", evicted)
+
+
+class CachedPolygonClient:
+    """
+    Drop-in wrapper around a Polygon RESTClient that serves list_aggs and
+    get_daily_open_close_agg from a BarCache, plus list_bars for the same bars as a BarArray.
+
+    A request is mapped to the calendar dates it covers, cached dates are served locally,
+    and a single Polygon call fetches the span of missing dates. Minute requests always fetch
+    whole days so later requests for other windows of the same day are cache hits. Bars are
+    fetched and stored unadjusted; adjusted requests (the default) apply the ticker's current
+    splits on read, and when the splits cannot be fetched the request goes to Polygon uncached.
+    Any other attribute is delegated to the wrapped client.
+
+    Args:
+        polygon_client: The client to wrap.
+        bar_cache (BarCache): The store of unadjusted bars.
+        split_history (SplitHistory or None): Splits applied on read; one over polygon_client by default.
+    """
+
+    def __init__(self, polygon_client, bar_cache, split_history=None):
+        self.polygon_client = polygon_client
+        self.bar_cache = bar_cache
+        self.split_history = split_history or SplitHistory(polygon_client)
+
+    def __getattr__(self, name):
+        return getattr(self.polygon_client, name)
+
+    def list_aggs(self, ticker, multiplier, timespan, from_, to, adjusted=None, sort=None, limit=None, **kwargs):
+        splits = self._splits(ticker, adjusted) if _is_cacheable(timespan, sort, kwargs) else None
+        if splits is None:
+            return self.polygon_client.list_aggs(ticker=ticker, multiplier=multiplier, timespan=timespan,
+                                                 from_=from_, to=to, adjusted=adjusted, sort=sort, limit=limit,
+                                                 **kwargs)
+
+        start_ms, end_ms = _to_ms(from_), _to_ms(to)
+        rows = [row for rows in self._load_rows(ticker, multiplier, timespan, from_, to) for row in rows
+                if (start_ms is None or row[0] >= start_ms) and (end_ms is None or row[0] <= end_ms)]
+        factors = split_factors([row[0] for row in rows], splits).tolist()
+        return iter([Agg(**_adjust_values(dict(zip(AGG_FIELDS, row)), factor)) for row, factor in zip(rows, factors)])
+
+    def list_bars(self, ticker, multiplier, timespan, from_, to, adjusted=None, sort=None, limit=None, **kwargs):
+        """
+        Same request as list_aggs, returned as a BarArray built straight from the cached rows
+        without creating an Agg per bar.
+        """
+        splits = self._splits(ticker, adjusted) if _is_cacheable(timespan, sort, kwargs) else None
+        if splits is None:
+            return BarArray.from_aggs(self.polygon_client.list_aggs(ticker=ticker, multiplier=multiplier,
+                                                                    timespan=timespan, from_=from_, to=to,
+                                                                    adjusted=adjusted, sort=sort, limit=limit,
+                                                                    **kwargs))
+
+        rows = [row for rows in self._load_rows(ticker, multiplier, timespan, from_, to) for row in rows]
+        bars = adjust_for_splits(BarArray.from_rows(rows, AGG_FIELDS), splits)
+        start_ms, end_ms = _to_ms(from_), _to_ms(to)
+        if start_ms is None and end_ms is None:
+            return bars
+        # list_aggs bounds are inclusive at both ends
+        return bars.window(start_ms if start_ms is not None else np.iinfo(np.int64).min,
+                           end_ms + 1 if end_ms is not None else np.iinfo(np.int64).max)
+
+    def _splits(self, ticker, adjusted):
+        """Returns the splits to apply to a request ([] if unadjusted), or None if they cannot be fetched."""
+        return [] if _is_false(adjusted) else self.split_history.get(ticker)
+
+    def _load_rows(self, ticker, multiplier, timespan, from_, to):
+        """
+        Loads the unadjusted bars of a request from the cache, fetching the span of missing
+        trading days in one call.
+
+        Returns:
+            list: One list of encoded rows per calendar date of the request, in date order.
+        """
+        cache_key = f"{multiplier}/{timespan}"
+        start_date, end_date = _to_date(from_), _to_date(to)
+        rows_by_date = self.bar_cache.load(ticker, cache_key, start_date, end_date)
+
+        # Weekends and holidays have no bars: they are never fetched just to find that out
+        missing = [d for d in _date_range(start_date, end_date)
+                   if d.isoformat() not in rows_by_date and is_trading_day(d)]
+        CACHE_DAYS.inc(len(rows_by_date), cache_key, 'hit')
+        CACHE_DAYS.inc(len(missing), cache_key, 'miss')
+        if missing:
+            fetched = {d.isoformat(): [] for d in _date_range(missing[0], missing[-1])}
+            aggs_data = self.polygon_client.list_aggs(
+                ticker=ticker,
+                multiplier=multiplier,
+                timespan=timespan,
+                from_=missing[0].isoformat(),
+                to=missing[-1].isoformat(),
+                adjusted='false',
+                limit=50000
+            )
+            aggs_data = list(aggs_data)
+            for agg, date_str in zip(aggs_data, local_dates([agg.timestamp for agg in aggs_data])):
+                if date_str in fetched:
+                    fetched[date_str].append([getattr(agg, field) for field in AGG_FIELDS])
+            self.bar_cache.store(ticker, cache_key, fetched, finalized_before=today_est())
+            rows_by_date.update(fetched)
+
+        return [rows_by_date.get(d.isoformat(), []) for d in _date_range(start_date, end_date)]
+
+    def get_daily_open_close_agg(self, ticker, date, adjusted=None, **kwargs):
+        splits = None if kwargs else self._splits(ticker, adjusted)
+        if splits is None:
+            return self.polygon_client.get_daily_open_close_agg(ticker=ticker, date=date, adjusted=adjusted,
+                                                                **kwargs)
+
+        session_date = _to_date(date)
+        cached = self.bar_cache.load(ticker, 'open_close', session_date, session_date)
+        if session_date.isoformat() in cached:
+            CACHE_DAYS.inc(1, 'open_close', 'hit')
+            row = cached[session_date.isoformat()]
+        else:
+            CACHE_DAYS.inc(1, 'open_close', 'miss')
+            daily_summary = self.polygon_client.get_daily_open_close_agg(ticker=ticker, date=session_date.isoformat(),
+                                                                         adjusted='false')
+            row = [getattr(daily_summary, field, None) for field in OPEN_CLOSE_FIELDS]
+            self.bar_cache.store(ticker, 'open_close', {session_date.isoformat(): row},
+                                 finalized_before=today_est())
+        factor = float(split_factors([session_boundaries(session_date.isoformat())['midnight']], splits)[0])
+        return DailyOpenCloseAgg(symbol=ticker, from_=session_date.isoformat(),
+                                 **_adjust_values(dict(zip(OPEN_CLOSE_FIELDS, row)), factor))
+
+
+def _date_range(start_date, end_date):
+    """Yields every calendar date from start_date to end_date inclusive."""
+    days = (end_date - start_date).days
+    return [start_date + timedelta(days=offset) for offset in range(days + 1)]
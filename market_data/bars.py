@@ -0,0 +1,122 @@
+# bars.py
+"""
+Compact struct-of-arrays container for bar aggregates.
+
+A BarArray keeps one contiguous typed NumPy array per field instead of one Agg object per
+bar. Time windows are zero-copy views found by binary search, and the per-bar loops of the
+analysis (high/low with their times, volume sums, VWAP resampling and cross counting) become
+array operations.
+"""
+from array import array
+
+import numpy as np
+
+BAR_FIELDS = ('timestamp', 'open', 'high', 'low', 'close', 'volume', 'vwap')
+
+
+class BarArray:
+    """
+    Bars as parallel arrays, in ascending timestamp order.
+
+    Args:
+        timestamp (np.ndarray): int64 epoch milliseconds.
+        open, high, low, close, volume, vwap (np.ndarray): float64 values; NaN where Polygon sent none.
+    """
+
+    __slots__ = BAR_FIELDS
+
+    def __init__(self, timestamp, open, high, low, close, volume, vwap):
+        self.timestamp = timestamp
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.vwap = vwap
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), *(np.empty(0) for _ in BAR_FIELDS[1:]))
+
+    @classmethod
+    def from_aggs(cls, aggs):
+        """
+        Fills the arrays straight from an iterator of Agg objects (e.g. a paginated list_aggs),
+        without keeping the objects.
+        """
+        timestamps = array('q')
+        columns = {field: array('d') for field in BAR_FIELDS[1:]}
+        for agg in aggs:
+            timestamps.append(agg.timestamp)
+            for field, column in columns.items():
+                value = getattr(agg, field)
+                column.append(np.nan if value is None else value)
+        # The arrays share the buffers they were appended to
+        return cls(np.frombuffer(timestamps, dtype=np.int64),
+                   *(np.frombuffer(columns[field], dtype=np.float64) for field in BAR_FIELDS[1:]))
+
+    @classmethod
+    def from_rows(cls, rows, fields):
+        """
+        Builds the arrays from row lists, e.g. the bar cache payload.
+
+        Args:
+            rows (list): One list of values per bar, in the order of fields.
+            fields (tuple): Field names of the row values; must include every BAR_FIELDS name.
+        """
+        if not rows:
+            return cls.empty()
+        matrix = np.array(rows, dtype=np.float64)  # None becomes NaN
+        return cls(matrix[:, fields.index('timestamp')].astype(np.int64),
+                   *(np.ascontiguousarray(matrix[:, fields.index(field)]) for field in BAR_FIELDS[1:]))
+
+    @classmethod
+    def concat(cls, parts):
+        """Joins BarArrays into one, in ascending timestamp order."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        timestamp = np.concatenate([part.timestamp for part in parts])
+        order = np.argsort(timestamp, kind='stable')
+        return cls(timestamp[order],
+                   *(np.concatenate([getattr(part, field) for part in parts])[order] for field in BAR_FIELDS[1:]))
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def window(self, start_ms, end_ms):
+        """Returns the bars with start_ms <= timestamp < end_ms as views of these arrays."""
+        start, end = np.searchsorted(self.timestamp, (start_ms, end_ms), side='left')
+        return BarArray(*(getattr(self, field)[start:end] for field in BAR_FIELDS))
+
+    def high_low(self):
+        """
+        Finds the high and low and the timestamps of their first occurrence.
+
+        Returns:
+            tuple: (max_high, high_timestamp_ms, min_low, low_timestamp_ms), all None if there are no
+                   bars or no high or low is known (e.g. minutes without trades).
+        """
+        if not len(self) or np.all(np.isnan(self.high)) or np.all(np.isnan(self.low)):
+            return None, None, None, None
+        high_index = int(np.nanargmax(self.high))
+        low_index = int(np.nanargmin(self.low))
+        return (float(self.high[high_index]), int(self.timestamp[high_index]),
+                float(self.low[low_index]), int(self.timestamp[low_index]))
+
+    def total_volume(self):
+        return float(np.nansum(self.volume))
+
+
+def fetch_bar_array(polygon_client, **list_aggs_kwargs):
+    """
+    Runs a list_aggs request and returns the result as a BarArray.
+
+    Clients that can serve arrays directly (the bar cache's list_bars) skip Agg objects entirely.
+    """
+    list_bars = getattr(polygon_client, 'list_bars', None)
+    if list_bars is not None:
+        return list_bars(**list_aggs_kwargs)
+    return BarArray.from_aggs(polygon_client.list_aggs(**list_aggs_kwargs))
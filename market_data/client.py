@@ -0,0 +1,58 @@
+# client.py
+"""
+Builds the layered Polygon client used by the web app and the batch runner.
+
+All aggregate requests go through the on-disk bar cache so finalized sessions are fetched only
+once; cache misses are coalesced and retried by the resilient layer, and every attempt takes a
+token from the rate limiter. The keep-alive pool holds a connection for every thread that can
+fetch at once. With a flat-file bar store, the dates ingested from flat files are read from
+disk and only the others reach the bar cache.
+"""
+from polygon import RESTClient
+
+from market_data.bar_cache import BarCache, CachedPolygonClient, DEFAULT_MAX_BYTES
+from market_data.flat_files import FlatFileBarStore, FlatFileClient
+from market_data.resilient import ResilientClient, configure_connection_pool
+from market_data.scheduler import RateLimitedClient
+
+
+def build_polygon_client(api_key, token_bucket, bar_cache_path, bar_cache_max_bytes=DEFAULT_MAX_BYTES,
+                         pool_size=1, max_retries=4, deadline=60.0, connect_timeout=5.0, read_timeout=30.0,
+                         bar_store_dir=None):
+    """
+    Builds CachedPolygonClient(ResilientClient(RateLimitedClient(RESTClient))), wrapped in a
+    FlatFileClient when a flat-file bar store is given.
+
+    Args:
+        api_key (str or None): The Polygon API key; None reads POLYGON_API_KEY.
+        token_bucket: TokenBucket (or SharedTokenBucket) every request attempt takes a token from.
+        bar_cache_path (str): Path of the bar cache SQLite file.
+        bar_cache_max_bytes (int): Size above which the bar cache evicts.
+        pool_size (int): Connections kept alive, normally the number of threads that fetch.
+        max_retries (int): Retries of a transient failure after the first attempt.
+        deadline (float): Seconds a call may take across all its attempts.
+        connect_timeout (float): Seconds to establish a connection.
+        read_timeout (float): Seconds to wait for a response.
+        bar_store_dir (str or None): Directory of the FlatFileBarStore to read ingested bars from.
+
+    Returns:
+        CachedPolygonClient or FlatFileClient: The client; raises if the RESTClient cannot be
+                                               created (e.g. no API key).
+    """
+    rest_client = configure_connection_pool(
+        RESTClient(api_key),
+        pool_size=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout
+    )
+    cached_client = CachedPolygonClient(
+        ResilientClient(
+            RateLimitedClient(rest_client, token_bucket),
+            max_retries=max_retries,
+            deadline=deadline
+        ),
+        BarCache(bar_cache_path, max_bytes=bar_cache_max_bytes)
+    )
+    if bar_store_dir is None:
+        return cached_client
+    return FlatFileClient(cached_client, FlatFileBarStore(bar_store_dir))
@@ -0,0 +1,95 @@
+# feeds.py
+"""
+Minute bar feeds for the live gap watcher.
+
+A feed is an iterable of batches; each batch is a list of bars as tuples in FEED_FIELDS order.
+ReplayFeed plays a recorded minute-aggregates file back one minute at a time (for tests and
+for rehearsing a session), PolygonLiveFeed streams Polygon's per-minute aggregates ("AM"
+channel) over the WebSocket API.
+"""
+import queue
+import threading
+import time as time_module
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from polygon import WebSocketClient
+
+from market_data.flat_files import _read_flat_file
+
+FEED_FIELDS = ('ticker', 'timestamp', 'open', 'high', 'low', 'close', 'volume', 'vwap')
+
+
+class ReplayFeed:
+    """
+    Replays a minute-aggregates file (Polygon flat-file CSV, optionally gzipped) in time order.
+
+    Args:
+        path (str): The file, e.g. minute_aggs_v1/2025/03/2025-03-07.csv.gz.
+        speed (float or None): Playback speed; 60 plays a minute per second. None replays as fast
+                               as the consumer reads.
+        start_ms (int or None): Skip bars before this epoch-ms timestamp.
+        end_ms (int or None): Stop before this epoch-ms timestamp.
+    """
+
+    def __init__(self, path, speed=None, start_ms=None, end_ms=None):
+        self.path = path
+        self.speed = speed
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+
+    def __iter__(self):
+        table = pa.Table.from_batches(list(_read_flat_file(self.path)))
+        stamps = table.column('timestamp')
+        if self.start_ms is not None:
+            table = table.filter(pc.greater_equal(stamps, self.start_ms))
+            stamps = table.column('timestamp')
+        if self.end_ms is not None:
+            table = table.filter(pc.less(stamps, self.end_ms))
+        # Flat files are ordered by ticker: regroup them by minute
+        table = table.sort_by([('timestamp', 'ascending'), ('ticker', 'ascending')])
+        columns = {field: table.column(field).to_numpy(zero_copy_only=False) for field in FEED_FIELDS}
+        stamps = columns['timestamp']
+        starts = np.flatnonzero(np.r_[True, stamps[1:] != stamps[:-1]]) if len(stamps) else np.array([], dtype=int)
+        ends = np.r_[starts[1:], len(stamps)]
+
+        previous_ms = None
+        for start, end in zip(starts, ends):
+            minute_ms = int(stamps[start])
+            if self.speed and previous_ms is not None:
+                time_module.sleep((minute_ms - previous_ms) / 1000 / self.speed)
+            previous_ms = minute_ms
+            yield list(zip(*(columns[field][start:end].tolist() for field in FEED_FIELDS)))
+
+
+class PolygonLiveFeed:
+    """
+    Streams Polygon's per-minute aggregates over the WebSocket API.
+
+    The WebSocket client runs on a background thread and hands each message list to the
+    iterator through a queue, so a slow consumer never blocks the socket.
+
+    Args:
+        api_key (str or None): The Polygon API key; None reads POLYGON_API_KEY.
+        tickers (list or None): Symbols to subscribe to; None subscribes to every ticker.
+    """
+
+    def __init__(self, api_key=None, tickers=None):
+        self.api_key = api_key
+        self.tickers = tickers
+
+    def __iter__(self):
+        subscriptions = [f"AM.{ticker}" for ticker in self.tickers] if self.tickers else ['AM.*']
+        client = WebSocketClient(api_key=self.api_key, subscriptions=subscriptions)
+        messages = queue.Queue()
+        thread = threading.Thread(target=client.run, args=(messages.put,), daemon=True)
+        thread.start()
+        # The socket thread is a daemon: it ends with the process once the consumer stops reading
+        while thread.is_alive() or not messages.empty():
+            try:
+                batch = messages.get(timeout=1)
+            except queue.Empty:
+                continue
+            yield [(agg.symbol, agg.start_timestamp, agg.open, agg.high, agg.low, agg.close, agg.volume, agg.vwap)
+                   for agg in batch if getattr(agg, 'event_type', None) == 'AM']
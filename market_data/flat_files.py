@@ -0,0 +1,344 @@
+# flat_files.py
+"""
+Local bar store built from Polygon flat files.
+
+Polygon publishes the aggregates of every ticker as one gzipped CSV per date
+(us_stocks_sip/minute_aggs_v1/YYYY/MM/YYYY-MM-DD.csv.gz and day_aggs_v1 alike). Files already
+on disk are streamed in chunks into a partitioned Parquet store: one file per date for minute
+bars and one per month for day bars, sorted by ticker so a read for one ticker only touches the
+row groups that hold it. FlatFileClient serves list_aggs and list_bars from that store for the
+dates it covers and fetches only the rest (typically the last few days) from Polygon, so a
+full-history backfill reads the disk instead of paging through the REST API.
+
+Flat files carry no VWAP: unless a file has a vwap column (e.g. a recorded feed), the bars are
+stored with a NaN VWAP, and the VWAP crosses of a session read from them are unknown (None,
+so its gap day is not finalized). They are also not split-adjusted; adjusted requests apply
+the ticker's splits (one list_splits call per ticker, shared with the bar cache, see
+SplitHistory).
+"""
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from polygon.rest.models import Agg
+
+from market_data.bar_cache import CachedPolygonClient, SplitHistory, _date_range, _is_false, _to_date, _to_ms, \
+    adjust_for_splits, today_est
+from market_data.bars import BAR_FIELDS, BarArray, fetch_bar_array
+from market_data.trading_calendar import is_trading_day, local_dates, session_boundaries
+
+FLAT_FILE_TIMESPANS = ('minute', 'day')
+
+# Columns of a Polygon aggregates flat file; window_start is in epoch nanoseconds
+FLAT_FILE_COLUMNS = ('ticker', 'volume', 'open', 'close', 'high', 'low', 'window_start', 'transactions')
+
+STORE_SCHEMA = pa.schema([('ticker', pa.string()), ('timestamp', pa.int64())]
+                         + [(field, pa.float64()) for field in BAR_FIELDS[1:]]
+                         + [('transactions', pa.float64())])
+
+# Bytes of CSV parsed per chunk, and rows per Parquet row group
+CSV_BLOCK_BYTES = 16 * 1024 * 1024
+ROW_GROUP_ROWS = 16 * 1024
+
+# Bumped when the meaning of the stored bars changes; bars of another version are deleted
+STORE_FORMAT_VERSION = '1'
+
+_FILE_DATE = re.compile(r'(\d{4}-\d{2}-\d{2})\.csv(\.gz)?$')
+
+
+def flat_file_timespan(path):
+    """Tells the timespan of a flat file from Polygon's directory layout, or None."""
+    normalized = path.replace(os.sep, '/')
+    for timespan in FLAT_FILE_TIMESPANS:
+        if f'/{timespan}_aggs' in normalized:
+            return timespan
+    return None
+
+
+def flat_file_date(path):
+    """Returns the session date in a flat file's name, or None."""
+    match = _FILE_DATE.search(os.path.basename(path))
+    return date.fromisoformat(match.group(1)) if match else None
+
+
+def find_flat_files(paths):
+    """Expands files and directories (searched recursively) into the sorted list of YYYY-MM-DD.csv[.gz] files."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                found.extend(os.path.join(directory, name) for name in names if _FILE_DATE.search(name))
+        elif _FILE_DATE.search(os.path.basename(path)):
+            found.append(path)
+    return sorted(found)
+
+
+def _to_store_batch(batch):
+    """Converts a record batch of flat-file columns to the store schema."""
+    return pa.RecordBatch.from_arrays([
+        pc.cast(batch.column('ticker'), pa.string()),
+        pc.divide(pc.cast(batch.column('window_start'), pa.int64()), 1_000_000),
+        pc.cast(batch.column('open'), pa.float64()),
+        pc.cast(batch.column('high'), pa.float64()),
+        pc.cast(batch.column('low'), pa.float64()),
+        pc.cast(batch.column('close'), pa.float64()),
+        pc.cast(batch.column('volume'), pa.float64()),
+        pc.fill_null(pc.cast(batch.column('vwap'), pa.float64()), float('nan')),
+        pc.cast(batch.column('transactions'), pa.float64()),
+    ], schema=STORE_SCHEMA)
+
+
+def _read_flat_file(path):
+    """Streams a (gzipped) flat file as record batches in the store schema."""
+    compression = 'gzip' if path.endswith('.gz') else None
+    reader = pa_csv.open_csv(
+        pa.input_stream(path, compression=compression),
+        read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+        convert_options=pa_csv.ConvertOptions(include_columns=list(FLAT_FILE_COLUMNS) + ['vwap'],
+                                              include_missing_columns=True,
+                                              column_types={'ticker': pa.string(), 'vwap': pa.float64()})
+    )
+    for batch in reader:
+        yield _to_store_batch(batch)
+
+
+class FlatFileBarStore:
+    """
+    Partitioned Parquet store of the bars ingested from flat files.
+
+    Layout: minute/YYYY/YYYY-MM-DD.parquet (one file per date) and day/YYYY-MM.parquet (one file
+    per month, listing the dates it holds in its metadata). A date is covered once its file was
+    ingested; re-ingesting a date replaces it. Bars ingested by an earlier version, which stored
+    the typical price as the VWAP of files without one, are deleted when the store is opened.
+
+    Args:
+        directory (str): Root directory of the store.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._day_lock = threading.Lock()
+        self._month_dates = {}  # month file path -> (mtime_ns, set of dates)
+        self._check_format()
+
+    def _check_format(self):
+        """Deletes the ingested bars when they were written in another format."""
+        version_path = os.path.join(self.directory, 'FORMAT')
+        try:
+            with open(version_path) as version_file:
+                if version_file.read().strip() == STORE_FORMAT_VERSION:
+                    return
+        except FileNotFoundError:
+            pass
+        for timespan in FLAT_FILE_TIMESPANS:
+            if os.path.isdir(os.path.join(self.directory, timespan)):
+                shutil.rmtree(os.path.join(self.directory, timespan))
+                print(f"Deleted the {timespan} bars of {self.directory} ingested by an earlier version; "
+                      f"ingest their flat files again.")
+        with open(version_path, 'w') as version_file:
+            version_file.write(STORE_FORMAT_VERSION + '\n')
+
+    def _minute_path(self, session_date):
+        return os.path.join(self.directory, 'minute', f"{session_date.year:04d}", f"{session_date.isoformat()}.parquet")
+
+    def _day_path(self, session_date):
+        return os.path.join(self.directory, 'day', f"{session_date.year:04d}-{session_date.month:02d}.parquet")
+
+    def _dates_in_month_file(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return set()
+        cached = self._month_dates.get(path)
+        if cached is None or cached[0] != mtime:
+            metadata = pq.read_schema(path).metadata or {}
+            cached = (mtime, set(json.loads(metadata.get(b'dates', b'[]'))))
+            self._month_dates[path] = cached
+        return cached[1]
+
+    def covered_dates(self, timespan, start_date, end_date):
+        """Returns the 'YYYY-MM-DD' dates in [start_date, end_date] that were ingested."""
+        if timespan == 'minute':
+            return {d.isoformat() for d in _date_range(start_date, end_date)
+                    if is_trading_day(d) and os.path.exists(self._minute_path(d))}
+        covered = set()
+        for path in sorted({self._day_path(d) for d in _date_range(start_date, end_date)}):
+            covered.update(d for d in self._dates_in_month_file(path)
+                           if start_date.isoformat() <= d <= end_date.isoformat())
+        return covered
+
+    def load(self, ticker, timespan, dates):
+        """
+        Loads the bars of a ticker for covered dates.
+
+        Args:
+            ticker (str): The stock ticker symbol.
+            timespan (str): 'minute' or 'day'.
+            dates (iterable): 'YYYY-MM-DD' dates, all covered.
+
+        Returns:
+            BarArray: The unadjusted bars of those dates, in ascending time order.
+        """
+        dates = sorted(dates)
+        if not dates:
+            return BarArray.empty()
+        days = [date.fromisoformat(d) for d in dates]
+        paths = sorted({self._minute_path(d) if timespan == 'minute' else self._day_path(d) for d in days})
+        tables = [pq.read_table(path, columns=list(BAR_FIELDS), filters=[('ticker', '==', ticker)])
+                  for path in paths]
+        table = pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+        bars = BarArray(*(table.column(field).to_numpy() for field in BAR_FIELDS))
+        if np.any(np.diff(bars.timestamp) < 0):
+            order = np.argsort(bars.timestamp, kind='stable')
+            bars = BarArray(*(getattr(bars, field)[order] for field in BAR_FIELDS))
+        if timespan == 'day':
+            # Month files also hold dates that were not asked for
+            keep = np.isin(local_dates(bars.timestamp), dates)
+            bars = BarArray(*(getattr(bars, field)[keep] for field in BAR_FIELDS))
+        return bars
+
+    def ingest(self, path, timespan=None):
+        """
+        Streams one flat file into the store, replacing the date if it was ingested before.
+
+        Args:
+            path (str): A YYYY-MM-DD.csv.gz (or .csv) aggregates file.
+            timespan (str or None): 'minute' or 'day'; read from Polygon's directory layout when omitted.
+
+        Returns:
+            int: The number of bars stored.
+        """
+        timespan = timespan or flat_file_timespan(path)
+        if timespan not in FLAT_FILE_TIMESPANS:
+            raise ValueError(f"Cannot tell the timespan of {path}; expected a minute_aggs or day_aggs directory.")
+        session_date = flat_file_date(path)
+        if timespan == 'minute':
+            return self._ingest_minute(path, session_date)
+        return self._ingest_day(path, session_date)
+
+    def _ingest_minute(self, path, session_date):
+        # Flat files are ordered by ticker, so streaming the chunks keeps the store sorted
+        target = self._minute_path(session_date)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temporary_path = target + '.tmp'
+        rows = 0
+        with pq.ParquetWriter(temporary_path, STORE_SCHEMA, compression='zstd') as writer:
+            for batch in _read_flat_file(path):
+                writer.write_table(pa.Table.from_batches([batch]), row_group_size=ROW_GROUP_ROWS)
+                rows += batch.num_rows
+        os.replace(temporary_path, target)
+        return rows
+
+    def _ingest_day(self, path, session_date):
+        new_rows = pa.Table.from_batches(list(_read_flat_file(path)), schema=STORE_SCHEMA)
+        target = self._day_path(session_date)
+        with self._day_lock:
+            dates = self._dates_in_month_file(target) - {session_date.isoformat()}
+            tables = [new_rows]
+            if os.path.exists(target):
+                existing = pq.read_table(target)
+                midnight = session_boundaries(session_date.isoformat())['midnight']
+                next_midnight = session_boundaries((session_date + timedelta(days=1)).isoformat())['midnight']
+                stamps = existing.column('timestamp')
+                tables.append(existing.filter(pc.or_(pc.less(stamps, midnight),
+                                                     pc.greater_equal(stamps, next_midnight))))
+            month = pa.concat_tables(tables).sort_by([('ticker', 'ascending'), ('timestamp', 'ascending')])
+            month = month.replace_schema_metadata(
+                {'dates': json.dumps(sorted(dates | {session_date.isoformat()}))})
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temporary_path = target + '.tmp'
+            pq.write_table(month, temporary_path, row_group_size=ROW_GROUP_ROWS, compression='zstd')
+            os.replace(temporary_path, target)
+        return new_rows.num_rows
+
+
+def ingest_flat_file(directory, path, timespan=None):
+    """Ingests one file into the store at directory; module-level so a process pool can run it."""
+    return FlatFileBarStore(directory).ingest(path, timespan)
+
+
+class FlatFileClient:
+    """
+    Drop-in wrapper that serves list_aggs and list_bars of 1-minute and 1-day bars from a
+    FlatFileBarStore for the dates it covers, and fetches the other trading days of a request in
+    one call to the wrapped client (normally the CachedPolygonClient). Any other request and
+    attribute is delegated to the wrapped client.
+
+    Args:
+        polygon_client: The client to wrap.
+        store (FlatFileBarStore): The ingested bars.
+    """
+
+    def __init__(self, polygon_client, store):
+        self.polygon_client = polygon_client
+        self.store = store
+        # The bar cache below adjusts its bars with the same splits: share them
+        self.split_history = polygon_client.split_history if isinstance(polygon_client, CachedPolygonClient) \
+            else SplitHistory(polygon_client)
+
+    def __getattr__(self, name):
+        return getattr(self.polygon_client, name)
+
+    def list_aggs(self, ticker, multiplier, timespan, from_, to, adjusted=None, sort=None, limit=None, **kwargs):
+        bars = self._load(ticker, multiplier, timespan, from_, to, adjusted, sort, kwargs)
+        if bars is None:
+            return self.polygon_client.list_aggs(ticker=ticker, multiplier=multiplier, timespan=timespan,
+                                                 from_=from_, to=to, adjusted=adjusted, sort=sort, limit=limit,
+                                                 **kwargs)
+        columns = [getattr(bars, field).tolist() for field in BAR_FIELDS]
+        return iter([Agg(**{field: (None if isinstance(value, float) and value != value else value)
+                            for field, value in zip(BAR_FIELDS, values)})
+                     for values in zip(*columns)])
+
+    def list_bars(self, ticker, multiplier, timespan, from_, to, adjusted=None, sort=None, limit=None, **kwargs):
+        """Same request as list_aggs, returned as a BarArray."""
+        bars = self._load(ticker, multiplier, timespan, from_, to, adjusted, sort, kwargs)
+        if bars is None:
+            return fetch_bar_array(self.polygon_client, ticker=ticker, multiplier=multiplier, timespan=timespan,
+                                   from_=from_, to=to, adjusted=adjusted, sort=sort, limit=limit, **kwargs)
+        return bars
+
+    def _load(self, ticker, multiplier, timespan, from_, to, adjusted, sort, kwargs):
+        """
+        Loads a request from the store plus the uncovered trading days from the wrapped client.
+
+        Returns:
+            BarArray or None: The bars, or None if the request is not served from the store.
+        """
+        if multiplier != 1 or timespan not in FLAT_FILE_TIMESPANS or sort not in (None, 'asc') or kwargs:
+            return None
+        start_date, end_date = _to_date(from_), _to_date(to)
+        covered = self.store.covered_dates(timespan, start_date, end_date)
+        if not covered:
+            return None
+        adjust = not _is_false(adjusted)
+        splits = self.split_history.get(ticker) if adjust else []
+        if splits is None:
+            return None
+
+        parts = [adjust_for_splits(self.store.load(ticker, timespan, covered), splits)]
+        missing = [d for d in _date_range(start_date, end_date)
+                   if d.isoformat() not in covered and is_trading_day(d) and d <= today_est()]
+        if missing:
+            fetched = fetch_bar_array(self.polygon_client, ticker=ticker, multiplier=1, timespan=timespan,
+                                      from_=missing[0].isoformat(), to=missing[-1].isoformat(),
+                                      adjusted='true' if adjust else 'false', limit=50000)
+            keep = ~np.isin(local_dates(fetched.timestamp), list(covered))
+            parts.append(BarArray(*(getattr(fetched, field)[keep] for field in BAR_FIELDS)))
+        bars = BarArray.concat(parts)
+
+        start_ms, end_ms = _to_ms(from_), _to_ms(to)
+        if start_ms is None and end_ms is None:
+            return bars
+        # list_aggs bounds are inclusive at both ends
+        return bars.window(start_ms if start_ms is not None else np.iinfo(np.int64).min,
+                           end_ms + 1 if end_ms is not None else np.iinfo(np.int64).max)
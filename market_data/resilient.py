@@ -0,0 +1,219 @@
+# resilient.py
+"""
+Resilient fetch layer shared by every Polygon helper.
+
+ResilientClient retries transient failures (429, 5xx, connection errors and timeouts) with
+jittered exponential backoff, honors Retry-After, bounds each call by a deadline and coalesces
+identical in-flight requests, so two workers asking for the same (ticker, range) share one
+call. configure_connection_pool gives the Polygon RESTClient a keep-alive pool sized for the
+worker threads, per-attempt timeouts, and lets the retry layer see each response's status.
+
+A call that still fails raises, instead of turning into an empty value that would be stored
+as if it were real data.
+"""
+import random
+import threading
+import time as time_module
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import certifi
+import urllib3
+from polygon.exceptions import AuthError, BadResponse
+
+from metrics import API_RETRIES
+
+# HTTP statuses worth retrying: rate limited, client closed, and transient server errors
+RETRY_STATUSES = (413, 429, 499, 500, 502, 503, 504)
+
+# Status and headers of the last response seen by this thread, and this thread's call deadline
+_request_state = threading.local()
+
+
+class _ObservedPoolManager(urllib3.PoolManager):
+    """PoolManager that records each response for the retry layer and clamps timeouts to the call deadline."""
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        deadline = getattr(_request_state, 'deadline', None)
+        if deadline is not None:
+            remaining = max(0.1, deadline - time_module.monotonic())
+            timeout = self.connection_pool_kw.get('timeout')
+            if isinstance(timeout, urllib3.Timeout):
+                kw['timeout'] = urllib3.Timeout(connect=min(timeout.connect_timeout, remaining),
+                                                read=min(timeout.read_timeout, remaining))
+        _request_state.status = None
+        _request_state.retry_after = None
+        response = super().urlopen(method, url, redirect=redirect, **kw)
+        _request_state.status = response.status
+        _request_state.retry_after = response.headers.get('Retry-After')
+        return response
+
+
+def configure_connection_pool(rest_client, pool_size, connect_timeout=5.0, read_timeout=30.0):
+    """
+    Replaces a RESTClient's connection pool with a tuned keep-alive pool.
+
+    The pool keeps up to pool_size connections to the API open for reuse (the default keeps one,
+    so concurrent workers keep reconnecting), applies per-attempt timeouts, and leaves retries to
+    ResilientClient.
+
+    Args:
+        rest_client: The polygon RESTClient.
+        pool_size (int): Connections kept alive, normally the number of threads that fetch.
+        connect_timeout (float): Seconds to establish a connection.
+        read_timeout (float): Seconds to wait for a response.
+
+    Returns:
+        The same RESTClient.
+    """
+    rest_client.client = _ObservedPoolManager(
+        num_pools=4,
+        maxsize=max(1, pool_size),
+        block=True,
+        headers=rest_client.headers,
+        ca_certs=certifi.where(),
+        cert_reqs='CERT_REQUIRED',
+        retries=False,
+        timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+    )
+    return rest_client
+
+
+def _retry_after_seconds(value):
+    """Parses a Retry-After header (seconds or an HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_transient(error):
+    """Tells whether a failed request is worth retrying."""
+    if isinstance(error, AuthError):
+        return False
+    if isinstance(error, (urllib3.exceptions.HTTPError, ConnectionError, TimeoutError)):
+        return True
+    status = getattr(_request_state, 'status', None)
+    return status in RETRY_STATUSES
+
+
+def is_not_found(error):
+    """Tells whether a request failed because Polygon has no data for it (404), which no retry changes."""
+    if isinstance(error, BadResponse) and 'NOT_FOUND' in str(error):
+        return True
+    return getattr(_request_state, 'status', None) == 404
+
+
+class _InFlight:
+    """Result of a request shared by the callers waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResilientClient:
+    """
+    Wrapper around a Polygon client that retries, bounds and coalesces requests.
+
+    Wrap it around the RateLimitedClient so every attempt, retries included, takes a token, and
+    under the CachedPolygonClient so only cache misses reach it.
+
+    Args:
+        polygon_client: The client to wrap.
+        max_retries (int): Retries after the first attempt.
+        backoff_base (float): Backoff before the first retry, in seconds; doubles on each retry.
+        backoff_max (float): Upper bound of a single backoff, in seconds.
+        deadline (float): Seconds a call may take across all its attempts and waits.
+    """
+
+    def __init__(self, polygon_client, max_retries=4, backoff_base=0.5, backoff_max=30.0, deadline=60.0):
+        self.polygon_client = polygon_client
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.polygon_client, name)
+
+    def list_aggs(self, *args, **kwargs):
+        endpoint = f"list_aggs/{kwargs.get('timespan', args[2] if len(args) > 2 else '')}"
+        aggs_list = self._coalesced(endpoint, ('list_aggs', args, tuple(sorted(kwargs.items()))),
+                                    lambda: list(self.polygon_client.list_aggs(*args, **kwargs)))
+        return iter(aggs_list)
+
+    def get_daily_open_close_agg(self, *args, **kwargs):
+        return self._coalesced('get_daily_open_close_agg',
+                               ('get_daily_open_close_agg', args, tuple(sorted(kwargs.items()))),
+                               lambda: self.polygon_client.get_daily_open_close_agg(*args, **kwargs))
+
+    def get_grouped_daily_aggs(self, *args, **kwargs):
+        return self._coalesced('get_grouped_daily_aggs',
+                               ('get_grouped_daily_aggs', args, tuple(sorted(kwargs.items()))),
+                               lambda: self.polygon_client.get_grouped_daily_aggs(*args, **kwargs))
+
+    def list_splits(self, *args, **kwargs):
+        splits = self._coalesced('list_splits', ('list_splits', args, tuple(sorted(kwargs.items()))),
+                                 lambda: list(self.polygon_client.list_splits(*args, **kwargs)))
+        return iter(splits)
+
+    def _coalesced(self, endpoint, key, fetch):
+        """Runs fetch, or waits for the identical request that is already in flight and shares its outcome."""
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.result
+
+        try:
+            in_flight.result = self._with_retries(endpoint, fetch)
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
+        return in_flight.result
+
+    def _with_retries(self, endpoint, fetch):
+        deadline = time_module.monotonic() + self.deadline
+        _request_state.deadline = deadline
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return fetch()
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_transient(e):
+                        raise
+                    # Equal jitter: half the exponential step plus a random share of the other half
+                    step = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                    delay = step / 2 + random.uniform(0, step / 2)
+                    retry_after = _retry_after_seconds(getattr(_request_state, 'retry_after', None))
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+                    if time_module.monotonic() + delay > deadline:
+                        raise
+                    API_RETRIES.inc(1, endpoint)
+                    print(f"Retrying {endpoint} in {delay:.1f}s after: {e}")
+                    time_module.sleep(delay)
+                    attempt += 1
+        finally:
+            _request_state.deadline = None
@@ -0,0 +1,155 @@
+# scheduler.py
+"""
+Concurrency helpers for fanning analysis out across tickers and gap days.
+
+A token bucket keeps the combined request rate of all worker threads (or, shared, of all
+batch worker processes) under the Polygon plan's requests-per-minute limit, and
+run_concurrently maps a function over items on a bounded thread pool while preserving input
+order.
+"""
+import contextvars
+import multiprocessing
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import span, API_REQUESTS, API_ERRORS, API_BARS
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at a fixed requests-per-minute rate.
+
+    Args:
+        requests_per_minute (float): Sustained request rate. 0 or None disables limiting.
+        burst (int or None): Maximum tokens that can accumulate; defaults to one second's worth (at least 1).
+    """
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate_per_second = (requests_per_minute or 0) / 60.0
+        self.capacity = burst if burst is not None else max(1.0, self.rate_per_second)
+        self._tokens = self.capacity
+        self._updated = time_module.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        if not self.rate_per_second:
+            return
+        while True:
+            with self._lock:
+                now = time_module.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate_per_second
+            time_module.sleep(wait)
+
+
+class SharedTokenBucket:
+    """
+    Token bucket whose state lives in shared memory, so the worker processes of a batch run draw
+    from one requests-per-minute budget. Create it in the parent process and hand it to the
+    workers when they start.
+
+    Args:
+        requests_per_minute (float): Sustained request rate across all processes. 0 or None disables limiting.
+        burst (int or None): Maximum tokens that can accumulate; defaults to one second's worth (at least 1).
+    """
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate_per_second = (requests_per_minute or 0) / 60.0
+        self.capacity = burst if burst is not None else max(1.0, self.rate_per_second)
+        # [tokens, last refill]; the monotonic clock is system-wide, so processes can share it
+        self._state = multiprocessing.Array('d', [self.capacity, time_module.monotonic()])
+
+    def acquire(self):
+        """Blocks until a token is available and consumes it."""
+        if not self.rate_per_second:
+            return
+        while True:
+            with self._state.get_lock():
+                now = time_module.monotonic()
+                tokens = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate_per_second)
+                self._state[1] = now
+                if tokens >= 1:
+                    self._state[0] = tokens - 1
+                    return
+                self._state[0] = tokens
+                wait = (1 - tokens) / self.rate_per_second
+            time_module.sleep(wait)
+
+
+class RateLimitedClient:
+    """
+    Wrapper around a Polygon RESTClient that takes a token from the bucket before every request.
+
+    list_aggs is materialized inside the wrapper so the request happens under the token that
+    was acquired for it. Every request is counted and timed as a polygon.<endpoint> span. Any
+    other attribute is delegated to the wrapped client.
+    """
+
+    def __init__(self, polygon_client, token_bucket):
+        self.polygon_client = polygon_client
+        self.token_bucket = token_bucket
+
+    def __getattr__(self, name):
+        return getattr(self.polygon_client, name)
+
+    def _request(self, endpoint, fetch):
+        with span('rate_limit_wait'):
+            self.token_bucket.acquire()
+        API_REQUESTS.inc(1, endpoint)
+        try:
+            with span(f'polygon.{endpoint}'):
+                return fetch()
+        except Exception:
+            API_ERRORS.inc(1, endpoint)
+            raise
+
+    def list_aggs(self, *args, **kwargs):
+        endpoint = f"list_aggs/{kwargs.get('timespan', args[2] if len(args) > 2 else '')}"
+        aggs_list = self._request(endpoint, lambda: list(self.polygon_client.list_aggs(*args, **kwargs)))
+        API_BARS.inc(len(aggs_list), endpoint)
+        return iter(aggs_list)
+
+    def get_daily_open_close_agg(self, *args, **kwargs):
+        daily_summary = self._request('get_daily_open_close_agg',
+                                      lambda: self.polygon_client.get_daily_open_close_agg(*args, **kwargs))
+        API_BARS.inc(1, 'get_daily_open_close_agg')
+        return daily_summary
+
+    def get_grouped_daily_aggs(self, *args, **kwargs):
+        grouped_aggs = self._request('get_grouped_daily_aggs',
+                                     lambda: self.polygon_client.get_grouped_daily_aggs(*args, **kwargs))
+        API_BARS.inc(len(grouped_aggs), 'get_grouped_daily_aggs')
+        return grouped_aggs
+
+    def list_splits(self, *args, **kwargs):
+        splits = self._request('list_splits', lambda: list(self.polygon_client.list_splits(*args, **kwargs)))
+        return iter(splits)
+
+
+def run_concurrently(func, items, max_workers):
+    """
+    Applies func to every item on a bounded thread pool.
+
+    Each item runs in a copy of the caller's context, so request-scoped state such as the
+    request's timing breakdown follows the work into the pool.
+
+    Args:
+        func (callable): The function to apply.
+        items (iterable): The inputs.
+        max_workers (int): Pool size. 1 or less runs serially in the calling thread.
+
+    Returns:
+        list: The results in the same order as items.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
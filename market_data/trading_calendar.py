@@ -0,0 +1,313 @@
+# trading_calendar.py
+"""
+NYSE trading calendar with precomputed session boundaries.
+
+Holidays (with their weekend observance rules), 13:00 early closes and the session boundaries
+of every day are computed once per year as epoch milliseconds, DST included, so fetchers and
+analyzers look boundaries up instead of localizing datetimes on every call. Bar timestamps are
+converted to local dates and minutes in bulk with NumPy instead of one datetime per bar.
+pandas is only imported when a year's table is first built.
+"""
+import functools
+from datetime import date, timedelta
+
+import numpy as np
+import pytz
+
+est_timezone = pytz.timezone('America/New_York')
+
+# Session boundaries as minutes after local midnight; early closes end the regular session at 13:00
+# and after hours at 17:00
+PREMARKET_START_MINUTE = 4 * 60
+MARKET_OPEN_MINUTE = 9 * 60 + 30
+FIRST_30_MIN_END_MINUTE = 10 * 60
+MARKET_CLOSE_MINUTE = 16 * 60
+AFTERHOURS_END_MINUTE = 20 * 60
+EARLY_CLOSE_MINUTE = 13 * 60
+EARLY_AFTERHOURS_END_MINUTE = 17 * 60
+
+BOUNDARY_NAMES = ('premarket_start', 'market_open', 'first_30_min_end', 'market_close', 'afterhours_end')
+
+# Unscheduled full-day closures
+SPECIAL_CLOSURES = {
+    date(2012, 10, 29), date(2012, 10, 30),  # Hurricane Sandy
+    date(2018, 12, 5),  # President George H. W. Bush
+    date(2025, 1, 9),  # President Jimmy Carter
+}
+
+MS_PER_MINUTE = 60_000
+
+
+def _easter(year):
+    """Returns Easter Sunday of a year (anonymous Gregorian algorithm)."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    """Returns the n-th (1-based; -1 for the last) given weekday of a month."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(holiday):
+    """Moves a Saturday holiday to Friday and a Sunday holiday to Monday."""
+    if holiday.weekday() == 5:
+        return holiday - timedelta(days=1)
+    if holiday.weekday() == 6:
+        return holiday + timedelta(days=1)
+    return holiday
+
+
+@functools.lru_cache(maxsize=None)
+def nyse_holidays(year):
+    """
+    Returns the full-day NYSE closures of a year.
+
+    Returns:
+        frozenset: The closed weekdays, as dates.
+    """
+    holidays = {
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed(date(year, 7, 4)),  # Independence Day
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)),  # Christmas
+    }
+    # New Year's Day falling on a Saturday is not observed on the Friday before
+    if date(year, 1, 1).weekday() != 5:
+        holidays.add(_observed(date(year, 1, 1)))
+    if year >= 1998:
+        holidays.add(_nth_weekday(year, 1, 0, 3))  # Martin Luther King Jr. Day
+    if year >= 2022:
+        holidays.add(_observed(date(year, 6, 19)))  # Juneteenth
+    holidays.update(d for d in SPECIAL_CLOSURES if d.year == year)
+    return frozenset(holidays)
+
+
+@functools.lru_cache(maxsize=None)
+def nyse_early_closes(year):
+    """
+    Returns the 13:00 early-close days of a year: July 3 and Christmas Eve when they fall
+    Monday to Thursday, and the day after Thanksgiving.
+
+    Returns:
+        frozenset: The early-close dates.
+    """
+    early_closes = {_nth_weekday(year, 11, 3, 4) + timedelta(days=1)}
+    for candidate in (date(year, 7, 3), date(year, 12, 24)):
+        if candidate.weekday() < 4:
+            early_closes.add(candidate)
+    return frozenset(early_closes - nyse_holidays(year))
+
+
+def is_trading_day(day):
+    """Tells whether the exchange holds a session on a date."""
+    return day.weekday() < 5 and day not in nyse_holidays(day.year)
+
+
+def is_early_close(day):
+    """Tells whether a date is a 13:00 early close."""
+    return day in nyse_early_closes(day.year)
+
+
+def previous_trading_day(day):
+    """Returns the last trading day before a date."""
+    previous = day - timedelta(days=1)
+    while not is_trading_day(previous):
+        previous -= timedelta(days=1)
+    return previous
+
+
+def trading_days(start_date, end_date):
+    """Returns the trading days from start_date to end_date inclusive."""
+    days = []
+    current = start_date
+    while current <= end_date:
+        if is_trading_day(current):
+            days.append(current)
+        current += timedelta(days=1)
+    return days
+
+
+@functools.lru_cache(maxsize=None)
+def _year_table(year):
+    """
+    Precomputes every calendar day of a year: local midnight and session boundaries in epoch ms,
+    the trading and early-close flags, and the 'YYYY-MM-DD' labels.
+    """
+    import pandas as pd
+    days = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq='D')
+    trading = np.array([is_trading_day(day.date()) for day in days])
+    early = np.array([is_early_close(day.date()) for day in days])
+
+    def epoch_ms(minutes):
+        # Localize naive wall-clock times, so each day gets its own UTC offset across DST changes
+        local = (days + pd.to_timedelta(minutes, unit='min')).tz_localize(est_timezone)
+        return local.as_unit('ms').asi8
+
+    market_close = np.where(early, EARLY_CLOSE_MINUTE, MARKET_CLOSE_MINUTE)
+    afterhours_end = np.where(early, EARLY_AFTERHOURS_END_MINUTE, AFTERHOURS_END_MINUTE)
+    return {
+        'first_ordinal': date(year, 1, 1).toordinal(),
+        'labels': np.array(days.strftime('%Y-%m-%d'), dtype=object),
+        'trading': trading,
+        'early_close': early,
+        'midnight': epoch_ms(np.zeros(len(days))),
+        'noon': epoch_ms(np.full(len(days), 12 * 60)),
+        'premarket_start': epoch_ms(np.full(len(days), PREMARKET_START_MINUTE)),
+        'market_open': epoch_ms(np.full(len(days), MARKET_OPEN_MINUTE)),
+        'first_30_min_end': epoch_ms(np.full(len(days), FIRST_30_MIN_END_MINUTE)),
+        'market_close': epoch_ms(market_close),
+        'afterhours_end': epoch_ms(afterhours_end),
+    }
+
+
+@functools.lru_cache(maxsize=4096)
+def session_boundaries(date_str):
+    """
+    Looks up the session boundaries of a date.
+
+    Args:
+        date_str (str): The date in 'YYYY-MM-DD' format.
+
+    Returns:
+        dict: Boundary name -> UTC timestamp (ms) for premarket start, market open, end of the first
+              30 minutes, market close and after-hours end, plus 'midnight' (local midnight, ms),
+              'trading_day' and 'early_close'. Early closes end at 13:00 and after hours at 17:00.
+    """
+    day = date.fromisoformat(date_str)
+    table = _year_table(day.year)
+    index = day.toordinal() - table['first_ordinal']
+    boundaries = {name: int(table[name][index]) for name in ('midnight',) + BOUNDARY_NAMES}
+    boundaries['trading_day'] = bool(table['trading'][index])
+    boundaries['early_close'] = bool(table['early_close'][index])
+    return boundaries
+
+
+def next_session_change(timestamp_ms):
+    """
+    Finds the next time a session starts or ends: the premarket start or after-hours end of the
+    current or a following trading day.
+
+    Args:
+        timestamp_ms (int): Epoch milliseconds.
+
+    Returns:
+        tuple: (epoch ms of the change, True if a session is running at timestamp_ms).
+    """
+    day = date.fromisoformat(local_dates([timestamp_ms])[0])
+    while True:
+        boundaries = session_boundaries(day.isoformat())
+        if boundaries['trading_day']:
+            if timestamp_ms < boundaries['premarket_start']:
+                return boundaries['premarket_start'], False
+            if timestamp_ms < boundaries['afterhours_end']:
+                return boundaries['afterhours_end'], True
+        day += timedelta(days=1)
+
+
+def session_table(start_date, end_date, trading_only=True):
+    """
+    Precomputes the session boundaries of a date range in one pass.
+
+    Returns:
+        pd.DataFrame: One row per (trading) day: date, trading_day, early_close, midnight and
+                      the boundary columns in epoch ms.
+    """
+    import pandas as pd
+    frames = []
+    for year in range(start_date.year, end_date.year + 1):
+        table = _year_table(year)
+        frames.append(pd.DataFrame({
+            'date': table['labels'], 'trading_day': table['trading'], 'early_close': table['early_close'],
+            'midnight': table['midnight'], **{name: table[name] for name in BOUNDARY_NAMES}
+        }))
+    sessions = pd.concat(frames, ignore_index=True)
+    sessions = sessions[(sessions['date'] >= start_date.isoformat()) & (sessions['date'] <= end_date.isoformat())]
+    if trading_only:
+        sessions = sessions[sessions['trading_day']]
+    return sessions.reset_index(drop=True)
+
+
+def _utc_year(timestamp_ms):
+    """Returns the UTC calendar year of an epoch ms timestamp."""
+    return int(np.datetime64(int(timestamp_ms), 'ms').astype('datetime64[Y]').astype(np.int64)) + 1970
+
+
+def _day_lookup(timestamps, *fields):
+    """Returns, per timestamp, the given per-day fields of the local day it falls in."""
+    first_year = _utc_year(timestamps.min()) - 1
+    last_year = _utc_year(timestamps.max())
+    tables = [_year_table(year) for year in range(first_year, last_year + 1)]
+    midnights = np.concatenate([table['midnight'] for table in tables])
+    day_index = np.searchsorted(midnights, timestamps, side='right') - 1
+    return [np.concatenate([table[field] for table in tables])[day_index] for field in fields]
+
+
+def local_dates(timestamps_ms):
+    """
+    Converts epoch-ms timestamps to their New York 'YYYY-MM-DD' dates in one vectorized pass.
+
+    Returns:
+        np.ndarray: The date labels (object dtype), aligned with the input.
+    """
+    timestamps = np.asarray(timestamps_ms, dtype=np.int64)
+    if timestamps.size == 0:
+        return np.array([], dtype=object)
+    labels, = _day_lookup(timestamps, 'labels')
+    return labels
+
+
+def local_minutes(timestamps_ms):
+    """
+    Converts epoch-ms timestamps to New York wall-clock minutes after midnight in one vectorized pass.
+
+    Returns:
+        np.ndarray: int64 minutes, aligned with the input.
+    """
+    timestamps = np.asarray(timestamps_ms, dtype=np.int64)
+    if timestamps.size == 0:
+        return np.array([], dtype=np.int64)
+    midnights, noons = _day_lookup(timestamps, 'midnight', 'noon')
+    # DST switches at 02:00: earlier times share midnight's UTC offset, later ones share noon's
+    since_midnight = (timestamps - midnights) // MS_PER_MINUTE
+    from_noon = 12 * 60 + (timestamps - noons) // MS_PER_MINUTE
+    return np.where(since_midnight < 120, since_midnight, from_noon)
+
+
+def format_minute(minute):
+    """Formats minutes after midnight as HH:MM."""
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def format_local_time(timestamp_ms, midnight_ms=None):
+    """
+    Formats an epoch-ms timestamp as HH:MM New York time.
+
+    Args:
+        timestamp_ms (int or None): The timestamp.
+        midnight_ms (int or None): Local midnight of the timestamp's trading day, e.g. from
+                                   session_boundaries (trading days have no DST switch); looked up
+                                   when omitted.
+
+    Returns:
+        str or None: The HH:MM time, or None for a None timestamp.
+    """
+    if timestamp_ms is None:
+        return None
+    if midnight_ms is None:
+        return format_minute(int(local_minutes([timestamp_ms])[0]))
+    return format_minute(int(timestamp_ms - midnight_ms) // MS_PER_MINUTE)
@@ -0,0 +1,192 @@
+# metrics.py
+"""
+In-process timing spans, counters and latency histograms.
+
+Hot-path helpers are wrapped in named spans; every span feeds a latency histogram and, when a
+request has started collecting timings, that request's per-span breakdown. Counters track Polygon
+calls, bars, retries, and bar and result cache hits. render_prometheus formats everything in the Prometheus text
+exposition format for the /metrics endpoint.
+
+Metrics live in the memory of the process that recorded them, so with several gunicorn workers
+each scrape reports the worker that answered it.
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time as time_module
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _label_text(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): HELP text.
+        label_names (tuple): Names of the labels passed to inc, in order.
+    """
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.label_names, label_values)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with optional labels.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): HELP text.
+        label_names (tuple): Names of the labels passed to observe, in order.
+        buckets (tuple): Increasing bucket upper bounds.
+    """
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 2))
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{_label_text(self.label_names, label_values, [('le', le)])}"
+                                 f" {cumulative}")
+                labels = _label_text(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+SPAN_SECONDS = Histogram('gap_up_span_seconds', 'Time spent in instrumented helpers.', ('span',))
+REQUEST_SECONDS = Histogram('gap_up_request_seconds', 'HTTP request latency.', ('endpoint', 'status'))
+API_REQUESTS = Counter('polygon_requests_total', 'Polygon API requests sent.', ('endpoint',))
+API_ERRORS = Counter('polygon_request_errors_total', 'Polygon API requests that raised.', ('endpoint',))
+API_RETRIES = Counter('polygon_retries_total', 'Polygon API requests retried.', ('endpoint',))
+API_BARS = Counter('polygon_bars_total', 'Bars returned by the Polygon API.', ('endpoint',))
+CACHE_DAYS = Counter('bar_cache_days_total', 'Ticker-days looked up in the bar cache.', ('kind', 'result'))
+RESULT_CACHE = Counter('result_cache_lookups_total', 'Analysis result cache lookups (hit, wait or miss).',
+                       ('result',))
+
+REGISTRY = (SPAN_SECONDS, REQUEST_SECONDS, API_REQUESTS, API_ERRORS, API_RETRIES, API_BARS, CACHE_DAYS,
+            RESULT_CACHE)
+
+
+class RequestTimings:
+    """Per-request totals and counts by span name, shared by the threads that serve the request."""
+
+    def __init__(self):
+        self.started = time_module.perf_counter()
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            total, count = self.spans.get(name, (0.0, 0))
+            self.spans[name] = (total + seconds, count + 1)
+
+    def elapsed(self):
+        return time_module.perf_counter() - self.started
+
+    def server_timing(self):
+        """Formats the breakdown as a Server-Timing header value (durations in milliseconds)."""
+        with self._lock:
+            entries = [f"{name};dur={total * 1000:.1f};desc=\"{count}x\"" for name, (total, count) in
+                       sorted(self.spans.items(), key=lambda item: -item[1][0])]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(entries)
+
+
+_current_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request_timings():
+    """Starts collecting a per-span breakdown for the current request and returns it."""
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def stop_request_timings():
+    """Stops collecting and returns the current request's RequestTimings, if any."""
+    timings = _current_timings.get()
+    _current_timings.set(None)
+    return timings
+
+
+@contextmanager
+def span(name):
+    """Times the enclosed block under name."""
+    started = time_module.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time_module.perf_counter() - started
+        SPAN_SECONDS.observe(elapsed, name)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+
+
+def timed(name):
+    """Decorator form of span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_prometheus():
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'